@@ -1,26 +1,42 @@
 """
 Export earthquake prediction model to JavaScript
 This script creates JavaScript files that can be used directly in JS projects.
+
+export_compact_models() also exports the KMeans centroids and the cluster
+RandomForest: the trees are flattened into typed arrays (see
+forest_arrays.py) and written with the linear coefficients to one binary
+file, earthquake_models.bin, which the small evaluator in
+earthquake_models.js wraps in typed arrays without parsing.
 """
 
 import joblib
 import json
+import os
+import sys
+import gzip
+
+TRAINING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model training stuff")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FREQUENCY_INFO = os.path.join(ROOT, "frequency_model_info.json")
 
-def export_model_to_javascript():
+def export_model_to_javascript(info_path=FREQUENCY_INFO, out_dir="."):
     """Export the trained model as JavaScript functions"""
     
     # Load model info
     try:
-        with open("model_info.json", 'r') as f:
+        with open(info_path, 'r') as f:
             model_info = json.load(f)
     except FileNotFoundError:
-        print("❌ Error: model_info.json not found. Run model_training.py first.")
+        print(f"❌ Error: {info_path} not found. Run model_training.py first.")
         return
     
     # Extract coefficients
     intercept = model_info['model_coefficients']['intercept']
     slope = model_info['model_coefficients']['slope']
-    r2_score = model_info['performance_metrics']['r2_score']
+    # the shipped frequency_model_info.json carries no metrics
+    r2_score = model_info.get('performance_metrics', {}).get('r2_score')
+    r2_text = f"{r2_score:.4f}" if r2_score is not None else "n/a"
+    r2_js = r2_score if r2_score is not None else "null"
     
     # Create JavaScript module
     js_code = f'''/**
@@ -28,8 +44,8 @@ def export_model_to_javascript():
  * Exported from Python scikit-learn LinearRegression
  * 
  * Model Performance:
- * - R² Score: {r2_score:.4f}
- * - Training Date: {model_info['training_date']}
+ * - R² Score: {r2_text}
+ * - Training Date: {model_info.get('training_date', 'n/a')}
  * 
  * Model Equation: earthquakes = {slope:.4f} * year + ({intercept:.4f})
  */
@@ -38,7 +54,7 @@ class EarthquakePredictionModel {{
     constructor() {{
         this.intercept = {intercept};
         this.slope = {slope};
-        this.r2Score = {r2_score};
+        this.r2Score = {r2_js};
         this.modelInfo = {json.dumps(model_info, indent=2)};
     }}
     
@@ -88,7 +104,7 @@ class EarthquakePredictionModel {{
             r2Score: this.r2Score,
             equation: `earthquakes = ${{this.slope.toFixed(2)}} × year + ${{this.intercept.toFixed(2)}}`,
             interpretation: `Earthquake frequency increases by ~${{Math.round(this.slope)}} events per year`,
-            varianceExplained: `${{(this.r2Score * 100).toFixed(1)}}%`,
+            varianceExplained: this.r2Score === null ? 'n/a' : `${{(this.r2Score * 100).toFixed(1)}}%`,
             fullInfo: this.modelInfo
         }};
     }}
@@ -146,7 +162,7 @@ console.log('Model info:', info);
 '''
     
     # Write JavaScript file
-    with open("earthquake_model.js", "w") as f:
+    with open(os.path.join(out_dir, "earthquake_model.js"), "w") as f:
         f.write(js_code)
     
     # Create a simple HTML demo
@@ -285,7 +301,7 @@ console.log('Model info:', info);
 </body>
 </html>'''
     
-    with open("earthquake_demo.html", "w") as f:
+    with open(os.path.join(out_dir, "earthquake_demo.html"), "w") as f:
         f.write(html_demo)
     
     # Create a Node.js example
@@ -325,7 +341,7 @@ rangePreds.forEach(pred => {
 });
 '''
     
-    with open("nodejs_example.js", "w") as f:
+    with open(os.path.join(out_dir, "nodejs_example.js"), "w") as f:
         f.write(nodejs_example)
     
     print("✓ JavaScript files created successfully!")
@@ -337,7 +353,185 @@ rangePreds.forEach(pred => {
     print(f"\nModel coefficients exported:")
     print(f"- Intercept: {intercept:.4f}")
     print(f"- Slope: {slope:.4f}")
-    print(f"- R² Score: {r2_score:.4f}")
+    print(f"- R² Score: {r2_text}")
+
+
+EVALUATOR_JS = r"""/**
+ * Earthquake cluster models (compact export)
+ * Loads earthquake_models.bin written by export_to_js.export_compact_models:
+ * KMeans centroids, the cluster RandomForest as flattened node arrays and the
+ * linear frequency model. The arrays are views on the file's buffer.
+ */
+
+const ARRAY_TYPES = {
+    '<f8': Float64Array, '<f4': Float32Array, '<i4': Int32Array, '<u4': Uint32Array,
+    '<i2': Int16Array, '<u2': Uint16Array, '|u1': Uint8Array, '|i1': Int8Array
+};
+
+/** Round half to even, like np.rint and Python's round (Math.round rounds halves up). */
+function roundHalfEven(x) {
+    const r = Math.round(x);
+    return r - x === 0.5 && r % 2 !== 0 ? r - 1 : r;
+}
+
+class EarthquakeModels {
+    /**
+     * @param {ArrayBuffer} buffer - Contents of earthquake_models.bin
+     */
+    constructor(buffer) {
+        const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+        if (magic !== 'EQAR') throw new Error('Not an earthquake model file');
+        const length = new DataView(buffer).getUint32(4, true);
+        this.header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, length)));
+        const base = 8 + length;
+        this.arrays = {};
+        for (const [name, entry] of Object.entries(this.header.arrays)) {
+            const count = entry.shape.reduce((a, b) => a * b, 1);
+            this.arrays[name] = new ARRAY_TYPES[entry.dtype](buffer, base + entry.offset, count);
+        }
+        this.nClusters = this.header.n_clusters;
+        this.nTrees = this.arrays.tree_offsets.length - 1;
+    }
+
+    /** Fetch and load the model file in the browser. */
+    static async load(url = 'earthquake_models.bin') {
+        const response = await fetch(url);
+        return new EarthquakeModels(await response.arrayBuffer());
+    }
+
+    /** Load the model file in Node.js. */
+    static loadFile(path) {
+        const data = require('fs').readFileSync(path);
+        return new EarthquakeModels(data.buffer.slice(data.byteOffset, data.byteOffset + data.byteLength));
+    }
+
+    /** Index of the nearest KMeans centroid. */
+    assignCluster(lat, lon) {
+        const centers = this.arrays.centers;
+        let best = 0, bestDistance = Infinity;
+        for (let c = 0; c < this.nClusters; c++) {
+            const dLat = lat - centers[2 * c], dLon = lon - centers[2 * c + 1];
+            const distance = dLat * dLat + dLon * dLon;
+            if (distance < bestDistance) { bestDistance = distance; best = c; }
+        }
+        return best;
+    }
+
+    /**
+     * Feature row from three consecutive years of per-cluster counts, oldest first.
+     * @param {number[][]} counts - [[...n_clusters], [...], [...]]
+     */
+    buildFeatures(counts) {
+        const totals = counts.map(row => row.reduce((a, b) => a + b, 0));
+        return [...counts[2], ...counts[1], ...counts[0],
+                totals[1], (totals[0] + totals[1] + totals[2]) / 3];
+    }
+
+    /** Forest prediction for one feature row (mean over trees, like sklearn). */
+    predictFeatures(row) {
+        const { tree_offsets: offsets, right, feature, threshold, leaf_value: leaves } = this.arrays;
+        const x = Float32Array.from(row);  // sklearn compares float32 features
+        let sum = 0;
+        for (let t = 0; t < this.nTrees; t++) {
+            let node = offsets[t];
+            while (right[node] >= 0) {
+                node = x[feature[node]] <= threshold[node] ? node + 1 : right[node];
+            }
+            sum += leaves[~right[node]];
+        }
+        return sum / this.nTrees;
+    }
+
+    /** Next year's total from three years of per-cluster counts. */
+    predictFromCounts(counts) {
+        return this.predictFeatures(this.buildFeatures(counts));
+    }
+
+    /** Split a total over clusters in proportion to weights (largest remainder). */
+    allocate(total, weights) {
+        total = Math.max(roundHalfEven(total), 0);
+        let sum = weights.reduce((a, b) => a + b, 0);
+        if (sum <= 0) { weights = weights.map(() => 1); sum = weights.length; }
+        const exact = weights.map(w => total * w / sum);
+        const shares = exact.map(Math.floor);
+        let left = total - shares.reduce((a, b) => a + b, 0);
+        const order = exact.map((e, i) => [shares[i] - e, i]).sort((a, b) => a[0] - b[0]);
+        for (let i = 0; i < left; i++) shares[order[i][1]] += 1;
+        return shares;
+    }
+
+    /** Linear frequency model, same rounding as EarthquakePredictionModel. */
+    predictYear(year) {
+        const { slope, intercept } = this.header.frequency;
+        return Math.max(0, roundHalfEven(slope * year + intercept));
+    }
+}
+
+if (typeof module !== 'undefined' && module.exports) {
+    module.exports = EarthquakeModels;
+}
+if (typeof window !== 'undefined') {
+    window.EarthquakeModels = EarthquakeModels;
+}
+"""
+
+def export_compact_models(cluster_model_path, kmeans_path, frequency_info_path, cluster_info_path, out_dir="."):
+    """Write earthquake_models.bin and earthquake_models.js and report their size.
+
+    test_forest_arrays.py checks both evaluators against sklearn.
+    """
+    import numpy as np
+    if TRAINING_DIR not in sys.path:
+        sys.path.insert(0, TRAINING_DIR)
+    import forest_arrays
+
+    model = joblib.load(cluster_model_path)
+    kmeans = joblib.load(kmeans_path)
+    with open(frequency_info_path, 'r') as f:
+        coeffs = json.load(f)['model_coefficients']
+    with open(cluster_info_path, 'r') as f:
+        cluster_info = json.load(f)
+
+    arrays = forest_arrays.flatten_forest(model)
+    arrays["centers"] = np.asarray(kmeans.cluster_centers_, dtype=np.float64)
+    header = {
+        "format": 1,
+        "n_clusters": int(cluster_info["n_clusters"]),
+        "features": cluster_info["features"],
+        "frequency": {"slope": float(coeffs["slope"]), "intercept": float(coeffs["intercept"])},
+    }
+    bin_path = os.path.join(out_dir, "earthquake_models.bin")
+    js_path = os.path.join(out_dir, "earthquake_models.js")
+    forest_arrays.write_arrays(bin_path, arrays, header)
+    with open(js_path, "w") as f:
+        f.write(EVALUATOR_JS)
+
+    with open(bin_path, "rb") as f:
+        compressed = len(gzip.compress(f.read()))
+    print(f"✓ Compact models written to {bin_path}")
+    print("\nSize report:")
+    for name, array in arrays.items():
+        print(f"  {name:14s} {str(array.dtype):8s} {array.size:8d} values {array.nbytes / 1024:9.1f} KB")
+    print(f"  {'total':14s} {os.path.getsize(bin_path) / 1024:35.1f} KB "
+          f"({compressed / 1024:.1f} KB gzipped)")
+    print(f"  evaluator      {os.path.getsize(js_path) / 1024:35.1f} KB")
+    pickles = os.path.getsize(cluster_model_path) + os.path.getsize(kmeans_path)
+    print(f"  pickles        {pickles / 1024:35.1f} KB")
+    return bin_path, js_path
+
 
 if __name__ == "__main__":
-    export_model_to_javascript()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--compact", action="store_true",
+                        help="also export the KMeans centroids and cluster RandomForest")
+    parser.add_argument("--info", default=FREQUENCY_INFO, help="linear frequency model info")
+    parser.add_argument("--cluster-model", default=os.path.join(ROOT, "earthquake_cluster_model_rf.pkl"))
+    parser.add_argument("--cluster-info", default=os.path.join(ROOT, "model_info.json"))
+    parser.add_argument("--kmeans", default=os.path.join(ROOT, "models", "model training stuff", "kmeans_model.pkl"))
+    parser.add_argument("--out-dir", default=".")
+    args = parser.parse_args()
+
+    export_model_to_javascript(args.info, args.out_dir)
+    if args.compact:
+        export_compact_models(args.cluster_model, args.kmeans, args.info, args.cluster_info, args.out_dir)
@@ -0,0 +1,175 @@
+"""Frequency cube over the cleaned catalog.
+
+One pass over the store counts events per (year, month, day, cluster, grid
+cell, magnitude bin), the finest grain any dashboard asks for. That base cube
+is saved to catalog/cube.parquet and every coarser question (per-month and
+per-cluster counts, yearly counts per grid cell, ...) is a group-by over the
+cube instead of another scan of the events.
+"""
+from imports import pd
+import os
+import json
+import numpy as np
+import joblib
+import catalog_store
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+CUBE_FILE = os.path.join(catalog_store.STORE_DIR, "cube.parquet")
+CUBE_INFO_FILE = os.path.join(catalog_store.STORE_DIR, "cube.json")
+
+GRID_DEGREES = 5.0
+MAG_BINS = [3.5, 4.0, 4.5, 5.0, 5.5, 6.0, 7.0]
+
+DIMENSIONS = ["year", "month", "day", "cluster", "cell", "mag_bin"]
+TIME_LEVELS = {"year": ["year"], "month": ["year", "month"], "day": ["year", "month", "day"]}
+
+# bit widths used to pack one row's keys into a single int64
+_BITS = {"year": 12, "month": 4, "day": 5, "cluster": 8, "cell": 20, "mag_bin": 4}
+
+
+def grid_cell(lat, lon, degrees=GRID_DEGREES):
+    """Row-major id of the lat/lon grid cell containing each point."""
+    n_rows, n_cols = int(np.ceil(180 / degrees)), int(np.ceil(360 / degrees))
+    row = np.clip(((lat + 90) // degrees).astype(np.int64), 0, n_rows - 1)
+    col = np.clip(((lon + 180) // degrees).astype(np.int64), 0, n_cols - 1)
+    return row * n_cols + col
+
+
+def cell_bounds(cell, degrees=GRID_DEGREES):
+    """(min_lat, min_lon) corner of grid cells."""
+    n_cols = int(np.ceil(360 / degrees))
+    return (np.asarray(cell) // n_cols) * degrees - 90, (np.asarray(cell) % n_cols) * degrees - 180
+
+
+def _pack(keys):
+    packed = np.zeros(len(keys["year"]), dtype=np.int64)
+    for name in DIMENSIONS:
+        packed = (packed << _BITS[name]) | keys[name].astype(np.int64)
+    return packed
+
+
+def _unpack(packed):
+    keys = {}
+    for name in reversed(DIMENSIONS):
+        keys[name] = packed & ((1 << _BITS[name]) - 1)
+        packed = packed >> _BITS[name]
+    return keys
+
+
+def _batches(chunksize):
+    if catalog_store.store_exists():
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(catalog_store.EVENTS_DIR, format="parquet", partitioning="hive")
+        columns = ["latitude", "longitude", "magnitudo", "date"]
+        columns += [c for c in ("month", "day") if c in dataset.schema.names]
+        for batch in dataset.to_batches(columns=columns, batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+    # training.csv only knows the year
+    reader = pd.read_csv(get_absolute_path("training.csv"),
+                         usecols=["latitude", "longitude", "magnitudo", "date"], chunksize=chunksize)
+    with reader:
+        yield from reader
+
+
+def build_cube(grid_degrees=GRID_DEGREES, mag_bins=MAG_BINS, kmeans_path=None, chunksize=1_000_000):
+    """Count events per base-cube cell in a single pass and save the cube."""
+    if np.ceil(180 / grid_degrees) * np.ceil(360 / grid_degrees) >= 1 << _BITS["cell"]:
+        raise ValueError(f"grid of {grid_degrees} degrees has too many cells for the cube")
+    if len(mag_bins) >= 1 << _BITS["mag_bin"]:
+        raise ValueError("too many magnitude bins for the cube")
+
+    kmeans_path = kmeans_path or get_absolute_path("kmeans_model.pkl")
+    centers = None
+    if os.path.exists(kmeans_path):
+        centers = np.asarray(joblib.load(kmeans_path).cluster_centers_, dtype=np.float64)
+
+    partial = []
+    for frame in _batches(chunksize):
+        frame = frame.dropna(subset=["latitude", "longitude", "magnitudo", "date"])
+        lat = frame["latitude"].to_numpy(dtype=np.float64)
+        lon = frame["longitude"].to_numpy(dtype=np.float64)
+
+        if centers is not None:
+            coords = np.column_stack([lat, lon])
+            # stored as cluster + 1 so 0 can mean "no clustering"
+            cluster = ((coords[:, None, :] - centers[None]) ** 2).sum(axis=-1).argmin(axis=1) + 1
+        else:
+            cluster = np.zeros(len(frame), dtype=np.int64)
+
+        keys = {
+            "year": frame["date"].to_numpy(dtype=np.int64),
+            "month": frame["month"].to_numpy(dtype=np.int64) if "month" in frame else np.zeros(len(frame), np.int64),
+            "day": frame["day"].to_numpy(dtype=np.int64) if "day" in frame else np.zeros(len(frame), np.int64),
+            "cluster": cluster,
+            "cell": grid_cell(lat, lon, grid_degrees),
+            "mag_bin": np.digitize(frame["magnitudo"].to_numpy(dtype=np.float64), mag_bins),
+        }
+        packed, counts = np.unique(_pack(keys), return_counts=True)
+        partial.append(pd.DataFrame({"key": packed, "count": counts}))
+
+    merged = pd.concat(partial).groupby("key", sort=True)["count"].sum()
+    keys = _unpack(merged.index.to_numpy())
+    cube = pd.DataFrame({name: keys[name].astype(np.int32) for name in DIMENSIONS})
+    cube["cluster"] -= 1
+    cube["count"] = merged.to_numpy()
+
+    os.makedirs(catalog_store.STORE_DIR, exist_ok=True)
+    cube.to_parquet(CUBE_FILE, engine="pyarrow", compression="zstd", index=False)
+    with open(CUBE_INFO_FILE, "w") as f:
+        json.dump({"grid_degrees": grid_degrees, "mag_bins": list(mag_bins),
+                   "clustered": centers is not None}, f, indent=2)
+    print(f"✓ Built cube with {len(cube)} cells from {int(cube['count'].sum())} events")
+    return cube
+
+
+class FrequencyCube:
+    """Slice the precomputed cube; each distinct rollup is computed once."""
+
+    def __init__(self, cube=None):
+        self.cube = cube if cube is not None else pd.read_parquet(CUBE_FILE, engine="pyarrow")
+        with open(CUBE_INFO_FILE, "r") as f:
+            self.info = json.load(f)
+        self._rollups = {}
+
+    def rollup(self, time="year", by=()):
+        """Counts per time bucket and the extra dimensions in `by`.
+
+        time is "year", "month", "day" or None; by can hold "cluster", "cell"
+        and "mag_bin".
+        """
+        keys = (TIME_LEVELS[time] if time else []) + list(by)
+        cache_key = tuple(keys)
+        if cache_key not in self._rollups:
+            if keys:
+                self._rollups[cache_key] = self.cube.groupby(keys, sort=True)["count"].sum()
+            else:
+                self._rollups[cache_key] = pd.Series([self.cube["count"].sum()], name="count")
+        return self._rollups[cache_key]
+
+    def query(self, time="year", by=(), **where):
+        """Rollup restricted to the given values, e.g. query("month", ["cluster"], year=2020).
+
+        Filters take a single value or a list of values per dimension.
+        """
+        cube = self.cube
+        for name, value in where.items():
+            values = value if isinstance(value, (list, tuple, set, range)) else [value]
+            cube = cube[cube[name].isin(list(values))]
+        keys = (TIME_LEVELS[time] if time else []) + list(by)
+        return cube.groupby(keys, sort=True)["count"].sum() if keys else cube["count"].sum()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grid", type=float, default=GRID_DEGREES, help="grid cell size in degrees")
+    args = parser.parse_args()
+
+    cube = FrequencyCube(build_cube(grid_degrees=args.grid))
+    print("\nEvents per year and cluster (last 5 rows):")
+    print(cube.rollup("year", ["cluster"]).unstack(fill_value=0).tail())
@@ -0,0 +1,204 @@
+"""Rolling-origin backtest of the frequency and cluster models.
+
+Every origin year replays what was known at the end of that year: each model
+is fitted on the years up to the origin only and scored on the year after.
+
+- the frequency LinearRegression (yearly counts) is refitted incrementally:
+  an ordinary least squares line only needs the running sums of 1, x, y,
+  x² and xy, so one cumulative sum over the years gives the fit of every
+  origin at once, with no refits;
+- the cluster RandomForest (model_training.build_features rows) cannot take
+  new rows into trees that are already grown, and warm_start only adds trees,
+  so every origin gets a fresh fit. The lag features are built once, sent
+  to each worker of a process pool once, and the origins are fitted in
+  parallel, one single-threaded forest per task.
+
+The cluster backtest is not fully out of sample: the cluster labels come from
+the one KMeans model fitted on the whole catalog, so the features of an early
+origin are counted over centroids placed with events from later years. Only
+the forest is refitted per origin. Its errors are a lower bound, and each row
+of backtest_clusters.csv records the last catalog year the labels were fitted
+on as kmeans_through.
+
+The per-origin tables (origin, target year, actual, predicted and errors) go
+to backtest_frequency.csv and backtest_clusters.csv; backtest() also returns
+MAE / RMSE / MAPE / bias per model.
+"""
+from imports import pd
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from catalog_store import load_frequency
+import instrumentation
+from model_training import N_CLUSTERS, RF_PARAMS, event_clusters, cluster_year_counts, build_features
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+# fewest training years an origin is scored with
+MIN_TRAIN = 3
+
+
+def error_table(origins, actual, predicted, **extra):
+    """Per-origin errors; pct_error is NaN where the actual count is zero."""
+    actual = np.asarray(actual, dtype=np.float64)
+    predicted = np.asarray(predicted, dtype=np.float64)
+    error = predicted - actual
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct_error = np.where(actual != 0, 100 * error / actual, np.nan)
+    return pd.DataFrame({"origin": np.asarray(origins, dtype=np.int64),
+                         "target_year": np.asarray(origins, dtype=np.int64) + 1,
+                         "actual": actual, "predicted": predicted, "error": error,
+                         "abs_error": np.abs(error), "pct_error": pct_error, **extra})
+
+
+def summarize(table):
+    if table.empty:
+        return {"origins": 0}
+    summary = {
+        "origins": len(table),
+        "first_origin": int(table["origin"].min()),
+        "last_origin": int(table["origin"].max()),
+        "mae": float(table["abs_error"].mean()),
+        "rmse": float(np.sqrt((table["error"] ** 2).mean())),
+        "mape": float(table["pct_error"].abs().mean()),
+        "bias": float(table["error"].mean()),
+    }
+    if "kmeans_through" in table.columns:
+        summary["kmeans_through"] = int(table["kmeans_through"].max())
+    return summary
+
+
+def _origins(available, start=None, end=None):
+    origins = np.asarray(available, dtype=np.int64)
+    if start is not None:
+        origins = origins[origins >= start]
+    if end is not None:
+        origins = origins[origins <= end]
+    return origins
+
+
+@instrumentation.stage("backtest.frequency")
+def backtest_frequency(freq=None, start=None, end=None, min_train=MIN_TRAIN):
+    """One-year-ahead errors of the yearly-count line refitted at every origin.
+
+    The fit at origin o uses every year <= o; years are centred on the first
+    one so the running sums stay well conditioned.
+    """
+    freq = load_frequency() if freq is None else freq
+    freq = freq.dropna(subset=["date", "count"]).sort_values("date")
+    years = freq["date"].to_numpy(dtype=np.int64)
+    counts = freq["count"].to_numpy(dtype=np.float64)
+    x = (years - years[0]).astype(np.float64)
+
+    n = np.arange(1, len(x) + 1, dtype=np.float64)
+    sx, sy = np.cumsum(x), np.cumsum(counts)
+    sxx, sxy = np.cumsum(x * x), np.cumsum(x * counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+    intercept = (sy - slope * sx) / n
+
+    # row i is an origin when the table has the year after it to score against
+    scored = np.flatnonzero((n[:-1] >= max(min_train, 2)) & (years[1:] == years[:-1] + 1))
+    scored = scored[np.isin(years[scored], _origins(years, start, end))]
+    instrumentation.rows("origins", len(years), len(scored))
+    predicted = intercept[scored] + slope[scored] * (x[scored] + 1)
+    return error_table(years[scored], counts[scored + 1], predicted,
+                       n_train=n[scored].astype(np.int64), slope=slope[scored], intercept=intercept[scored])
+
+
+_worker = {}
+
+
+def _init_worker(X, y, years, params):
+    _worker.update(X=X, y=y, years=years, params=params)
+
+
+def _fit_origin(origin):
+    """Forest fitted on the rows whose target year is <= origin, predicting origin + 1."""
+    X, y, years = _worker["X"], _worker["y"], _worker["years"]
+    train = years < origin
+    model = RandomForestRegressor(n_jobs=1, **_worker["params"]).fit(X[train], y[train])
+    return float(model.predict(X[years == origin])[0]), int(train.sum())
+
+
+@instrumentation.stage("backtest.clusters")
+def backtest_clusters(counts=None, start=None, end=None, params=None, workers=None,
+                      min_train=MIN_TRAIN, n_clusters=N_CLUSTERS, kmeans_path=None):
+    """One-year-ahead errors of the cluster RandomForest refitted at every origin.
+
+    The feature row of year t predicts the total of t + 1, so origin o trains
+    on rows t < o and is scored on row o. The cluster labels are not refitted
+    per origin (see the module docstring); kmeans_through is the last year of
+    `counts`, which the labels were assigned over.
+    """
+    if counts is None:
+        counts = cluster_year_counts(*event_clusters(n_clusters, kmeans_path), n_clusters)
+    X, y = build_features(counts)
+    years = X.index.to_numpy(dtype=np.int64)
+    params = {**RF_PARAMS, **(params or {})}
+    kmeans_through = int(counts.index.max())
+
+    origins = _origins(years[min_train:], start, end)
+    instrumentation.rows("origins", len(years), len(origins))
+    if not len(origins):
+        return error_table([], [], [], n_train=np.empty(0, dtype=np.int64),
+                           kmeans_through=np.empty(0, dtype=np.int64))
+    if origins.min() < kmeans_through:
+        print(f"⚠️  Cluster labels come from KMeans fitted through {kmeans_through}; "
+              f"origins before that see later centroids")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(X.to_numpy(dtype=np.float64), y.to_numpy(dtype=np.float64),
+                                       years, params)) as pool:
+        results = list(pool.map(_fit_origin, origins.tolist()))
+    predicted, n_train = zip(*results)
+    return error_table(origins, y.loc[origins].to_numpy(), predicted, n_train=np.array(n_train),
+                       kmeans_through=np.full(len(origins), kmeans_through, dtype=np.int64))
+
+
+def backtest(start=None, end=None, params=None, workers=None, out_dir=None, n_clusters=N_CLUSTERS,
+             kmeans_path=None):
+    """Backtest both models and save their per-origin tables; returns (tables, summaries)."""
+    out_dir = out_dir or get_absolute_path("")
+    tables = {
+        "frequency": backtest_frequency(start=start, end=end),
+        "clusters": backtest_clusters(start=start, end=end, params=params, workers=workers,
+                                      n_clusters=n_clusters, kmeans_path=kmeans_path),
+    }
+    summaries = {}
+    for name, table in tables.items():
+        path = os.path.join(out_dir, f"backtest_{name}.csv")
+        table.to_csv(path, index=False)
+        summaries[name] = summarize(table)
+        print(f"✓ Saved the {name} backtest ({len(table)} origins) to {path}")
+    return tables, summaries
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start", type=int, default=None, help="first origin year")
+    parser.add_argument("--end", type=int, default=None, help="last origin year")
+    parser.add_argument("--workers", type=int, default=None, help="processes for the forest refits")
+    parser.add_argument("--n-estimators", type=int, default=None, help="trees per refit (default: as trained)")
+    parser.add_argument("--n-clusters", type=int, default=N_CLUSTERS)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    params = {"n_estimators": args.n_estimators} if args.n_estimators else None
+    tables, summaries = backtest(args.start, args.end, params, args.workers, n_clusters=args.n_clusters)
+    for name, table in tables.items():
+        summary = summaries[name]
+        print(f"\n{name.capitalize()} model, {summary['origins']} origins:")
+        if summary["origins"]:
+            print(f"  MAE: {summary['mae']:,.1f}  RMSE: {summary['rmse']:,.1f}  "
+                  f"MAPE: {summary['mape']:.1f}%  bias: {summary['bias']:+,.1f}")
+            if "kmeans_through" in summary:
+                print(f"  Cluster labels fitted through {summary['kmeans_through']}, not per origin")
+            print(table[["origin", "target_year", "actual", "predicted", "error", "pct_error"]]
+                  .to_string(index=False, float_format=lambda v: f"{v:,.1f}"))
+    print(f"\n✓ Backtest finished in {time.perf_counter() - started:.1f}s")
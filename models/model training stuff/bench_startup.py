@@ -0,0 +1,81 @@
+"""Startup-time benchmark for the prediction models.
+
+Each measurement runs in a fresh interpreter so import costs are included:
+construct the model, then make the first prediction.
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SNIPPETS = {
+    "frequency": (
+        "m = predict_earthquakes.EarthquakePredictionModel(model_path={model!r}, info_path={info!r}, lazy={lazy})\n"
+        "m.predict_single_year(2030)"
+    ),
+    "cluster": (
+        "m = predict_earthquakes.ClusterPredictionModel(model_path={model!r}, info_path={info!r}, lazy={lazy})\n"
+        "m.predict([[[100] * m.n_clusters] * 3])"
+    ),
+}
+
+TEMPLATE = """
+import time, contextlib, io
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import predict_earthquakes
+    {body}
+    ready = time.perf_counter()
+    {predict}
+done = time.perf_counter()
+print((ready - start) * 1000, (done - start) * 1000)
+"""
+
+
+def run_once(kind, model, info, lazy):
+    construct, predict = SNIPPETS[kind].format(model=model, info=info, lazy=lazy).split("\n")
+    code = TEMPLATE.format(body=construct, predict=predict)
+    out = subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True,
+                         capture_output=True, text=True).stdout.split()
+    return float(out[0]), float(out[1])
+
+
+def benchmark(kind, model, info, repeats=7):
+    results = {}
+    for lazy in (False, True):
+        runs = [run_once(kind, model, info, lazy) for _ in range(repeats)]
+        results["lazy" if lazy else "eager"] = {
+            "construct_ms": statistics.median(r[0] for r in runs),
+            "first_prediction_ms": statistics.median(r[1] for r in runs),
+        }
+    return results
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frequency-model", default=os.path.join(HERE, "..", "..", "earthquake_frequency_model.pkl"))
+    parser.add_argument("--frequency-info", default=os.path.join(HERE, "..", "..", "frequency_model_info.json"))
+    parser.add_argument("--cluster-model", default=os.path.join(HERE, "..", "..", "earthquake_cluster_model_rf.pkl"))
+    parser.add_argument("--cluster-info", default=os.path.join(HERE, "..", "..", "model_info.json"))
+    parser.add_argument("--repeats", type=int, default=7)
+    args = parser.parse_args()
+
+    report = {
+        "frequency": benchmark("frequency", os.path.abspath(args.frequency_model),
+                               os.path.abspath(args.frequency_info), args.repeats),
+        "cluster": benchmark("cluster", os.path.abspath(args.cluster_model),
+                             os.path.abspath(args.cluster_info), args.repeats),
+    }
+    for kind, modes in report.items():
+        print(f"{kind} model:")
+        for mode, timing in modes.items():
+            print(f"  {mode:5s}  construct {timing['construct_ms']:7.1f} ms   "
+                  f"first prediction {timing['first_prediction_ms']:7.1f} ms")
+    return report
+
+
+if __name__ == "__main__":
+    main()
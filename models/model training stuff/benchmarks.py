@@ -0,0 +1,244 @@
+"""Benchmark suite for the ingest, clustering, training and prediction hot paths.
+
+A synthetic earthquakes.csv with the USGS export schema is generated into a
+scratch copy of these scripts, then every stage runs in its own child process
+so its wall time and peak RSS are measured in isolation. Results are written
+as JSON; with --baseline the run is compared against an earlier result file
+and regressions beyond the tolerance are flagged (exit status 1).
+
+    python benchmarks.py --events 100000 --out bench.json
+    python benchmarks.py --events 100000 --baseline bench.json
+"""
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+
+
+USGS_COLUMNS = ["time", "place", "status", "tsunami", "significance", "data_type", "magnitudo",
+                "state", "longitude", "latitude", "depth", "date"]
+
+
+def generate_catalog(path, n_events, seed=0, chunk=1_000_000):
+    """Write n_events synthetic rows in the earthquakes.csv schema, chunk by chunk."""
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    # a few dozen hotspots so clustering has structure to find
+    hotspots = np.column_stack([rng.uniform(-60, 60, 40), rng.uniform(-180, 180, 40)])
+    written = 0
+    while written < n_events:
+        n = min(chunk, n_events - written)
+        centre = hotspots[rng.integers(0, len(hotspots), n)]
+        lat = np.clip(centre[:, 0] + rng.normal(0, 4, n), -89.9, 89.9)
+        lon = (centre[:, 1] + rng.normal(0, 6, n) + 180) % 360 - 180
+        times = rng.integers(631152000000, 1700000000000, n)
+        frame = pd.DataFrame({
+            "time": times,
+            "place": "synthetic",
+            "status": rng.choice(["reviewed", "automatic"], n),
+            "tsunami": rng.integers(0, 2, n),
+            "significance": rng.integers(0, 1000, n),
+            "data_type": rng.choice(["earthquake", "quarry blast", "explosion"], n, p=[0.94, 0.03, 0.03]),
+            "magnitudo": np.round(rng.exponential(0.9, n) + 2.0, 2),
+            "state": " Synthetic",
+            "longitude": np.round(lon, 4),
+            "latitude": np.round(lat, 4),
+            "depth": np.round(rng.exponential(30, n), 2),
+            "date": pd.to_datetime(times, unit="ms").strftime("%Y-%m-%d %H:%M:%S.%f+00:00"),
+        }, columns=USGS_COLUMNS)
+        frame.to_csv(path, mode="a" if written else "w", header=not written, index=False)
+        written += n
+
+
+def make_workspace(n_events, seed):
+    """Scratch tree laid out like the repo, with the scripts and a synthetic catalog."""
+    root = tempfile.mkdtemp(prefix="eq-bench-")
+    scripts = os.path.join(root, "models", "model training stuff")
+    os.makedirs(scripts)
+    for path in glob.glob(get_absolute_path("*.py")):
+        shutil.copy(path, scripts)
+    shutil.copy(get_absolute_path(os.path.join("..", "export_to_js.py")), os.path.join(root, "models"))
+    generate_catalog(os.path.join(scripts, "earthquakes.csv"), n_events, seed)
+    return root, scripts
+
+
+# Each stage is a snippet run in a fresh interpreter inside the workspace.
+STAGES = {
+    "ingest_oneshot": "from cleanData import dataCleaner; dataCleaner()",
+    "ingest_chunked": "from cleanData import dataCleaner; dataCleaner(chunksize=250_000)",
+    "frequency": "from cleanData import modify; modify()",
+    "kmeans_full": ("import joblib; from verify_kmeans import load_coords, fit_full\n"
+                    "joblib.dump(fit_full(load_coords()), 'kmeans_model.pkl')"),
+    "kmeans_minibatch": "from verify_kmeans import fit_minibatch; fit_minibatch(chunksize=100_000)",
+    "train_clusters": "from model_training import main; main(n_jobs=-1)",
+    "train_frequency": "from model_training import train_frequency_model; train_frequency_model()",
+}
+
+# stages a stage needs to have run first; run unmeasured when not selected
+PREREQUISITES = {
+    "frequency": ["ingest_chunked"],
+    "kmeans_full": ["ingest_chunked"],
+    "kmeans_minibatch": ["ingest_chunked"],
+    "train_clusters": ["kmeans_full"],
+    "train_frequency": ["frequency"],
+    "prediction": ["train_frequency", "train_clusters"],
+}
+
+PREDICTION_SNIPPET = """
+import numpy as np, time
+from predict_earthquakes import EarthquakePredictionModel, ClusterPredictionModel
+freq = EarthquakePredictionModel('../../earthquake_frequency_model.pkl', '../../frequency_model_info.json', lazy=True)
+clus = ClusterPredictionModel('../../earthquake_cluster_model_rf.pkl', '../../model_info.json', lazy=True)
+clus.predict(np.ones((1, 3, clus.n_clusters)))
+timings = {}
+for size in SIZES:
+    years = np.random.default_rng(0).integers(1990, 2100, size)
+    counts = np.random.default_rng(0).integers(0, 5000, (min(size, 100_000), 3, clus.n_clusters))
+    for name, fn, arg in (("frequency", freq.predict_batch, years), ("cluster", clus.predict, counts)):
+        runs = []
+        for _ in range(5):
+            start = time.perf_counter(); fn(arg); runs.append(time.perf_counter() - start)
+        timings[f"predict_{name}_{len(arg)}"] = float(np.median(runs))
+RESULT.update(timings)
+"""
+
+# peak_rss_mb is the child's whole-process high-water mark (VmHWM / ru_maxrss)
+CHILD = """
+import contextlib, io, json, sys, time
+import instrumentation
+RESULT = {{}}
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+{body}
+RESULT["seconds"] = time.perf_counter() - start
+RESULT["peak_rss_mb"] = instrumentation.peak_rss_mb()
+print(json.dumps(RESULT))
+"""
+
+
+def run_stage(scripts, body, sizes=None):
+    code = CHILD.format(body="\n".join("    " + line for line in body.strip().splitlines()))
+    code = code.replace("SIZES", repr(sizes or []))
+    proc = subprocess.run([sys.executable, "-c", code], cwd=scripts, capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError(f"benchmark stage failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run(n_events, seed=0, batch_sizes=(1, 100, 10_000, 1_000_000), stages=None, keep=False):
+    start = time.perf_counter()
+    root, scripts = make_workspace(n_events, seed)
+    print(f"✓ Generated {n_events:,} synthetic events in {time.perf_counter() - start:.1f}s ({root})")
+
+    order = list(STAGES) + ["prediction"]
+    selected = sorted(stages, key=order.index) if stages else order
+    ran, results = set(), {}
+
+    def setup(name):
+        for needed in PREREQUISITES.get(name, []):
+            if needed not in ran and needed not in selected:
+                setup(needed)
+                run_stage(scripts, STAGES[needed])
+                ran.add(needed)
+
+    try:
+        for name in selected:
+            setup(name)
+            ran.add(name)
+            if name == "prediction":
+                out = run_stage(scripts, PREDICTION_SNIPPET, list(batch_sizes))
+                for key in list(out):
+                    if key.startswith("predict_"):
+                        results[key] = {"seconds": out.pop(key)}
+                results["prediction_process"] = out
+            else:
+                results[name] = run_stage(scripts, STAGES[name])
+            print(f"  {name:18s} done")
+    finally:
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "meta": {"events": n_events, "seed": seed, "python": platform.python_version(),
+                 "machine": platform.machine(), "cpus": os.cpu_count(),
+                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+
+
+# absolute slack per metric, so microsecond timings do not flag on noise
+MIN_DELTA = {"seconds": 0.005, "peak_rss_mb": 5.0}
+
+
+def compare(report, baseline, tolerance=0.2):
+    """Stage metrics that got worse than the baseline by more than `tolerance`."""
+    regressions = []
+    for stage, metrics in report["results"].items():
+        old = baseline["results"].get(stage)
+        if not old:
+            continue
+        for metric, value in metrics.items():
+            before = old.get(metric)
+            if before and value > before * (1 + tolerance) and value - before > MIN_DELTA.get(metric, 0):
+                regressions.append((stage, metric, before, value))
+    return regressions
+
+
+def print_report(report):
+    print(f"\n{'stage':28s} {'seconds':>10s} {'peak RSS MB':>12s}")
+    for stage, metrics in report["results"].items():
+        rss = metrics.get("peak_rss_mb")
+        rss = f"{rss:12.1f}" if rss is not None else ""
+        print(f"{stage:28s} {metrics['seconds']:10.4f} {rss}")
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=100_000, help="synthetic catalog size (10k to 50M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", default=None, choices=list(STAGES) + ["prediction"],
+                        help=f"subset of: {', '.join(list(STAGES) + ['prediction'])}")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 10_000, 1_000_000])
+    parser.add_argument("--out", default=None, help="write the results JSON here")
+    parser.add_argument("--baseline", default=None, help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch workspace")
+    args = parser.parse_args(argv)
+
+    report = run(args.events, args.seed, args.batch_sizes, args.stages, args.keep)
+    print_report(report)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Results saved to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline["meta"]["events"] != args.events:
+            print(f"⚠️  Baseline was run with {baseline['meta']['events']:,} events")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against baseline:")
+            for stage, metric, before, after in regressions:
+                print(f"  {stage}.{metric}: {before:.4f} -> {after:.4f} ({after / before - 1:+.0%})")
+            return 1
+        print("\n✓ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
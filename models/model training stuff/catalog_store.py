@@ -0,0 +1,90 @@
+"""Columnar store for the cleaned catalog.
+
+dataCleaner writes the cleaned events as zstd-compressed Parquet, partitioned
+by year (the `date` column after cleaning), with float32 coordinates and
+magnitudes, plus uint8 month/day columns that training.csv does not carry.
+Downstream scripts load it through load_training / load_frequency, which only
+read the requested columns and year partitions and fall back to
+training.csv / Frequency.csv when no store has been built.
+"""
+from imports import pd
+import os
+import shutil
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+STORE_DIR = get_absolute_path("catalog")
+EVENTS_DIR = os.path.join(STORE_DIR, "events")
+FREQUENCY_FILE = os.path.join(STORE_DIR, "frequency.parquet")
+
+FLOAT_COLUMNS = ["magnitudo", "latitude", "longitude"]
+
+
+def store_exists():
+    return os.path.isdir(EVENTS_DIR)
+
+
+def clear_events():
+    """Remove the events partitions so a fresh clean can be written."""
+    if os.path.isdir(EVENTS_DIR):
+        shutil.rmtree(EVENTS_DIR)
+
+
+def _typed(frame):
+    frame = frame.astype({column: "float32" for column in FLOAT_COLUMNS})
+    frame["data_type"] = frame["data_type"].astype("category")
+    frame["date"] = frame["date"].astype("int16")
+    for column in ("month", "day"):
+        if column in frame.columns:
+            # 0 marks an unknown month/day
+            frame[column] = frame[column].fillna(0).astype("uint8")
+    return frame
+
+
+def write_events(frame, part=0):
+    """Append cleaned rows to the store, one file per year partition.
+
+    `part` keeps file names unique when a clean is written chunk by chunk.
+    """
+    if frame.empty:
+        return
+    _typed(frame).to_parquet(EVENTS_DIR, engine="pyarrow", compression="zstd",
+                             partition_cols=["date"], index=False,
+                             basename_template=f"part-{part}-{{i}}.parquet")
+
+
+def load_training(columns=None, years=None):
+    """Load cleaned events, reading only `columns` and the `years` partitions."""
+    if not store_exists():
+        usecols = columns
+        if years is not None and columns is not None and "date" not in columns:
+            usecols = list(columns) + ["date"]
+        df = pd.read_csv(get_absolute_path("training.csv"), usecols=usecols)
+        if years is not None:
+            df = df[df["date"].isin(list(years))]
+            if usecols is not columns:
+                df = df.drop(columns="date")
+        return df
+
+    filters = [("date", "in", [int(year) for year in years])] if years is not None else None
+    df = pd.read_parquet(EVENTS_DIR, engine="pyarrow", columns=columns, filters=filters)
+    if "date" in df.columns:
+        # partition values come back as a categorical
+        df["date"] = df["date"].astype("int64")
+    return df
+
+
+def write_frequency(counts):
+    """Save the per-year counts series produced by modify()."""
+    os.makedirs(STORE_DIR, exist_ok=True)
+    counts.rename_axis("date").reset_index(name="count").to_parquet(
+        FREQUENCY_FILE, engine="pyarrow", compression="zstd", index=False)
+
+
+def load_frequency():
+    if os.path.exists(FREQUENCY_FILE):
+        return pd.read_parquet(FREQUENCY_FILE, engine="pyarrow")
+    return pd.read_csv(get_absolute_path("Frequency.csv"))
@@ -1,32 +1,104 @@
 from imports import pd
+import catalog_store
+import event_store
+import instrumentation
 import os
 
+# Columns that are not needed for training
+DROPPED_COLUMNS = ["depth","significance","tsunami", "time", "status", "place", "state"]
+MIN_MAGNITUDE = 3.5
+
+# Kept in the catalog store for finer aggregation, not written to training.csv
+DAY_COLUMNS = ["month", "day"]
+
+# Fixed dtypes so every chunk parses the same way the one-shot read does
+COLUMN_DTYPES = {"data_type": str, "date": str, "magnitudo": "float64",
+                 "latitude": "float64", "longitude": "float64"}
+
 # Get the absolute path of the current script
 def get_absolute_path(filename):
     return os.path.join(os.path.dirname(__file__), filename)
 
 
+#keep earthquakes above the magnitude threshold and shorten date to the year
+def filterEvents(training, min_magnitude=MIN_MAGNITUDE):
+    training['month'] = pd.to_numeric(training['date'].str[5:7], errors='coerce')
+    training['day'] = pd.to_numeric(training['date'].str[8:10], errors='coerce')
+    training['date'] = training['date'].str[:4]
+
+    rows_in = len(training)
+    training = training[training["data_type"] == "earthquake"]
+    instrumentation.rows("data_type", rows_in, len(training))
+    rows_in = len(training)
+    training = training[training["magnitudo"] >= min_magnitude]
+    instrumentation.rows("magnitude", rows_in, len(training))
+    return training
+
+
 #take out unnecceasry data points
-def dataCleaner():
-    training = pd.read_csv(filepath_or_buffer=get_absolute_path("earthquakes.csv"))
+def dataCleaner(chunksize=None, export_csv=False, min_magnitude=MIN_MAGNITUDE):
+    """Clean earthquakes.csv into the columnar catalog store.
 
-    # Drop unnecessary columns
-    training.drop(columns=["depth","significance","tsunami", "time", "status", "place", "state"], inplace=True)
+    With chunksize set the catalog is streamed: only the kept columns are
+    parsed, each chunk is filtered on its own and appended to the outputs,
+    so memory depends on the chunk size instead of the file size.
+    export_csv also writes the old training.csv.
+    """
+    catalog_store.clear_events()
+    event_store.clear()
+    if chunksize:
+        with instrumentation.stage("clean", chunksize=chunksize):
+            return streamCleaner(chunksize, export_csv, min_magnitude)
 
-    training['date'] = training['date'].str[:4]
-    
-    training = training[training["data_type"] == "earthquake"]
-    training = training[training["magnitudo"] >= 3.5]
-    
-    training.to_csv("training.csv")
+    with instrumentation.stage("clean"):
+        with instrumentation.stage("clean.read"):
+            training = pd.read_csv(filepath_or_buffer=get_absolute_path("earthquakes.csv"))
+
+        # Drop unnecessary columns
+        training.drop(columns=DROPPED_COLUMNS, inplace=True)
+
+        training = filterEvents(training, min_magnitude)
+
+        with instrumentation.stage("clean.write", rows=len(training)):
+            if export_csv:
+                training.drop(columns=DAY_COLUMNS).to_csv(get_absolute_path("training.csv"))
+            catalog_store.write_events(training)
+            event_store.append(training)
+
+
+#chunked version of dataCleaner, same output
+def streamCleaner(chunksize, export_csv=False, min_magnitude=MIN_MAGNITUDE):
+    reader = pd.read_csv(get_absolute_path("earthquakes.csv"),
+                         usecols=lambda column: column not in DROPPED_COLUMNS,
+                         dtype=COLUMN_DTYPES, chunksize=chunksize)
+
+    with reader:
+        for part, chunk in enumerate(reader):
+            chunk = filterEvents(chunk, min_magnitude)
+            if export_csv:
+                # header only once, every later chunk is appended
+                chunk.drop(columns=DAY_COLUMNS).to_csv(get_absolute_path("training.csv"),
+                                                       mode="a" if part else "w", header=not part)
+            catalog_store.write_events(chunk, part)
+            event_store.append(chunk)
+            instrumentation.count("clean.chunks")
 
-    
-#turn to csv
-def modify():
-    df = pd.read_csv(get_absolute_path("training.csv"))
 
-    frequency_Dates = df["date"].value_counts()
-    frequency_Dates.to_csv(get_absolute_path("Frequency.csv"))
+#count earthquakes per year
+@instrumentation.stage("frequency")
+def modify(export_csv=False):
+    if event_store.exists():
+        # counted straight off the memory-mapped year column
+        years, counts = event_store.EventStore().year_counts()
+        frequency_Dates = pd.Series(counts, index=pd.Index(years, name="date"), name="count")
+        frequency_Dates = frequency_Dates.sort_values(ascending=False, kind="stable")
+    else:
+        # only the year partitions are needed for counting
+        df = catalog_store.load_training(columns=["date"])
+        frequency_Dates = df["date"].value_counts()
+    catalog_store.write_frequency(frequency_Dates)
+    if export_csv:
+        frequency_Dates.to_csv(get_absolute_path("Frequency.csv"))
 
 
 
@@ -0,0 +1,293 @@
+"""Per-cluster forecasts for live event batches.
+
+ClusterForecaster assigns a batch of events (a USGS GeoJSON FeatureCollection
+or plain arrays) to the kmeans_model.pkl centroids in one vectorized call and
+adds them to a years x clusters count table. That table is the whole rolling
+state: the cluster_i / lag / total_lag1 / total_roll3 feature row of any year
+is three of its rows. forecast() runs the cluster RandomForest on that window
+and splits the predicted total over the clusters by their share of the
+window's events, the allocation script.js does client-side. outlook() rolls
+the windows forward several years, feeding each forecast back in as counts.
+
+The table starts from the compact event store (or empty) and can be saved to
+and restored from a JSON state file between runs.
+"""
+import json
+import os
+import time
+import numpy as np
+import event_store
+import model_artifacts
+from predict_earthquakes import ClusterPredictionModel
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+ROOT = get_absolute_path(os.path.join("..", ".."))
+
+# same event filter as cleanData.filterEvents (MIN_MAGNITUDE)
+MIN_MAGNITUDE = 3.5
+
+# incremental.WATERMARK_FILE, read directly so the service does not import pandas
+WATERMARK_FILE = get_absolute_path("training.watermark.json")
+
+
+def events_from_geojson(collection, min_magnitude=MIN_MAGNITUDE):
+    """ids, years, latitudes and longitudes of the earthquakes in a FeatureCollection."""
+    ids, times, lat, lon = [], [], [], []
+    for feature in collection.get("features", []):
+        props = feature.get("properties") or {}
+        coords = (feature.get("geometry") or {}).get("coordinates") or [None, None]
+        mag = props.get("mag")
+        if props.get("type") != "earthquake" or mag is None or mag < min_magnitude:
+            continue
+        if props.get("time") is None or coords[0] is None or coords[1] is None:
+            continue
+        ids.append(feature.get("id"))
+        times.append(props["time"])
+        lon.append(coords[0])
+        lat.append(coords[1])
+    years = np.array([time.gmtime(t / 1000).tm_year for t in times], dtype=np.int64)
+    return ids, years, np.array(lat, dtype=np.float64), np.array(lon, dtype=np.float64)
+
+
+def allocate(total, weights):
+    """Split a rounded total over clusters in proportion to weights (largest remainder)."""
+    total = max(int(round(total)), 0)
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.sum() <= 0:
+        weights = np.ones_like(weights)
+    exact = total * weights / weights.sum()
+    shares = np.floor(exact).astype(np.int64)
+    shares[np.argsort(shares - exact)[:total - shares.sum()]] += 1
+    return shares
+
+
+class ClusterForecaster:
+    def __init__(self, centers, model):
+        self.centers = np.asarray(centers, dtype=np.float64)
+        self.model = model
+        if len(self.centers) != model.n_clusters:
+            raise ValueError(f"{len(self.centers)} centroids but the model expects {model.n_clusters} clusters")
+        self.first_year = None
+        self.counts = np.zeros((0, len(self.centers)), dtype=np.int64)
+        self.seen = {}
+
+    @classmethod
+    def from_files(cls, kmeans_path=None, model_path=None, info_path=None, lazy=True):
+        kmeans_path = kmeans_path or get_absolute_path("kmeans_model.pkl")
+        model = ClusterPredictionModel(model_path or os.path.join(ROOT, "earthquake_cluster_model_rf.pkl"),
+                                       info_path or os.path.join(ROOT, "model_info.json"), lazy=lazy)
+        return cls(model_artifacts.load_centers(kmeans_path, model.model_info), model)
+
+    @property
+    def n_clusters(self):
+        return len(self.centers)
+
+    @property
+    def years(self):
+        return np.arange(len(self.counts)) + (self.first_year or 0)
+
+    def assign(self, lat, lon):
+        return event_store.nearest_center(np.column_stack([lat, lon]), self.centers)
+
+    def _grow(self, years):
+        lo, hi = int(years.min()), int(years.max())
+        if self.first_year is None:
+            self.first_year = lo
+            self.counts = np.zeros((hi - lo + 1, self.n_clusters), dtype=np.int64)
+            return
+        before = max(self.first_year - lo, 0)
+        after = max(hi - (self.first_year + len(self.counts) - 1), 0)
+        if before or after:
+            self.counts = np.pad(self.counts, ((before, after), (0, 0)))
+            self.first_year -= before
+
+    def _count(self, years, labels):
+        counted = labels >= 0
+        if counted.any():
+            self._grow(years[counted])
+            rows = years[counted] - self.first_year
+            self.counts += np.bincount(rows * self.n_clusters + labels[counted],
+                                       minlength=self.counts.size).reshape(self.counts.shape)
+
+    def add_events(self, years, lat, lon, ids=None):
+        """Assign events to clusters and count them; events with a known id are skipped.
+
+        Returns the cluster label of every event (-1 for skipped duplicates and
+        missing coordinates).
+        """
+        years = np.asarray(years, dtype=np.int64)
+        labels = self.assign(lat, lon)
+        if ids is not None:
+            fresh = np.array([i not in self.seen for i in ids], dtype=bool)
+            # duplicates inside the batch count once
+            _, first = np.unique(np.asarray(ids, dtype=object).astype(str), return_index=True)
+            once = np.zeros(len(ids), dtype=bool)
+            once[first] = True
+            labels[~(fresh & once)] = -1
+            self.seen.update((i, int(y)) for i, y, keep in zip(ids, years, fresh & once) if keep)
+            # feeds only repeat recent events, older ids can be forgotten
+            cutoff = int(self.years[-1]) - 1 if len(self.counts) else 0
+            self.seen = {i: y for i, y in self.seen.items() if y >= cutoff}
+
+        self._count(years, labels)
+        return labels
+
+    def add_geojson(self, collection):
+        ids, years, lat, lon = events_from_geojson(collection)
+        return self.add_events(years, lat, lon, ids)
+
+    def seed_from_store(self, store=None, watermark_path=WATERMARK_FILE):
+        """Start the count table from every event in the compact event store.
+
+        The store keeps no ids, but the ids incremental.apply_features added
+        in the last 30 days are in its watermark; they are marked as seen so a
+        feed repeating them is not counted a second time.
+        """
+        store = store or event_store.EventStore()
+        labels = store.labels_for(self.centers)
+        labels = np.asarray(labels) if labels is not None else self.assign(store["latitude"], store["longitude"])
+        self._count(np.asarray(store["year"], dtype=np.int64), labels)
+        try:
+            with open(watermark_path, "r") as f:
+                recent = json.load(f).get("recent_ids") or {}
+        except FileNotFoundError:
+            recent = {}
+        self.seen.update((i, time.gmtime(t / 1000).tm_year) for i, t in recent.items())
+        return self
+
+    def windows(self, years):
+        """(n, 3, n_clusters) counts of years t-2..t for each t, zeros outside the table."""
+        years = np.atleast_1d(np.asarray(years, dtype=np.int64))
+        rows = years[:, None] - np.arange(2, -1, -1)[None, :] - (self.first_year or 0)
+        inside = (rows >= 0) & (rows < len(self.counts))
+        windows = np.zeros(rows.shape + (self.n_clusters,), dtype=np.int64)
+        windows[inside] = self.counts[rows[inside]]
+        return windows
+
+    def last_complete_year(self):
+        current = time.gmtime().tm_year
+        return min(int(self.years[-1]), current - 1) if len(self.counts) else current - 1
+
+    def forecast(self, years=None, percentiles=None):
+        """Forecasts for the year after each of `years` (default: the last complete year).
+
+        One model call for all years. Each forecast carries the predicted total
+        and its split over the clusters by their share of the three-year window.
+        With percentiles (e.g. (5, 50, 95)) the total and every cluster also get
+        an "interval" from the spread of the individual trees.
+        """
+        years = np.atleast_1d(np.asarray(self.last_complete_year() if years is None else years, dtype=np.int64))
+        windows = self.windows(years)
+        if percentiles:
+            interval = self.model.predict_interval(windows, percentiles)
+            totals = interval["mean"]
+        else:
+            totals = np.atleast_1d(self.model.predict(windows))
+        window_counts = windows.sum(axis=1)
+
+        forecasts = []
+        for n, (year, total, counts) in enumerate(zip(years, totals, window_counts)):
+            shares = counts / counts.sum() if counts.sum() else np.full(self.n_clusters, 1 / self.n_clusters)
+            forecast = {
+                "year": int(year) + 1,
+                "total": float(total),
+                "clusters": [{"cluster": i, "center": self.centers[i].tolist(), "share": float(share),
+                              "predicted": int(predicted), "window_count": int(count)}
+                             for i, (share, predicted, count) in
+                             enumerate(zip(shares, allocate(total, counts), counts))],
+            }
+            if percentiles:
+                names = [f"p{q:g}" for q in percentiles]
+                forecast["interval"] = dict(zip(names, interval["total"][:, n].tolist()))
+                for i, cluster in enumerate(forecast["clusters"]):
+                    cluster["interval"] = dict(zip(names, interval["clusters"][:, n, i].tolist()))
+            forecasts.append(forecast)
+        return forecasts
+
+    def outlook(self, years=None, horizon=10):
+        """Forecasts for the `horizon` years after each of `years`, predictions fed back in.
+
+        All start years are rolled forward together, one model call per step
+        (ClusterPredictionModel.forecast).
+        """
+        years = np.atleast_1d(np.asarray(self.last_complete_year() if years is None else years, dtype=np.int64))
+        totals, clusters = self.model.forecast(self.windows(years), horizon)
+
+        outlooks = []
+        for year, year_totals, year_clusters in zip(years, totals, clusters):
+            steps = []
+            for step, (total, expected) in enumerate(zip(year_totals, year_clusters)):
+                steps.append({
+                    "year": int(year) + step + 1,
+                    "total": float(total),
+                    "clusters": [{"cluster": i, "expected": float(value), "predicted": int(predicted)}
+                                 for i, (value, predicted) in enumerate(zip(expected, allocate(total, expected)))],
+                })
+            outlooks.append({"from_year": int(year), "horizon": horizon, "forecasts": steps})
+        return outlooks
+
+    def save(self, path):
+        state = {"centers_hash": event_store.centers_hash(self.centers), "first_year": self.first_year,
+                 "counts": self.counts.tolist(), "seen": self.seen}
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    def load(self, path):
+        """Restore a saved table; refused when it was counted against other centroids."""
+        with open(path, "r") as f:
+            state = json.load(f)
+        if state["centers_hash"] != event_store.centers_hash(self.centers):
+            raise ValueError(f"{path} was built with different cluster centroids")
+        self.first_year = state["first_year"]
+        self.counts = np.array(state["counts"], dtype=np.int64).reshape(-1, self.n_clusters)
+        self.seen = state["seen"]
+        return self
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("geojson", nargs="*", help="USGS GeoJSON files to add before forecasting")
+    parser.add_argument("--state", default=None, help="count table to resume from and save to")
+    parser.add_argument("--year", type=int, nargs="+", default=None, help="forecast the year after these")
+    parser.add_argument("--horizon", type=int, default=1, help="years to forecast, predictions fed back in")
+    parser.add_argument("--percentiles", type=float, nargs="+", default=None,
+                        help="also report these percentiles over the trees, e.g. 5 50 95")
+    args = parser.parse_args()
+
+    forecaster = ClusterForecaster.from_files()
+    if args.state and os.path.exists(args.state):
+        forecaster.load(args.state)
+    elif event_store.exists():
+        forecaster.seed_from_store()
+
+    for path in args.geojson:
+        with open(path, "r") as f:
+            labels = forecaster.add_geojson(json.load(f))
+        print(f"✓ Added {int((labels >= 0).sum())} events from {path}")
+
+    if args.horizon > 1:
+        for outlook in forecaster.outlook(args.year, args.horizon):
+            print(f"\nOutlook from {outlook['from_year']}:")
+            for forecast in outlook["forecasts"]:
+                split = ", ".join(f"{c['predicted']:,}" for c in forecast["clusters"])
+                print(f"  {forecast['year']}: {forecast['total']:,.0f} ({split})")
+    else:
+        for forecast in forecaster.forecast(args.year, args.percentiles):
+            print(f"\nForecast for {forecast['year']}: {forecast['total']:,.0f} earthquakes")
+            if "interval" in forecast:
+                print("  " + "  ".join(f"{name}: {value:,.0f}" for name, value in forecast["interval"].items()))
+            for cluster in forecast["clusters"]:
+                lat, lon = cluster["center"]
+                interval = cluster.get("interval")
+                print(f"  Cluster {cluster['cluster']} ({lat:.2f}, {lon:.2f}): "
+                      f"{cluster['predicted']:,} ({cluster['share'] * 100:.1f}%)"
+                      + (f"  [{min(interval.values()):,.0f} - {max(interval.values()):,.0f}]" if interval else ""))
+
+    if args.state:
+        forecaster.save(args.state)
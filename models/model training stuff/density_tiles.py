@@ -0,0 +1,227 @@
+"""Event density tiles at several zoom levels, for reports and the map.
+
+One pass over the catalog puts every event into its Web Mercator bin at the
+deepest zoom (tile x/y as in Leaflet/OSM, TILE_BINS x TILE_BINS bins per
+tile) and counts the occupied bins. Each lower zoom is the one above summed
+over 2x2 bins, so the whole pyramid costs one scan plus work proportional to
+the occupied bins, never to the events.
+
+Tiles are written as uint16 (uint32 where needed) .npy arrays under
+catalog/tiles/<layer>/z/x/y.npy, where <layer> is "all" plus, with by="year" or by="mag_bin", one layer per
+value ("year=2020", "mag_bin=3", ...). With png=True every tile is also
+rendered to a transparent z/x/y.png, so a layer directory can be used as is:
+
+    L.tileLayer('catalog/tiles/all/{z}/{x}/{y}.png', {maxNativeZoom: 6}).addTo(map);
+
+DensityTiles reads tiles back and mosaic() assembles one zoom level into a
+single array for static plots, whatever the number of events.
+"""
+import json
+import os
+import shutil
+import numpy as np
+import catalog_store
+import event_store
+from aggregate import MAG_BINS
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+TILES_DIR = os.path.join(catalog_store.STORE_DIR, "tiles")
+MAX_ZOOM = 6
+TILE_BINS = 64
+MAX_LATITUDE = 85.0511287798
+
+LAYER_BITS = 16
+
+
+def mercator_bins(lat, lon, zoom, tile_bins=TILE_BINS):
+    """Global (x, y) bin of each point at a zoom level, y growing southwards."""
+    size = (1 << zoom) * tile_bins
+    phi = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lon, dtype=np.float64) + 180) / 360 * size
+    y = (1 - np.log(np.tan(phi) + 1 / np.cos(phi)) / np.pi) / 2 * size
+    return (np.clip(x.astype(np.int64), 0, size - 1),
+            np.clip(y.astype(np.int64), 0, size - 1))
+
+
+def _batches(by, chunksize):
+    """(lat, lon, layer value) chunks from the compact store, else the cleaned catalog."""
+    if event_store.exists():
+        store = event_store.EventStore()
+        for start in range(0, len(store), chunksize):
+            stop = start + chunksize
+            layer = store[by][start:stop] if by else np.zeros(min(stop, len(store)) - start)
+            yield store["latitude"][start:stop], store["longitude"][start:stop], layer
+        return
+    from aggregate import _batches as catalog_batches
+    for frame in catalog_batches(chunksize):
+        frame = frame.dropna(subset=["latitude", "longitude", "magnitudo", "date"])
+        if by == "year":
+            layer = frame["date"].to_numpy()
+        elif by == "mag_bin":
+            layer = np.digitize(frame["magnitudo"].to_numpy(dtype=np.float64), MAG_BINS)
+        else:
+            layer = np.zeros(len(frame))
+        yield frame["latitude"].to_numpy(), frame["longitude"].to_numpy(), layer
+
+
+def _merge(keys, counts):
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse, weights=counts).astype(np.int64)
+
+
+def count_bins(max_zoom=MAX_ZOOM, tile_bins=TILE_BINS, by=None, chunksize=1_000_000):
+    """Sparse counts at max_zoom: (layer, x, y) packed into int64 keys, and their counts."""
+    bits = max_zoom + int(np.log2(tile_bins))
+    if 2 * bits + LAYER_BITS > 63:
+        raise ValueError(f"zoom {max_zoom} with {tile_bins} bins per tile is too deep")
+    keys, counts = [], []
+    for lat, lon, layer in _batches(by, chunksize):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        valid = ~(np.isnan(lat) | np.isnan(lon))
+        x, y = mercator_bins(lat[valid], lon[valid], max_zoom, tile_bins)
+        packed = (np.asarray(layer)[valid].astype(np.int64) << 2 * bits) | (y << bits) | x
+        chunk_keys, chunk_counts = np.unique(packed, return_counts=True)
+        keys.append(chunk_keys)
+        counts.append(chunk_counts)
+    if not keys:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), bits
+    keys, counts = _merge(np.concatenate(keys), np.concatenate(counts))
+    return keys, counts, bits
+
+
+def _downsample(keys, counts, bits):
+    """Counts one zoom level up: every 2x2 block of bins summed into one."""
+    mask = (1 << bits) - 1
+    layer = keys >> 2 * bits
+    y, x = (keys >> bits) & mask, keys & mask
+    return _merge((layer << 2 * (bits - 1)) | ((y >> 1) << (bits - 1)) | (x >> 1), counts)
+
+
+def _layer_name(by, value):
+    return f"{by}={value}" if by else "all"
+
+
+def _render_png(path, tile, scale, colormap="inferno"):
+    """Colour a count tile on a log scale, transparent where empty.
+
+    The PNG has one pixel per bin; Leaflet stretches it to its 256 px tiles.
+    """
+    from matplotlib import colormaps
+    from PIL import Image
+    level = np.clip(np.log1p(tile) / scale, 0, 1)
+    rgba = (colormaps[colormap](np.linspace(0, 1, 256)) * 255).astype(np.uint8)[(level * 255).astype(np.uint8)]
+    rgba[..., 3] = np.where(tile > 0, (0.35 + 0.5 * level) * 255, 0)
+    Image.fromarray(rgba).save(path)
+
+
+def _write_level(out_dir, layer_name, zoom, keys, counts, bits, tile_bins, png, scale):
+    """Write the non-empty tiles of one layer and zoom; returns {"x/y": events}."""
+    shift = int(np.log2(tile_bins))
+    mask = (1 << bits) - 1
+    y, x = (keys >> bits) & mask, keys & mask
+    tile_ids = ((y >> shift) << zoom) | (x >> shift)
+    order = np.argsort(tile_ids, kind="stable")
+    tile_ids, x, y, counts = tile_ids[order], x[order], y[order], counts[order]
+    starts = np.flatnonzero(np.r_[True, tile_ids[1:] != tile_ids[:-1]])
+
+    written = {}
+    for start, stop in zip(starts, np.r_[starts[1:], len(tile_ids)]):
+        tx, ty = int(x[start] >> shift), int(y[start] >> shift)
+        tile = np.zeros((tile_bins, tile_bins), dtype=np.uint16 if counts[start:stop].max() < 1 << 16 else np.uint32)
+        tile[y[start:stop] & (tile_bins - 1), x[start:stop] & (tile_bins - 1)] = counts[start:stop]
+        folder = os.path.join(out_dir, layer_name, str(zoom), str(tx))
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, f"{ty}.npy"), tile)
+        if png:
+            _render_png(os.path.join(folder, f"{ty}.png"), tile, scale)
+        written[f"{tx}/{ty}"] = int(counts[start:stop].sum())
+    return written
+
+
+def build_tiles(max_zoom=MAX_ZOOM, tile_bins=TILE_BINS, by=None, png=False, out_dir=TILES_DIR,
+                chunksize=1_000_000):
+    """Count the catalog once and write the tile pyramid for zoom 0..max_zoom."""
+    if tile_bins & (tile_bins - 1):
+        raise ValueError("tile_bins must be a power of two")
+    if by not in (None, "year", "mag_bin"):
+        raise ValueError("by must be None, 'year' or 'mag_bin'")
+    keys, counts, bits = count_bins(max_zoom, tile_bins, by, chunksize)
+
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    manifest = {"projection": "web_mercator", "max_zoom": max_zoom, "tile_bins": tile_bins, "by": by,
+                "events": int(counts.sum()), "layers": {}}
+    levels = []
+    for zoom in range(max_zoom, -1, -1):
+        levels.append((zoom, keys, counts, bits))
+        if zoom:
+            keys, counts = _downsample(keys, counts, bits)
+            bits -= 1
+
+    layers = {}
+    for zoom, keys, counts, bits in levels:
+        values = keys >> 2 * bits
+        names = ["all"] + ([_layer_name(by, int(v)) for v in np.unique(values)] if by else [])
+        for name in names:
+            if name == "all":
+                level_keys, level_counts = _merge(keys & ((1 << 2 * bits) - 1), counts) if by else (keys, counts)
+            else:
+                selected = values == int(name.split("=")[1])
+                level_keys, level_counts = keys[selected] & ((1 << 2 * bits) - 1), counts[selected]
+            # one colour scale per layer and zoom, so neighbouring tiles match
+            scale = np.log1p(level_counts.max()) if len(level_counts) else 1.0
+            layers.setdefault(name, {})[str(zoom)] = _write_level(
+                out_dir, name, zoom, level_keys, level_counts, bits, tile_bins, png, scale)
+    manifest["layers"] = layers
+
+    with open(os.path.join(out_dir, "tiles.json"), "w") as f:
+        json.dump(manifest, f)
+    n_tiles = sum(len(tiles) for zooms in layers.values() for tiles in zooms.values())
+    print(f"✓ Wrote {n_tiles} tiles ({len(layers)} layers, zoom 0-{max_zoom}) "
+          f"for {manifest['events']} events to {out_dir}")
+    return manifest
+
+
+class DensityTiles:
+    def __init__(self, tiles_dir=TILES_DIR):
+        self.tiles_dir = tiles_dir
+        with open(os.path.join(tiles_dir, "tiles.json"), "r") as f:
+            self.manifest = json.load(f)
+        self.tile_bins = self.manifest["tile_bins"]
+
+    @property
+    def layers(self):
+        return list(self.manifest["layers"])
+
+    def tile(self, zoom, x, y, layer="all"):
+        """Counts of one tile; zeros for a tile without events."""
+        if f"{x}/{y}" not in self.manifest["layers"][layer].get(str(zoom), {}):
+            return np.zeros((self.tile_bins, self.tile_bins), dtype=np.uint16)
+        return np.load(os.path.join(self.tiles_dir, layer, str(zoom), str(x), f"{y}.npy"))
+
+    def mosaic(self, zoom, layer="all"):
+        """The whole world at one zoom as a single (2^zoom * tile_bins)² count array."""
+        size = (1 << zoom) * self.tile_bins
+        world = np.zeros((size, size), dtype=np.uint64)
+        for key in self.manifest["layers"][layer].get(str(zoom), {}):
+            x, y = map(int, key.split("/"))
+            world[y * self.tile_bins:(y + 1) * self.tile_bins,
+                  x * self.tile_bins:(x + 1) * self.tile_bins] = self.tile(zoom, x, y, layer)
+        return world
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-zoom", type=int, default=MAX_ZOOM)
+    parser.add_argument("--tile-bins", type=int, default=TILE_BINS, help="bins per tile side (power of two)")
+    parser.add_argument("--by", choices=["year", "mag_bin"], default=None, help="also write one layer per value")
+    parser.add_argument("--png", action="store_true", help="also render PNG tiles for Leaflet")
+    args = parser.parse_args()
+    build_tiles(args.max_zoom, args.tile_bins, args.by, args.png)
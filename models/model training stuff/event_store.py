@@ -0,0 +1,216 @@
+"""Compact, memory-mapped copy of the cleaned catalog.
+
+Only what the counting and clustering code reads is kept, one raw
+little-endian array per column under catalog/compact:
+
+    latitude, longitude, magnitudo   float32
+    year                             uint16
+    mag_bin                          uint8   (aggregate.MAG_BINS)
+    data_type                        uint8   codes into manifest["categories"]
+
+That is 16 bytes per event instead of the ~100 of a pandas frame with an
+object `date` column. dataCleaner and incremental.apply_features append to
+it; EventStore memory-maps the arrays read-only so opening it costs nothing
+and scans only page in what they touch.
+
+The nearest kmeans centroid of every event (int32, -1 if unassigned) is kept
+apart under catalog/compact_clusters with the centroids it was assigned with,
+so relabelling after a new KMeans fit never rewrites the store itself.
+"""
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import catalog_store
+from aggregate import MAG_BINS
+
+
+STORE_DIR = os.path.join(catalog_store.STORE_DIR, "compact")
+LABELS_DIR = os.path.join(catalog_store.STORE_DIR, "compact_clusters")
+
+COLUMNS = {"latitude": "<f4", "longitude": "<f4", "magnitudo": "<f4",
+           "year": "<u2", "mag_bin": "u1", "data_type": "u1"}
+LABEL_DTYPE = "<i4"
+
+
+def exists(store_dir=STORE_DIR):
+    return os.path.exists(os.path.join(store_dir, "manifest.json"))
+
+
+def clear(store_dir=STORE_DIR, labels_dir=LABELS_DIR):
+    for folder in (store_dir, labels_dir):
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
+
+
+def _read_manifest(store_dir):
+    try:
+        with open(os.path.join(store_dir, "manifest.json"), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"rows": 0, "columns": COLUMNS, "categories": {"data_type": []}, "mag_bins": MAG_BINS}
+
+
+def _read_labels(labels_dir):
+    try:
+        with open(os.path.join(labels_dir, "labels.json"), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"rows": 0, "centers": None, "centers_hash": None}
+
+
+def _write_manifest(store_dir, manifest, name="manifest.json"):
+    path = os.path.join(store_dir, name)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def centers_hash(centers):
+    return hashlib.sha256(np.ascontiguousarray(centers, dtype=np.float64).tobytes()).hexdigest()[:16]
+
+
+def nearest_center(coords, centers, chunksize=262_144):
+    """Index of the nearest centroid for each (lat, lon) row, -1 for missing coordinates.
+
+    Uses |c|² - 2 x·c per chunk, so the temporary is (chunk, k) instead of (chunk, k, 2).
+    """
+    centers = np.asarray(centers, dtype=np.float64)
+    offset = (centers ** 2).sum(axis=1)
+    labels = np.empty(len(coords), dtype=np.int32)
+    for start in range(0, len(coords), chunksize):
+        chunk = np.asarray(coords[start:start + chunksize], dtype=np.float64)
+        labels[start:start + len(chunk)] = (offset - 2 * chunk @ centers.T).argmin(axis=1)
+        labels[start:start + len(chunk)][np.isnan(chunk).any(axis=1)] = -1
+    return labels
+
+
+def append(frame, store_dir=STORE_DIR, labels_dir=LABELS_DIR):
+    """Append cleaned rows (data_type, magnitudo, latitude, longitude, date=year)."""
+    if frame.empty:
+        return
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = _read_manifest(store_dir)
+
+    categories = manifest["categories"]["data_type"]
+    values, inverse = np.unique(frame["data_type"].astype(str).to_numpy(), return_inverse=True)
+    for value in values:
+        if value not in categories:
+            categories.append(str(value))
+    if len(categories) > 255:
+        raise ValueError("too many data_type categories for the compact store")
+
+    lat = frame["latitude"].to_numpy(dtype=np.float32)
+    lon = frame["longitude"].to_numpy(dtype=np.float32)
+    magnitudo = frame["magnitudo"].to_numpy(dtype=np.float32)
+    columns = {
+        "latitude": lat,
+        "longitude": lon,
+        "magnitudo": magnitudo,
+        "year": frame["date"].astype(int).to_numpy(),
+        "mag_bin": np.digitize(magnitudo, manifest["mag_bins"]),
+        "data_type": np.array([categories.index(value) for value in values])[inverse],
+    }
+
+    rows = manifest["rows"]
+    for name, dtype in COLUMNS.items():
+        _append_column(os.path.join(store_dir, f"{name}.bin"), rows, columns[name], dtype)
+    manifest["rows"] = rows + len(frame)
+    _write_manifest(store_dir, manifest)
+
+    # new rows go to the centroids the store was last assigned with
+    labels = _read_labels(labels_dir)
+    if labels["centers"] is not None and labels["rows"] == rows:
+        _append_column(os.path.join(labels_dir, "cluster.bin"), rows,
+                       nearest_center(np.column_stack([lat, lon]), labels["centers"]), LABEL_DTYPE)
+        labels["rows"] = manifest["rows"]
+        _write_manifest(labels_dir, labels, "labels.json")
+
+
+def _append_column(path, rows, values, dtype):
+    with open(path, "ab") as f:
+        # drop anything a crashed append left behind the last committed row
+        f.truncate(rows * np.dtype(dtype).itemsize)
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+
+def assign_clusters(centers, store_dir=STORE_DIR, labels_dir=LABELS_DIR, chunksize=1_000_000):
+    """Label every stored event with its nearest centroid and remember the centroids."""
+    store = EventStore(store_dir, labels_dir)
+    os.makedirs(labels_dir, exist_ok=True)
+    path = os.path.join(labels_dir, "cluster.bin")
+    # written beside the current labels and swapped in, so readers never see a half-labelled store
+    with open(path + ".tmp", "wb") as f:
+        for start in range(0, len(store), chunksize):
+            f.write(nearest_center(store.coords(start, start + chunksize), centers).astype(LABEL_DTYPE).tobytes())
+    os.replace(path + ".tmp", path)
+    _write_manifest(labels_dir, {"rows": len(store), "centers": np.asarray(centers, dtype=np.float64).tolist(),
+                                 "centers_hash": centers_hash(centers)}, "labels.json")
+
+
+class EventStore:
+    def __init__(self, store_dir=STORE_DIR, labels_dir=LABELS_DIR):
+        self.store_dir = store_dir
+        self.labels_dir = labels_dir
+        self.manifest = _read_manifest(store_dir)
+        n = self.manifest["rows"]
+        self.columns = {name: (np.memmap(os.path.join(store_dir, f"{name}.bin"), dtype=dtype, mode="r", shape=(n,))
+                               if n else np.empty(0, dtype=dtype))
+                        for name, dtype in COLUMNS.items()}
+
+    def __len__(self):
+        return self.manifest["rows"]
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def categories(self, name="data_type"):
+        return self.manifest["categories"][name]
+
+    def coords(self, start=0, stop=None, dtype=np.float64):
+        """(n, 2) latitude/longitude array for a row range."""
+        return np.column_stack([self.columns["latitude"][start:stop],
+                                self.columns["longitude"][start:stop]]).astype(dtype, copy=False)
+
+    def iter_coords(self, chunksize=100_000, years=None):
+        """float64 coordinate chunks without NaNs, optionally only for some years."""
+        wanted = np.asarray(list(years), dtype=np.uint16) if years is not None else None
+        for start in range(0, len(self), chunksize):
+            coords = self.coords(start, start + chunksize)
+            if wanted is not None:
+                coords = coords[np.isin(self.columns["year"][start:start + chunksize], wanted)]
+            coords = coords[~np.isnan(coords).any(axis=1)]
+            if len(coords):
+                yield coords
+
+    def year_counts(self, chunksize=10_000_000):
+        """(years, counts) of the years that have events, counted chunk by chunk."""
+        counts = np.zeros(1 << 16, dtype=np.int64)
+        for start in range(0, len(self), chunksize):
+            counts += np.bincount(self.columns["year"][start:start + chunksize], minlength=1 << 16)
+        years = np.flatnonzero(counts)
+        return years, counts[years]
+
+    def labels_for(self, centers):
+        """The stored cluster labels if every event was assigned with these centroids, else None."""
+        labels = _read_labels(self.labels_dir)
+        if labels["centers_hash"] != centers_hash(centers) or labels["rows"] != len(self):
+            return None
+        if not len(self):
+            return np.empty(0, dtype=LABEL_DTYPE)
+        return np.memmap(os.path.join(self.labels_dir, "cluster.bin"), dtype=LABEL_DTYPE, mode="r", shape=(len(self),))
+
+
+if __name__ == "__main__":
+    store = EventStore()
+    print(f"✓ {len(store)} events, {store.nbytes / 1e6:.1f} MB on disk in {STORE_DIR}")
+    years, counts = store.year_counts()
+    if len(years):
+        print(f"  years {years.min()}-{years.max()}, busiest {years[counts.argmax()]} ({counts.max()} events)")
+    print(f"  clusters assigned: {_read_labels(store.labels_dir)['rows'] == len(store) and len(store) > 0}")
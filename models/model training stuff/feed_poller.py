@@ -0,0 +1,561 @@
+"""Poll the USGS earthquake and NWS alert feeds into the Python catalog.
+
+script.js and apis.js only fetch these feeds in the browser. This keeps the
+catalog used by dataCleaner and training up to date:
+
+    python feed_poller.py poll                       # every feed, forever
+    python feed_poller.py poll usgs_day --once
+    python feed_poller.py serve recorded/ --port 8800
+    python feed_poller.py poll --once --dry-run --base-url http://127.0.0.1:8800
+
+Requests go through a small asyncio HTTP/1.1 client (stdlib only). It keeps
+connections alive per host and bounds concurrency across all feeds. The
+ETag and Last-Modified of every feed URL are kept in STATE_FILE and sent
+back as If-None-Match / If-Modified-Since, so an unchanged feed costs a 304
+and no parsing. Network errors, 429 and 5xx answers back off exponentially
+with jitter, honouring Retry-After.
+
+USGS features are decoded while the body is still streaming in. They go to
+incremental.apply_features in batches, which cleans them, dedupes them
+against the catalog watermark and appends them. NWS alerts are not
+earthquakes, so the latest alert collection is written to ALERTS_FILE.
+
+`serve` is a stub server that replays recorded feed files (with ETags,
+Last-Modified, gzip and chunked bodies), so the poller can be tried offline.
+"""
+import asyncio
+import codecs
+import gzip
+import hashlib
+import json
+import os
+import random
+import ssl
+import time
+import zlib
+from contextlib import asynccontextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import instrumentation
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+STATE_FILE = get_absolute_path("feed_poller.state.json")
+# next to the catalog store (catalog_store.STORE_DIR)
+ALERTS_FILE = get_absolute_path(os.path.join("catalog", "nws_alerts.json"))
+
+USER_AGENT = "(RedHackathon earthquake catalog, feed_poller.py)"
+USGS_FEED = "https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/"
+
+FEEDS = {
+    "usgs_hour": {"url": USGS_FEED + "all_hour.geojson", "interval": 60, "kind": "usgs"},
+    "usgs_day": {"url": USGS_FEED + "all_day.geojson", "interval": 900, "kind": "usgs"},
+    "nws_alerts": {"url": "https://api.weather.gov/alerts/active", "interval": 300, "kind": "nws"},
+}
+
+
+class FetchError(Exception):
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _retry_after(value):
+    """Seconds from a Retry-After header (delta seconds or an HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+
+# ---- HTTP client ----
+
+class Response:
+    def __init__(self, status, headers, reader, timeout):
+        self.status = status
+        self.headers = headers
+        self.reader = reader
+        self.timeout = timeout
+        self.has_body = not (100 <= status < 200 or status in (204, 304))
+        # the connection can go back to the pool once the body was read to the end
+        self.complete = not self.has_body
+        self.reusable = headers.get("connection", "").lower() != "close"
+
+    async def _read(self, n):
+        data = await asyncio.wait_for(self.reader.read(n), self.timeout)
+        if not data:
+            raise asyncio.IncompleteReadError(b"", n)
+        return data
+
+    async def _raw(self):
+        if not self.has_body:
+            return
+        if "chunked" in self.headers.get("transfer-encoding", "").lower():
+            while True:
+                size = int((await asyncio.wait_for(self.reader.readline(), self.timeout)).split(b";")[0], 16)
+                if size == 0:
+                    while await asyncio.wait_for(self.reader.readline(), self.timeout) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                yield await asyncio.wait_for(self.reader.readexactly(size), self.timeout)
+                await asyncio.wait_for(self.reader.readline(), self.timeout)
+        elif "content-length" in self.headers:
+            remaining = int(self.headers["content-length"])
+            while remaining:
+                data = await self._read(min(remaining, 1 << 16))
+                remaining -= len(data)
+                yield data
+        else:
+            # body ends with the connection
+            self.reusable = False
+            while data := await asyncio.wait_for(self.reader.read(1 << 16), self.timeout):
+                yield data
+        self.complete = True
+
+    async def chunks(self):
+        """The body as it arrives, gzip-decoded."""
+        decoder = None
+        if self.headers.get("content-encoding", "").lower() == "gzip":
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        async for data in self._raw():
+            data = decoder.decompress(data) if decoder else data
+            if data:
+                yield data
+        if decoder and (tail := decoder.flush()):
+            yield tail
+
+    async def read(self):
+        return b"".join([data async for data in self.chunks()])
+
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections, at most max_per_host open to each host."""
+
+    def __init__(self, max_per_host=2, timeout=30.0):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.idle = {}
+        self.limits = {}
+        self.ssl = ssl.create_default_context()
+        self.stats = {"connections": 0, "reused": 0}
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        self.stats["connections"] += 1
+        return await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self.ssl if scheme == "https" else None), self.timeout)
+
+    @asynccontextmanager
+    async def request(self, url, headers=None):
+        """GET url; yields a Response whose body can be streamed inside the block."""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        lines = [f"GET {target} HTTP/1.1", f"Host: {parts.netloc}", f"User-Agent: {USER_AGENT}",
+                 "Accept-Encoding: gzip", "Connection: keep-alive"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        message = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        async with self.limits.setdefault(key, asyncio.Semaphore(self.max_per_host)):
+            while True:
+                idle = self.idle.setdefault(key, [])
+                reused = bool(idle)
+                reader, writer = idle.pop() if reused else await self._connect(key)
+                try:
+                    writer.write(message)
+                    await writer.drain()
+                    status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+                    if not status_line:
+                        raise ConnectionError("connection closed by the server")
+                    break
+                except (OSError, asyncio.TimeoutError):
+                    writer.close()
+                    # a kept-alive connection the server has closed meanwhile: try a fresh one
+                    if not reused:
+                        raise
+            if reused:
+                self.stats["reused"] += 1
+
+            try:
+                status = int(status_line.split()[1])
+                response_headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), self.timeout)
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    response_headers[name.strip().lower()] = value.strip()
+                response = Response(status, response_headers, reader, self.timeout)
+                yield response
+            except BaseException:
+                writer.close()
+                raise
+            if response.complete and response.reusable:
+                self.idle[key].append((reader, writer))
+            else:
+                writer.close()
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+
+# ---- streaming GeoJSON ----
+
+async def iter_features(chunks):
+    """Features of a GeoJSON FeatureCollection, decoded while the body streams in.
+
+    Stops at the end of the features array without reading the rest of `chunks`.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer, pos, started = "", 0, False
+    async for chunk in chunks:
+        buffer += text.decode(chunk)
+        if not started:
+            start = buffer.find('"features"')
+            bracket = buffer.find("[", start) if start >= 0 else -1
+            if bracket < 0:
+                continue
+            buffer, started = buffer[bracket + 1:], True
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if buffer[pos] == "]":
+                return
+            try:
+                feature, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the feature is still incomplete, wait for the next chunk
+                break
+            yield feature
+        buffer, pos = buffer[pos:], 0
+    raise ValueError("truncated or malformed FeatureCollection")
+
+
+# ---- poller ----
+
+def _apply_features(features):
+    # imported here so the stub server and --dry-run stay free of pandas
+    from incremental import apply_features
+    return apply_features(features)
+
+
+class FeedPoller:
+    def __init__(self, feeds=None, pool=None, state_path=STATE_FILE, concurrency=4, batch_size=5000,
+                 apply=None, alerts_path=ALERTS_FILE, base_delay=5.0, max_backoff=900.0, save_state=True):
+        self.feeds = feeds or FEEDS
+        self.pool = pool or ConnectionPool()
+        self.state_path = state_path
+        # off for --dry-run: validators of a feed that was only counted must not
+        # turn the next real poll into a 304
+        self.save_state = save_state
+        self.concurrency = asyncio.Semaphore(concurrency)
+        self.batch_size = batch_size
+        self.apply = apply or _apply_features
+        self.alerts_path = alerts_path
+        self.base_delay = base_delay
+        self.max_backoff = max_backoff
+        # apply_features rewrites the watermark and the catalog, one batch at a time
+        self.apply_lock = asyncio.Lock()
+        try:
+            with open(state_path, "r") as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {}
+
+    def _save_state(self):
+        if not self.save_state:
+            return
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def _conditional_headers(self, state):
+        headers = {}
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+        return headers
+
+    async def _apply(self, features):
+        async with self.apply_lock:
+            return await asyncio.to_thread(self.apply, features)
+
+    async def _ingest(self, response):
+        body = response.chunks()
+        batch, added = [], 0
+        async for feature in iter_features(body):
+            batch.append(feature)
+            if len(batch) >= self.batch_size:
+                added += await self._apply(batch)
+                batch = []
+        if batch:
+            added += await self._apply(batch)
+        async for _ in body:
+            pass
+        return added
+
+    async def _save_alerts(self, response):
+        if self.alerts_path is None:
+            await response.read()
+            return
+        os.makedirs(os.path.dirname(self.alerts_path), exist_ok=True)
+        with open(self.alerts_path + ".tmp", "wb") as f:
+            async for data in response.chunks():
+                f.write(data)
+        os.replace(self.alerts_path + ".tmp", self.alerts_path)
+
+    async def poll(self, name):
+        """Fetch one feed once. Returns the number of events added, or None if it was unchanged."""
+        feed = self.feeds[name]
+        state = self.state.setdefault(feed["url"], {})
+        start = time.perf_counter()
+        async with self.concurrency:
+            async with self.pool.request(feed["url"], self._conditional_headers(state)) as response:
+                if response.status == 304:
+                    result = None
+                elif response.status != 200:
+                    await response.read()
+                    raise FetchError(f"HTTP {response.status}", response.status,
+                                     _retry_after(response.headers.get("retry-after")))
+                elif feed["kind"] == "usgs":
+                    result = await self._ingest(response)
+                else:
+                    await self._save_alerts(response)
+                    result = 0
+
+        # validators are only kept once the body was fully processed
+        if response.status == 200:
+            state["etag"] = response.headers.get("etag")
+            state["last_modified"] = response.headers.get("last-modified")
+        state["checked"] = time.time()
+        state["failures"] = 0
+        self._save_state()
+        instrumentation.observe(f"feed.{name}", start)
+        instrumentation.count("feed.unchanged" if result is None else "feed.updated")
+        return result
+
+    def _backoff(self, name, error):
+        state = self.state.setdefault(self.feeds[name]["url"], {})
+        state["failures"] = state.get("failures", 0) + 1
+        delay = min(self.max_backoff, self.base_delay * 2 ** (state["failures"] - 1))
+        delay = random.uniform(delay / 2, delay)
+        retry_after = getattr(error, "retry_after", None)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    async def poll_safely(self, name):
+        """poll(), with failures reported instead of raised. Returns (result, seconds until the next poll)."""
+        try:
+            added = await self.poll(name)
+        except (FetchError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            delay = self._backoff(name, e)
+            instrumentation.count("feed.errors")
+            print(f"⚠️  {name}: {str(e) or type(e).__name__}; retrying in {delay:.0f}s")
+            return False, delay
+        if added is None:
+            print(f"✓ {name}: unchanged")
+        else:
+            print(f"✓ {name}: {added} new events" if self.feeds[name]["kind"] == "usgs"
+                  else f"✓ {name}: updated")
+        return added, self.feeds[name]["interval"]
+
+    async def run(self, names=None, duration=None):
+        """Poll every feed on its own interval until `duration` seconds have passed (forever if None)."""
+        stop_at = None if duration is None else time.monotonic() + duration
+
+        async def loop(name):
+            while stop_at is None or time.monotonic() < stop_at:
+                _, delay = await self.poll_safely(name)
+                if stop_at is not None:
+                    delay = min(delay, max(stop_at - time.monotonic(), 0))
+                await asyncio.sleep(delay)
+
+        try:
+            await asyncio.gather(*(loop(name) for name in names or self.feeds))
+        finally:
+            self.pool.close()
+
+    async def run_once(self, names=None):
+        try:
+            return dict(zip(names or self.feeds,
+                            await asyncio.gather(*(self.poll_safely(name) for name in names or self.feeds))))
+        finally:
+            self.pool.close()
+
+
+# ---- stub server replaying recorded feeds ----
+
+class ReplayServer:
+    """Serve recorded feed files the way the live feeds do.
+
+    A request for .../<name> is answered from <directory>/<name>. Numbered
+    recordings <stem>.1<ext>, <stem>.2<ext>, ... are served in turn, one step
+    per request, and the last one repeats, so successive polls see the feed
+    change and then stay unchanged. Bodies carry an ETag and Last-Modified,
+    honour If-None-Match / If-Modified-Since, are gzipped when asked for and
+    sent chunked. The first `fail` requests get a 503 with Retry-After.
+    """
+
+    def __init__(self, directory, fail=0, chunk_size=16384):
+        self.directory = directory
+        self.fail = fail
+        self.chunk_size = chunk_size
+        self.served = {}
+        self.stats = {"requests": 0, "200": 0, "304": 0, "404": 0, "503": 0}
+
+    def _recordings(self, name):
+        stem, ext = os.path.splitext(name)
+        numbered = []
+        while os.path.exists(os.path.join(self.directory, f"{stem}.{len(numbered) + 1}{ext}")):
+            numbered.append(os.path.join(self.directory, f"{stem}.{len(numbered) + 1}{ext}"))
+        if numbered:
+            return numbered
+        path = os.path.join(self.directory, name)
+        return [path] if os.path.isfile(path) else []
+
+    def _respond(self, name, headers):
+        self.stats["requests"] += 1
+        if self.stats["requests"] <= self.fail:
+            self.stats["503"] += 1
+            return 503, {"Retry-After": "1"}, b""
+        recordings = self._recordings(name)
+        if not recordings:
+            self.stats["404"] += 1
+            return 404, {}, b""
+        step = self.served.get(name, 0)
+        self.served[name] = step + 1
+        path = recordings[min(step, len(recordings) - 1)]
+        with open(path, "rb") as f:
+            body = f.read()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        last_modified = formatdate(int(os.path.getmtime(path)), usegmt=True)
+        validators = {"ETag": etag, "Last-Modified": last_modified}
+
+        if headers.get("if-none-match") == etag or (
+                "if-none-match" not in headers and headers.get("if-modified-since") == last_modified):
+            self.stats["304"] += 1
+            return 304, validators, b""
+        if "gzip" in headers.get("accept-encoding", ""):
+            body = gzip.compress(body)
+            validators["Content-Encoding"] = "gzip"
+        self.stats["200"] += 1
+        return 200, {**validators, "Content-Type": "application/json"}, body
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                status, response_headers, body = self._respond(os.path.basename(urlsplit(target).path), headers)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Replay'}"]
+                head += [f"{name}: {value}" for name, value in response_headers.items()]
+                head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+                if status == 200:
+                    head.append("Transfer-Encoding: chunked")
+                elif status != 304:
+                    head.append("Content-Length: 0")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+                if status == 200:
+                    for start in range(0, len(body), self.chunk_size):
+                        piece = body[start:start + self.chunk_size]
+                        writer.write(f"{len(piece):x}\r\n".encode() + piece + b"\r\n")
+                        await writer.drain()
+                    writer.write(b"0\r\n\r\n")
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(replay, host="127.0.0.1", port=8800):
+    server = await asyncio.start_server(replay.handle, host, port)
+    print(f"✓ Replaying feeds from {replay.directory} on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def _rebase(feeds, base_url):
+    """The same feeds, fetched from base_url/<last path segment> (e.g. a ReplayServer)."""
+    return {name: {**feed, "url": f"{base_url.rstrip('/')}/{os.path.basename(urlsplit(feed['url']).path)}"}
+            for name, feed in feeds.items()}
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    poll = commands.add_parser("poll", help="poll the feeds into the catalog")
+    poll.add_argument("feeds", nargs="*", help=f"feeds to poll (default: all of {', '.join(FEEDS)})")
+    poll.add_argument("--once", action="store_true", help="poll each feed once and exit")
+    poll.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    poll.add_argument("--concurrency", type=int, default=4, help="requests in flight across all feeds")
+    poll.add_argument("--base-url", default=None, help="fetch every feed from here instead (replay server)")
+    poll.add_argument("--state", default=STATE_FILE, help="ETag / Last-Modified state file")
+    poll.add_argument("--dry-run", action="store_true",
+                      help="count the features instead of writing anything (the state file is read, not updated)")
+
+    replay = commands.add_parser("serve", help="stub server replaying recorded feed files")
+    replay.add_argument("directory")
+    replay.add_argument("--host", default="127.0.0.1")
+    replay.add_argument("--port", type=int, default=8800)
+    replay.add_argument("--fail", type=int, default=0, help="answer the first N requests with 503")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(ReplayServer(args.directory, args.fail), args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    unknown = set(args.feeds) - set(FEEDS)
+    if unknown:
+        parser.error(f"unknown feeds: {', '.join(sorted(unknown))}")
+    feeds = _rebase(FEEDS, args.base_url) if args.base_url else FEEDS
+    poller = FeedPoller(feeds, state_path=args.state, concurrency=args.concurrency,
+                        apply=len if args.dry_run else None, alerts_path=None if args.dry_run else ALERTS_FILE,
+                        save_state=not args.dry_run)
+    names = args.feeds or None
+    try:
+        asyncio.run(poller.run_once(names) if args.once else poller.run(names, args.duration))
+    except KeyboardInterrupt:
+        pass
+    print(f"Connections opened: {poller.pool.stats['connections']}, reused: {poller.pool.stats['reused']}")
+
+
+if __name__ == "__main__":
+    main()
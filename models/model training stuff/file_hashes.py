@@ -0,0 +1,22 @@
+"""Content hashes of files, remembered by size and mtime.
+
+Shared by the pipeline runner (stage fingerprints) and the prediction cache
+(model versions), so unchanged files are only read once.
+"""
+import hashlib
+import os
+
+
+def file_hash(path, known):
+    """Content hash of a file, reusing the previous hash while size and mtime are unchanged."""
+    stat = os.stat(path)
+    key = f"{stat.st_size}:{stat.st_mtime_ns}"
+    cached = known.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    known[path] = [key, digest.hexdigest()]
+    return known[path][1]
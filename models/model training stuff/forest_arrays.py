@@ -0,0 +1,168 @@
+"""Flat typed-array form of the cluster RandomForest and KMeans centroids.
+
+Every tree is renumbered in preorder, so a split's left child is always the
+next node and only the right child has to be stored. The nodes of all trees
+are concatenated:
+
+    tree_offsets  int32    first node of each tree, plus the end
+    right         int32    right child of a split, or ~leaf for a leaf
+    feature       uint8/16 feature tested at a split
+    threshold     float32  split threshold, rounded down to float32
+    leaf_value    float64  prediction of each leaf
+
+sklearn casts X to float32 and tests x <= threshold; for a float32 x that is
+the same test against the threshold rounded down to float32, so the float32
+thresholds give exactly sklearn's leaves.
+
+write_arrays / read_arrays store a dict of arrays behind a small JSON header
+with every array 8-byte aligned, so the file can be memory-mapped in Python
+or wrapped by typed arrays in JavaScript without copying. The header holds
+the SHA-256 of the array data, checked by read_arrays(verify=True).
+"""
+import hashlib
+import json
+import os
+import struct
+import numpy as np
+
+MAGIC = b"EQAR"
+ALIGN = 8
+
+
+def _round_down_float32(values):
+    rounded = values.astype(np.float32)
+    above = rounded.astype(np.float64) > values
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+def _preorder(tree):
+    """Node ids of a fitted sklearn tree in preorder (node, left subtree, right subtree)."""
+    order, stack = [], [0]
+    left, right = tree.children_left, tree.children_right
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        if left[node] != -1:
+            stack.append(right[node])
+            stack.append(left[node])
+    return np.array(order, dtype=np.int64)
+
+
+def flatten_forest(model):
+    """Arrays describing every tree of a fitted RandomForestRegressor (single output)."""
+    offsets, right, feature, threshold, leaf_value = [0], [], [], [], []
+    n_leaves = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        if tree.value.shape[1] != 1:
+            raise ValueError("only single-output forests can be flattened")
+        order = _preorder(tree)
+        position = np.empty(tree.node_count, dtype=np.int64)
+        position[order] = np.arange(len(order)) + offsets[-1]
+
+        is_leaf = tree.children_left[order] == -1
+        leaf_ids = np.cumsum(is_leaf) - 1 + n_leaves
+        right.append(np.where(is_leaf, ~leaf_ids, position[np.maximum(tree.children_right[order], 0)]))
+        feature.append(np.where(is_leaf, 0, tree.feature[order]))
+        threshold.append(np.where(is_leaf, 0.0, tree.threshold[order]))
+        leaf_value.append(tree.value[order[is_leaf], 0, 0])
+
+        n_leaves += int(is_leaf.sum())
+        offsets.append(offsets[-1] + len(order))
+
+    n_features = model.n_features_in_
+    return {
+        "tree_offsets": np.array(offsets, dtype=np.int32),
+        "right": np.concatenate(right).astype(np.int32),
+        "feature": np.concatenate(feature).astype(np.uint8 if n_features <= 256 else np.uint16),
+        "threshold": _round_down_float32(np.concatenate(threshold)),
+        "leaf_value": np.concatenate(leaf_value).astype(np.float64),
+    }
+
+
+def tree_predictions(forest, X, chunksize=8192):
+    """(n_trees, n_samples) prediction of every tree, all trees and rows walked together."""
+    X = np.asarray(X, dtype=np.float32)
+    if len(X) > chunksize:
+        return np.concatenate([tree_predictions(forest, X[start:start + chunksize], chunksize)
+                               for start in range(0, len(X), chunksize)], axis=1)
+    right, feature, threshold = forest["right"], forest["feature"], forest["threshold"]
+    rows = np.arange(len(X))
+    node = np.repeat(forest["tree_offsets"][:-1, None].astype(np.int64), len(X), axis=1)
+    while True:
+        split = right[node] >= 0
+        if not split.any():
+            break
+        current = node[split]
+        go_left = X[np.broadcast_to(rows, node.shape)[split], feature[current]] <= threshold[current]
+        node[split] = np.where(go_left, current + 1, right[current])
+    return forest["leaf_value"][~right[node]]
+
+
+def predict(forest, X):
+    """Forest prediction, the mean over trees like RandomForestRegressor.predict."""
+    return tree_predictions(forest, X).mean(axis=0)
+
+
+def _dtype_name(dtype):
+    return np.dtype(dtype).newbyteorder("<").str
+
+
+def write_arrays(path, arrays, header=None):
+    """Write named arrays after a JSON header, each little-endian and 8-byte aligned.
+
+    Layout: MAGIC, uint32 header length, header JSON (padded), array data.
+    """
+    header = dict(header or {})
+    entries, blocks, offset = {}, [], 0
+    digest = hashlib.sha256()
+    for name, array in arrays.items():
+        dtype = _dtype_name(np.asarray(array).dtype)
+        data = np.ascontiguousarray(array, dtype=dtype).tobytes()
+        data += b"\0" * (-len(data) % ALIGN)
+        entries[name] = {"dtype": dtype, "shape": list(np.shape(array)), "offset": offset}
+        digest.update(data)
+        blocks.append(data)
+        offset += len(data)
+    header["arrays"] = entries
+    header["sha256"] = digest.hexdigest()
+
+    encoded = json.dumps(header).encode()
+    start = len(MAGIC) + 4 + len(encoded)
+    encoded += b" " * (-start % ALIGN)
+    # write next to the target and rename, so readers never map a half-written file
+    with open(path + ".tmp", "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+        for data in blocks:
+            f.write(data)
+    os.replace(path + ".tmp", path)
+    return header
+
+
+def read_arrays(path, mmap=True, verify=False):
+    """(header, arrays) of a file written by write_arrays; arrays are read-only memmaps when mmap.
+
+    verify recomputes the SHA-256 of the array data and raises ValueError on a mismatch.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a model array file")
+        (length,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length))
+    base = len(MAGIC) + 4 + length
+    if mmap:
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        with open(path, "rb") as f:
+            buffer = np.frombuffer(f.read(), dtype=np.uint8)
+    if verify and hashlib.sha256(buffer[base:]).hexdigest() != header.get("sha256"):
+        raise ValueError(f"{path} is corrupt: its data does not match the header hash")
+
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        start = base + entry["offset"]
+        arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(entry["shape"])
+    return header, arrays
@@ -0,0 +1,97 @@
+"""Geodesic spatial clustering for earthquake locations.
+
+KMeans on raw (latitude, longitude) treats degrees as flat distances, which
+stretches clusters near the poles and splits them at the antimeridian. Here
+points are embedded as 3D unit vectors, where straight-line (chord) distance
+grows monotonically with great-circle distance, and clustered there; centroids
+are projected back onto the sphere. Nearest-centroid assignment and radius
+queries go through BallTrees with the haversine metric.
+"""
+from sklearn.cluster import KMeans
+from sklearn.neighbors import BallTree
+import numpy as np
+import joblib
+import os
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+def to_unit_vectors(lat, lon):
+    lat, lon = np.radians(lat), np.radians(lon)
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def to_latlon(vectors):
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    lat = np.degrees(np.arcsin(np.clip(vectors[:, 2], -1, 1)))
+    lon = np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0]))
+    return lat, lon
+
+
+def _radians(lat, lon):
+    return np.radians(np.column_stack([np.asarray(lat, dtype=np.float64),
+                                       np.asarray(lon, dtype=np.float64)]))
+
+
+class GeoClusterIndex:
+    """Spherical KMeans clusters plus haversine BallTree lookups."""
+
+    def __init__(self, n_clusters=8, random_state=42):
+        self.n_clusters = n_clusters
+        self.random_state = random_state
+        self.point_tree = None
+
+    def fit(self, lat, lon):
+        """Cluster points on the sphere and build the centroid index."""
+        kmeans = KMeans(n_clusters=self.n_clusters, random_state=self.random_state)
+        kmeans.fit(to_unit_vectors(lat, lon))
+
+        # the mean of unit vectors lies inside the sphere, push it back out
+        self.centers_lat, self.centers_lon = to_latlon(kmeans.cluster_centers_)
+        self.center_tree = BallTree(_radians(self.centers_lat, self.centers_lon), metric="haversine")
+        return self
+
+    @property
+    def cluster_centers_(self):
+        return np.column_stack([self.centers_lat, self.centers_lon])
+
+    def assign(self, lat, lon):
+        """Nearest centroid for every point. Returns (labels, distance_km)."""
+        distance, label = self.center_tree.query(_radians(lat, lon), k=1)
+        return label[:, 0], distance[:, 0] * EARTH_RADIUS_KM
+
+    def predict(self, coords):
+        """KMeans-style predict on an (n, 2) array of latitude/longitude."""
+        coords = np.asarray(coords, dtype=np.float64)
+        return self.assign(coords[:, 0], coords[:, 1])[0]
+
+    def index_points(self, lat, lon):
+        """Build a point index for neighborhood queries."""
+        self.point_tree = BallTree(_radians(lat, lon), metric="haversine")
+        return self
+
+    def neighbors(self, lat, lon, radius_km):
+        """Indices of indexed points within radius_km of each query point."""
+        if self.point_tree is None:
+            raise RuntimeError("call index_points() before neighbors()")
+        return self.point_tree.query_radius(_radians(np.atleast_1d(lat), np.atleast_1d(lon)),
+                                            r=radius_km / EARTH_RADIUS_KM)
+
+    def assign_features(self, features):
+        """Cluster labels for GeoJSON features such as the USGS all_day feed."""
+        coords = np.array([f["geometry"]["coordinates"][:2] for f in features], dtype=np.float64).reshape(-1, 2)
+        if not len(coords):
+            return np.empty(0, dtype=np.int64)
+        return self.assign(coords[:, 1], coords[:, 0])[0]
+
+    def save(self, path=None):
+        joblib.dump(self, path or get_absolute_path("geo_kmeans_model.pkl"))
+
+    @staticmethod
+    def load(path=None):
+        return joblib.load(path or get_absolute_path("geo_kmeans_model.pkl"))
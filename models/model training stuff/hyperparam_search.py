@@ -0,0 +1,146 @@
+"""Parallel search over cluster counts and RandomForest settings.
+
+For every n_clusters the KMeans labels and the yearly lag-feature matrix are
+built once and cached on disk under search_cache/, keyed by the catalog
+contents and k; the coordinates go to each clustering worker once, through
+the pool initializer. Trials (k x RF parameter combination) are scored with
+TimeSeriesSplit in a second process pool; each worker loads the cached
+features for its k instead of reclustering. Results are written to leaderboard.csv.
+"""
+from imports import pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import joblib
+from sklearn.cluster import KMeans
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import TimeSeriesSplit, cross_validate
+from catalog_store import load_training
+from model_training import cluster_year_counts, build_features
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+CACHE_DIR = get_absolute_path("search_cache")
+
+DEFAULT_CLUSTERS = [4, 6, 8, 10, 12, 16]
+DEFAULT_GRID = {
+    "n_estimators": [100, 200],
+    "max_depth": [None, 4, 8],
+    "min_samples_leaf": [1, 2, 4],
+    "max_features": [1.0, "sqrt"],
+}
+
+
+def catalog_fingerprint(df):
+    """Hash of the coordinates and years the features are built from."""
+    digest = hashlib.sha256()
+    for column in ["latitude", "longitude", "date"]:
+        digest.update(np.ascontiguousarray(df[column].to_numpy()).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def feature_cache_path(fingerprint, n_clusters):
+    return os.path.join(CACHE_DIR, f"features_{fingerprint}_k{n_clusters}.pkl")
+
+
+_worker = {}
+
+
+def _init_worker(coords, years):
+    _worker.update(coords=coords, years=years)
+
+
+def build_cached_features(fingerprint, n_clusters, coords=None, years=None):
+    """Cluster the catalog with k clusters and cache (X, y) unless already cached.
+
+    coords and years default to the ones _init_worker gave the worker process.
+    """
+    path = feature_cache_path(fingerprint, n_clusters)
+    if os.path.exists(path):
+        return path
+    coords = _worker["coords"] if coords is None else coords
+    years = _worker["years"] if years is None else years
+    labels = KMeans(n_clusters=n_clusters, random_state=42).fit_predict(coords)
+    counts = cluster_year_counts(years, labels, n_clusters)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    joblib.dump(build_features(counts), path)
+    return path
+
+
+_features = {}
+
+
+def run_trial(path, n_clusters, params, n_splits):
+    """Score one parameter set with TimeSeriesSplit; runs inside a worker process."""
+    if path not in _features:
+        _features[path] = joblib.load(path)
+    X, y = _features[path]
+
+    start = time.perf_counter()
+    cv = TimeSeriesSplit(n_splits=min(n_splits, len(X) - 1))
+    scores = cross_validate(RandomForestRegressor(random_state=42, **params), X, y, cv=cv,
+                            scoring=["r2", "neg_root_mean_squared_error"])
+    r2, rmse = scores["test_r2"], -scores["test_neg_root_mean_squared_error"]
+    return {"n_clusters": n_clusters, **params,
+            "cv_r2_mean": float(np.nanmean(r2)), "cv_r2_std": float(np.nanstd(r2)),
+            "cv_rmse_mean": float(rmse.mean()), "seconds": time.perf_counter() - start}
+
+
+def search(cluster_counts=None, grid=None, n_splits=5, workers=None, out=None):
+    cluster_counts = cluster_counts or DEFAULT_CLUSTERS
+    grid = grid or DEFAULT_GRID
+    out = out or get_absolute_path("leaderboard.csv")
+
+    df = load_training(columns=["latitude", "longitude", "date"])
+    df = df.dropna(subset=["latitude", "longitude", "date"])
+    fingerprint = catalog_fingerprint(df)
+    coords = df[["latitude", "longitude"]].to_numpy(dtype=np.float64)
+    years = df["date"].astype(int).to_numpy()
+    del df
+
+    # clustering runs once per k, in parallel, and is skipped when cached
+    paths = {k: feature_cache_path(fingerprint, k) for k in cluster_counts}
+    missing = [k for k, path in paths.items() if not os.path.exists(path)]
+    if missing:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), len(missing)),
+                                 initializer=_init_worker, initargs=(coords, years)) as pool:
+            list(pool.map(build_cached_features, [fingerprint] * len(missing), missing))
+    print(f"✓ Features ready for k in {cluster_counts} ({len(missing)} newly clustered)")
+    del coords, years
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        combos = [dict(zip(grid, values)) for values in product(*grid.values())]
+        futures = [pool.submit(run_trial, paths[k], k, params, n_splits)
+                   for k in cluster_counts for params in combos]
+        results = []
+        for i, future in enumerate(as_completed(futures), 1):
+            results.append(future.result())
+            if i % 20 == 0 or i == len(futures):
+                print(f"  {i}/{len(futures)} trials done")
+
+    leaderboard = (pd.DataFrame(results)
+                   .sort_values(["cv_r2_mean", "cv_rmse_mean"], ascending=[False, True])
+                   .reset_index(drop=True))
+    leaderboard.to_csv(out, index=False)
+    print(f"\n✓ Leaderboard saved to {out}")
+    print(leaderboard.head(10).to_string())
+    return leaderboard
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clusters", type=int, nargs="+", default=None)
+    parser.add_argument("--grid", default=None, help="JSON object of RandomForest parameter lists")
+    parser.add_argument("--splits", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    search(args.clusters, json.loads(args.grid) if args.grid else None, args.splits, args.workers)
@@ -0,0 +1,152 @@
+"""Incremental catalog updates from USGS GeoJSON feeds.
+
+Instead of rerunning dataCleaner over the whole history, a delta file in the
+USGS feed format (the same all_day.geojson script.js reads) is cleaned with the
+same filters, deduped against a watermark and appended to the catalog store,
+the compact event store and training.csv. Per-year counts in Frequency.csv are updated in place.
+"""
+from imports import pd
+from cleanData import filterEvents, DAY_COLUMNS
+import catalog_store
+import event_store
+import instrumentation
+import json
+import os
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+WATERMARK_FILE = get_absolute_path("training.watermark.json")
+
+# ids are remembered this long, the longest window of the USGS summary feeds
+RETENTION_MS = 30 * 24 * 60 * 60 * 1000
+
+OUTPUT_COLUMNS = ["data_type", "magnitudo", "longitude", "latitude", "date"]
+
+
+def load_watermark():
+    try:
+        with open(WATERMARK_FILE, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"last_time": None, "last_id": None, "next_index": None, "recent_ids": {}}
+
+
+def save_watermark(watermark):
+    tmp = WATERMARK_FILE + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(tmp, WATERMARK_FILE)
+
+
+def features_to_frame(features):
+    """Turn GeoJSON features into rows shaped like earthquakes.csv."""
+    rows = []
+    for feature in features:
+        props = feature.get("properties") or {}
+        coords = (feature.get("geometry") or {}).get("coordinates") or [None, None]
+        rows.append({
+            "id": feature.get("id"),
+            "time": props.get("time"),
+            "data_type": props.get("type"),
+            "magnitudo": props.get("mag"),
+            "longitude": coords[0],
+            "latitude": coords[1],
+        })
+    frame = pd.DataFrame(rows, columns=["id", "time", "data_type", "magnitudo", "longitude", "latitude"])
+    frame = frame.dropna(subset=["id", "time"])
+    frame["time"] = frame["time"].astype("int64")
+    frame = frame.astype({"magnitudo": "float64", "longitude": "float64", "latitude": "float64"})
+    frame["date"] = pd.to_datetime(frame["time"], unit="ms", utc=True).dt.strftime("%Y-%m-%d %H:%M:%S%z")
+    return frame
+
+
+def _last_csv_index(path):
+    """Index of the last row in training.csv, read from the end of the file."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 4096))
+        lines = f.read().splitlines()
+    last = lines[-1].split(b",", 1)[0] if lines else b""
+    return int(last) if last.isdigit() else -1
+
+
+def _dedupe(frame, watermark):
+    frame = frame.sort_values("time").drop_duplicates("id", keep="last")
+    frame = frame[~frame["id"].isin(watermark["recent_ids"].keys())]
+    if watermark["last_time"] is not None:
+        # ids older than the window are forgotten, so a late or revised event
+        # from before it cannot be told from one already stored; it is skipped
+        recent = frame["time"] > watermark["last_time"] - RETENTION_MS
+        instrumentation.rows("older_than_id_window", len(frame), int(recent.sum()))
+        if not recent.all():
+            print(f"⚠️  Skipped {int((~recent).sum())} events older than the {RETENTION_MS // 86_400_000}-day id window "
+                  f"(oldest {pd.to_datetime(frame['time'][~recent].min(), unit='ms', utc=True):%Y-%m-%d})")
+        frame = frame[recent]
+    return frame
+
+
+def _update_frequency(new_counts):
+    freq = catalog_store.load_frequency().set_index("date")["count"]
+    freq = freq.add(new_counts, fill_value=0).astype("int64").sort_values(ascending=False)
+    freq.index.name = "date"
+    freq.name = "count"
+
+    catalog_store.write_frequency(freq)
+    csv_path = get_absolute_path("Frequency.csv")
+    if os.path.exists(csv_path):
+        freq.to_csv(csv_path)
+
+
+def apply_features(features):
+    """Append new events from GeoJSON features. Returns the number added."""
+    watermark = load_watermark()
+    delta = _dedupe(features_to_frame(features), watermark)
+    cleaned = filterEvents(delta.copy())
+
+    if not cleaned.empty:
+        rows = cleaned[OUTPUT_COLUMNS]
+        catalog_store.write_events(cleaned[OUTPUT_COLUMNS + DAY_COLUMNS],
+                                   part=f"delta-{int(cleaned['time'].max())}")
+        if event_store.exists():
+            event_store.append(cleaned)
+
+        csv_path = get_absolute_path("training.csv")
+        if os.path.exists(csv_path):
+            start = watermark["next_index"]
+            if start is None:
+                start = _last_csv_index(csv_path) + 1
+            rows = rows.set_axis(range(start, start + len(rows)))
+            rows.to_csv(csv_path, mode="a", header=False)
+            watermark["next_index"] = start + len(rows)
+
+        _update_frequency(cleaned["date"].astype("int64").value_counts())
+
+        newest = cleaned.loc[cleaned["time"].idxmax()]
+        if watermark["last_time"] is None or newest["time"] > watermark["last_time"]:
+            watermark["last_time"] = int(newest["time"])
+            watermark["last_id"] = newest["id"]
+
+        recent = watermark["recent_ids"]
+        recent.update(zip(cleaned["id"].tolist(), cleaned["time"].tolist()))
+        cutoff = watermark["last_time"] - RETENTION_MS
+        watermark["recent_ids"] = {i: t for i, t in recent.items() if t > cutoff}
+
+    save_watermark(watermark)
+    return len(cleaned)
+
+
+def apply_delta_file(path):
+    with open(path, 'r') as f:
+        collection = json.load(f)
+    added = apply_features(collection.get("features", []))
+    print(f"✓ Added {added} new events from {path}")
+    return added
+
+
+if __name__ == "__main__":
+    import sys
+    for delta_path in sys.argv[1:]:
+        apply_delta_file(delta_path)
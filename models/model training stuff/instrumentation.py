@@ -0,0 +1,316 @@
+"""Timers, counters and memory high-water marks for the training and serving scripts.
+
+    with instrumentation.stage("clean", chunksize=250_000):
+        ...
+        instrumentation.rows("magnitude", rows_in, rows_out)
+
+Every finished stage becomes one record with its wall time, peak RSS and the
+rows in/out of each filter applied inside it. The process high-water mark is
+never reset: a stage that raised it reports it exactly, any other stage
+reports the highest RSS sampled while it ran (peak_is_exact false). Hot calls such as predictions
+use observe(), which only adds to an in-memory timer; timers and counters are
+written when the process exits (or on flush()).
+
+Records are appended as JSON lines to the file named by EQ_METRICS (or passed
+to configure()); without it everything stays in memory. EQ_PROFILE=cprofile
+or EQ_PROFILE=sample profiles the outermost stage (or the stages listed in
+EQ_PROFILE_STAGES) into EQ_PROFILE_DIR: a .prof file for pstats/snakeviz, or
+collapsed stacks for flamegraph.pl / speedscope from a SIGPROF sampler.
+
+python instrumentation.py metrics.jsonl summarizes a metrics file.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_config = {"path": os.environ.get("EQ_METRICS") or None,
+           "profile": os.environ.get("EQ_PROFILE") or None,
+           "profile_dir": os.environ.get("EQ_PROFILE_DIR", "profiles"),
+           "profile_stages": set(filter(None, os.environ.get("EQ_PROFILE_STAGES", "").split(",")))}
+
+_stack = []
+_counters = {}
+_timers = {}
+_profiling = [False]
+
+
+def configure(path=None, profile=None, profile_dir=None, profile_stages=None):
+    """Override the EQ_METRICS / EQ_PROFILE* settings from code (e.g. a CLI flag)."""
+    if path is not None:
+        _config["path"] = path
+        # worker processes (pipeline, hyperparameter search) pick it up from the environment
+        os.environ["EQ_METRICS"] = path
+    if profile is not None:
+        _config["profile"] = profile
+    if profile_dir is not None:
+        _config["profile_dir"] = profile_dir
+    if profile_stages is not None:
+        _config["profile_stages"] = set(profile_stages)
+
+
+def _emit(record):
+    if not _config["path"]:
+        return
+    record = {"ts": round(time.time(), 3), "pid": os.getpid(), **record}
+    with open(_config["path"], "a") as f:
+        f.write(json.dumps(record, default=float) + "\n")
+
+
+# ---- memory ----
+
+def _rss_mb(field):
+    """VmHWM (peak) or VmRSS (current) from /proc, in MB; None off Linux."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    peak = _rss_mb("VmHWM:")
+    if peak is None:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, KB elsewhere
+        peak /= 1024 * 1024 if sys.platform == "darwin" else 1024
+    return peak
+
+
+# seconds between VmRSS samples while a stage is open
+SAMPLE_INTERVAL = 0.01
+
+
+class _RssSampler:
+    """Raise `_sampled_peak` of every open stage to the current RSS until stopped."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            rss = _rss_mb("VmRSS:")
+            if rss is None:
+                return
+            for record in list(_stack):
+                if rss > record["_sampled_peak"]:
+                    record["_sampled_peak"] = rss
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+# ---- profilers ----
+
+class _Sampler:
+    """Collapsed call stacks sampled on SIGPROF (CPU time), main thread only."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = {}
+
+    def _sample(self, signum, frame):
+        names = []
+        while frame is not None and len(names) < 128:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        key = ";".join(reversed(names))
+        self.samples[key] = self.samples.get(key, 0) + 1
+
+    def start(self):
+        import signal
+        self.previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self, path):
+        import signal
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous)
+        with open(path, "w") as f:
+            for key, n in sorted(self.samples.items()):
+                f.write(f"{key} {n}\n")
+
+
+class _CProfile:
+    def start(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self, path):
+        self.profile.disable()
+        self.profile.dump_stats(path)
+
+
+def _start_profiler(name):
+    mode = _config["profile"]
+    if not mode or _profiling[0]:
+        return None
+    wanted = _config["profile_stages"]
+    if (wanted and name not in wanted) or (not wanted and _stack[:-1]):
+        return None
+    if mode == "sample":
+        import threading
+        if threading.current_thread() is not threading.main_thread():
+            return None
+        profiler = _Sampler()
+    elif mode == "cprofile":
+        profiler = _CProfile()
+    else:
+        raise ValueError(f"EQ_PROFILE must be 'cprofile' or 'sample', not {mode!r}")
+    profiler.start()
+    _profiling[0] = True
+    return profiler
+
+
+def _stop_profiler(profiler, name):
+    os.makedirs(_config["profile_dir"], exist_ok=True)
+    suffix = "prof" if isinstance(profiler, _CProfile) else "folded"
+    path = os.path.join(_config["profile_dir"], f"{name}.{os.getpid()}.{suffix}")
+    profiler.stop(path)
+    _profiling[0] = False
+    return path
+
+
+# ---- stages, counters and timers ----
+
+@contextmanager
+def stage(name, **fields):
+    """Time a block, track its peak RSS and collect rows() calls made inside it.
+
+    Works as a decorator too. Extra keyword arguments are stored in the record.
+    """
+    record = {"type": "stage", "stage": name, "parent": _stack[-1]["stage"] if _stack else None,
+              **fields, "filters": {}, "rss_start_mb": _rss_mb("VmRSS:")}
+    record["_hwm_start"] = peak_rss_mb()
+    record["_sampled_peak"] = record["rss_start_mb"] or 0.0
+    sampler = None if _stack else _RssSampler().start()
+    _stack.append(record)
+    profiler = _start_profiler(name)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        if profiler is not None:
+            record["profile"] = _stop_profiler(profiler, name)
+        _stack.pop()
+        if sampler is not None:
+            sampler.stop()
+        # the process high-water mark only moves while a new peak is being
+        # set, so if it moved during the stage it is the stage's own peak
+        hwm = peak_rss_mb()
+        exact = hwm > record.pop("_hwm_start")
+        sampled = max(record.pop("_sampled_peak"), _rss_mb("VmRSS:") or 0.0)
+        record["peak_rss_mb"] = hwm if exact else sampled
+        record["peak_is_exact"] = exact
+        if not record["filters"]:
+            del record["filters"]
+        _emit(record)
+
+
+def rows(name, rows_in, rows_out):
+    """Record a filter step inside the current stage; repeated calls (chunks) add up."""
+    if not _stack:
+        return
+    totals = _stack[-1]["filters"].setdefault(name, {"rows_in": 0, "rows_out": 0})
+    totals["rows_in"] += int(rows_in)
+    totals["rows_out"] += int(rows_out)
+
+
+def count(name, value=1):
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, start, n=1):
+    """Add the time since `start` (a perf_counter value) to the timer `name`.
+
+    Cheap enough for per-prediction calls; n is the number of rows served.
+    """
+    elapsed = time.perf_counter() - start
+    timer = _timers.get(name)
+    if timer is None:
+        timer = _timers[name] = [0, 0, 0.0, 0.0]
+    timer[0] += 1
+    timer[1] += n
+    timer[2] += elapsed
+    if elapsed > timer[3]:
+        timer[3] = elapsed
+
+
+def snapshot():
+    """Current counters and timers."""
+    return {
+        "counters": dict(_counters),
+        "timers": {name: {"calls": calls, "rows": n, "total_seconds": total,
+                          "mean_ms": 1000 * total / calls, "max_ms": 1000 * slowest}
+                   for name, (calls, n, total, slowest) in _timers.items()},
+    }
+
+
+def flush():
+    """Write the counters and timers accumulated so far and start over."""
+    current = snapshot()
+    for name, value in current["counters"].items():
+        _emit({"type": "counter", "name": name, "value": value})
+    for name, timer in current["timers"].items():
+        _emit({"type": "timer", "name": name, **timer})
+    _counters.clear()
+    _timers.clear()
+    if _config["path"] and (current["counters"] or current["timers"]):
+        _emit({"type": "process", "peak_rss_mb": peak_rss_mb()})
+
+
+atexit.register(flush)
+
+
+def summarize(path):
+    """Total time, calls and peak RSS per stage, and merged timers, from a metrics file."""
+    stages, timers = {}, {}
+    with open(path, "r") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["type"] == "stage":
+                s = stages.setdefault(record["stage"], {"runs": 0, "seconds": 0.0, "peak_rss_mb": 0.0})
+                s["runs"] += 1
+                s["seconds"] += record["seconds"]
+                s["peak_rss_mb"] = max(s["peak_rss_mb"], record["peak_rss_mb"] or 0.0)
+            elif record["type"] == "timer":
+                t = timers.setdefault(record["name"], {"calls": 0, "rows": 0, "total_seconds": 0.0, "max_ms": 0.0})
+                t["calls"] += record["calls"]
+                t["rows"] += record["rows"]
+                t["total_seconds"] += record["total_seconds"]
+                t["max_ms"] = max(t["max_ms"], record["max_ms"])
+    return stages, timers
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="JSON lines file written with EQ_METRICS")
+    args = parser.parse_args()
+
+    stages, timers = summarize(args.path)
+    print(f"{'stage':32s} {'runs':>5s} {'seconds':>10s} {'peak RSS MB':>12s}")
+    for name, s in sorted(stages.items(), key=lambda item: -item[1]["seconds"]):
+        print(f"{name:32s} {s['runs']:5d} {s['seconds']:10.3f} {s['peak_rss_mb']:12.1f}")
+    if timers:
+        print(f"\n{'timer':32s} {'calls':>8s} {'rows':>10s} {'mean ms':>9s} {'max ms':>9s}")
+        for name, t in sorted(timers.items()):
+            print(f"{name:32s} {t['calls']:8d} {t['rows']:10d} "
+                  f"{1000 * t['total_seconds'] / t['calls']:9.3f} {t['max_ms']:9.3f}")
@@ -0,0 +1,94 @@
+"""Load test for prediction_service.py.
+
+Opens `--connections` keep-alive connections and sends `--requests` requests
+on each, cycling through the year, range, cluster and assignment endpoints.
+Reports p50/p99 latency and throughput.
+"""
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+
+def make_request(kind, n_clusters, rng):
+    if kind == "year":
+        return "GET", f"/predict/year?year={rng.randint(1990, 2100)}", b""
+    if kind == "range":
+        start = rng.randint(1990, 2090)
+        return "GET", f"/predict/range?start={start}&end={start + rng.randint(0, 10)}", b""
+    if kind == "clusters":
+        counts = [[rng.randint(100, 3000) for _ in range(n_clusters)] for _ in range(3)]
+        return "POST", "/predict/clusters", json.dumps({"counts": counts}).encode()
+    return "GET", f"/cluster?lat={rng.uniform(-60, 60):.4f}&lon={rng.uniform(-180, 180):.4f}", b""
+
+
+async def client(host, port, n_requests, kinds, n_clusters, seed, latencies, errors):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(n_requests):
+            method, path, body = make_request(rng.choice(kinds), n_clusters, rng)
+            start = time.perf_counter()
+            writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run(host, port, connections, n_requests, kinds, n_clusters):
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, n_requests, kinds, n_clusters, seed, latencies, errors)
+                           for seed in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000
+    report = {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+    print(f"{report['requests']} requests ({report['errors']} errors) in {elapsed:.2f}s")
+    print(f"Throughput: {report['throughput_rps']:.0f} req/s")
+    print(f"Latency p50: {report['p50_ms']:.2f} ms   p99: {report['p99_ms']:.2f} ms")
+    return report
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=200, help="requests per connection")
+    parser.add_argument("--endpoints", default="year,range,clusters",
+                        help="comma separated: year, range, clusters, cluster")
+    parser.add_argument("--n-clusters", type=int, default=8)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.host, args.port, args.connections, args.requests,
+                    args.endpoints.split(","), args.n_clusters))
+
+
+if __name__ == "__main__":
+    main()
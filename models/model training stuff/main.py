@@ -1,8 +1,34 @@
 from cleanData import dataCleaner, modify
+from incremental import apply_delta_file
+import pipeline
+import instrumentation
+import argparse
+import os
 
 
 
 if __name__ == "__main__":
-    dataCleaner()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="stream earthquakes.csv in chunks of this many rows")
+    parser.add_argument("--csv", action="store_true",
+                        help="also export training.csv next to the catalog store")
+    parser.add_argument("--delta", nargs="+", default=None,
+                        help="append USGS GeoJSON delta files instead of a full clean")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="bring every stage up to date with pipeline.py (clean, count, cluster, train, export)")
+    parser.add_argument("--metrics", default=None,
+                        help="append stage timings and memory to this JSON lines file (same as EQ_METRICS)")
+    args = parser.parse_args()
+    if args.metrics:
+        instrumentation.configure(path=os.path.abspath(args.metrics))
+
+    if args.pipeline:
+        pipeline.run(chunksize=args.chunksize)
+    elif args.delta:
+        for path in args.delta:
+            apply_delta_file(path)
+    else:
+        dataCleaner(chunksize=args.chunksize, export_csv=args.csv)
+
 
-    
@@ -0,0 +1,126 @@
+"""Memory-mapped model artifacts that worker processes share.
+
+Unpickling a model builds a private copy of it in every process. Next to
+each pickle, training also writes the numbers prediction needs as an
+.arrays file (forest_arrays' container: uncompressed, 8-byte aligned):
+
+    earthquake_cluster_model_rf.arrays   the flattened trees
+    kmeans_model.arrays                  the centroids
+    earthquake_frequency_model.arrays    coefficient and intercept
+
+Loading maps the file read-only, so every worker reads the same pages of
+the page cache and N workers hold one copy of the trees.
+
+The header carries FORMAT_VERSION, the model kind, the SHA-256 of the
+array data and the version of the model it was exported from (the hash of
+its pickle). Training records the same under "artifact" in the model's
+info JSON. load() refuses an artifact whose version or hash differs from
+that record, or whose data does not match its hash. Callers then fall back
+to the pickle.
+"""
+import hashlib
+import os
+import forest_arrays
+
+FORMAT_VERSION = 1
+SUFFIX = ".arrays"
+
+
+class ArtifactError(ValueError):
+    pass
+
+
+def artifact_path(pickle_path):
+    return os.path.splitext(pickle_path)[0] + SUFFIX
+
+
+def _pickle_version(pickle_path):
+    digest = hashlib.sha256()
+    with open(pickle_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def _arrays(model):
+    """(kind, arrays) of a fitted RandomForestRegressor, KMeans or LinearRegression."""
+    import numpy as np
+    if hasattr(model, "estimators_"):
+        return "random_forest", forest_arrays.flatten_forest(model)
+    if hasattr(model, "cluster_centers_"):
+        return "kmeans", {"centers": np.asarray(model.cluster_centers_, dtype=np.float64)}
+    if hasattr(model, "coef_"):
+        return "linear", {"coef": np.ravel(model.coef_).astype(np.float64),
+                          "intercept": np.atleast_1d(model.intercept_).astype(np.float64)}
+    raise TypeError(f"no artifact format for {type(model).__name__}")
+
+
+def export(model, pickle_path):
+    """Write the artifact of a model saved at pickle_path; returns the record for its info JSON."""
+    kind, arrays = _arrays(model)
+    header = forest_arrays.write_arrays(artifact_path(pickle_path), arrays, {
+        "format": FORMAT_VERSION, "kind": kind, "version": _pickle_version(pickle_path)})
+    return describe(artifact_path(pickle_path), header)
+
+
+def describe(path, header=None):
+    """The info JSON record of an artifact file."""
+    if header is None:
+        header, _ = forest_arrays.read_arrays(path)
+    return {"file": os.path.basename(path), "format": header.get("format"), "kind": header.get("kind"),
+            "version": header.get("version"), "sha256": header.get("sha256")}
+
+
+def load(path, kind, expected=None, verify=True):
+    """Memory-mapped arrays of an artifact, checked against the `expected` info record."""
+    try:
+        header, arrays = forest_arrays.read_arrays(path, verify=verify)
+    except (OSError, ValueError) as e:
+        raise ArtifactError(str(e)) from e
+    if header.get("format") != FORMAT_VERSION:
+        raise ArtifactError(f"{path} has format {header.get('format')}, expected {FORMAT_VERSION}")
+    if header.get("kind") != kind:
+        raise ArtifactError(f"{path} holds a {header.get('kind')} model, expected {kind}")
+    if expected is not None:
+        for field in ("version", "sha256"):
+            if header.get(field) != expected.get(field):
+                raise ArtifactError(f"{path} does not match the model info ({field} differs)")
+    return arrays
+
+
+def load_for(pickle_path, kind, info=None, key="artifact"):
+    """The artifact next to pickle_path, or None when it is missing or does not check out.
+
+    With an info dict, the artifact must match its record under `key`; an
+    info JSON written before artifacts existed has none and the pickle is used.
+    """
+    path = artifact_path(pickle_path)
+    if not os.path.exists(path) or (info is not None and key not in info):
+        return None
+    try:
+        return load(path, kind, info.get(key) if info is not None else None)
+    except ArtifactError as e:
+        print(f"⚠️  {e}; loading {os.path.basename(pickle_path)} instead")
+        return None
+
+
+def load_centers(kmeans_path, info=None):
+    """KMeans centroids, memory-mapped when kmeans_model.arrays is current, else unpickled."""
+    import numpy as np
+    arrays = load_for(kmeans_path, "kmeans", info, key="kmeans_artifact")
+    if arrays is not None:
+        return arrays["centers"]
+    from predict_earthquakes import _load_pickle
+    return np.asarray(_load_pickle(kmeans_path).cluster_centers_, dtype=np.float64)
+
+
+if __name__ == "__main__":
+    import argparse
+    import joblib
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pickles", nargs="+", help="model pickles to write artifacts for")
+    args = parser.parse_args()
+    for pickle_path in args.pickles:
+        record = export(joblib.load(pickle_path), pickle_path)
+        size = os.path.getsize(artifact_path(pickle_path))
+        print(f"✓ {record['file']}: {record['kind']}, {size / 1024:.1f} KB, version {record['version']}")
@@ -1,20 +1,221 @@
 from imports import train_test_split, pd
 from imports import plt
 import os
+import numpy as np
 from sklearn.cluster import KMeans
 from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from datetime import date
 import joblib
 import json
+from catalog_store import load_training, load_frequency
+from predict_earthquakes import cluster_feature_names
+import event_store
+import instrumentation
+import model_artifacts
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
 from sklearn.model_selection import TimeSeriesSplit, cross_val_score
 
+N_CLUSTERS = 8
+RF_PARAMS = {"n_estimators": 200, "random_state": 42}
+
 
 def get_absolute_path(filename):
     return os.path.join(os.path.dirname(__file__), filename)
 
 
-def main():
-    df = pd.read_csv(filepath_or_buffer=get_absolute_path("training.csv"))
-    df.drop("data_type")
-    
-    
+ROOT = get_absolute_path(os.path.join("..", ".."))
+
+
+def load_kmeans(coords, n_clusters=N_CLUSTERS, kmeans_path=None):
+    """kmeans_model.pkl when it matches n_clusters, otherwise a fresh fit on coords()."""
+    kmeans_path = kmeans_path or get_absolute_path("kmeans_model.pkl")
+    kmeans = joblib.load(kmeans_path) if os.path.exists(kmeans_path) else None
+    if kmeans is None or len(kmeans.cluster_centers_) != n_clusters:
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42).fit(coords())
+        joblib.dump(kmeans, kmeans_path)
+        model_artifacts.export(kmeans, kmeans_path)
+        print(f"✓ Fitted KMeans with {n_clusters} clusters, saved to {kmeans_path}")
+    elif not os.path.exists(model_artifacts.artifact_path(kmeans_path)):
+        model_artifacts.export(kmeans, kmeans_path)
+    return kmeans
+
+
+@instrumentation.stage("train.assign_clusters")
+def load_clusters(df, n_clusters=N_CLUSTERS, kmeans_path=None):
+    """Cluster labels for every event, reusing kmeans_model.pkl when it matches n_clusters."""
+    coords = df[["latitude", "longitude"]].to_numpy(dtype=np.float64)
+    return load_kmeans(lambda: coords, n_clusters, kmeans_path).predict(coords)
+
+
+@instrumentation.stage("train.assign_clusters")
+def store_clusters(n_clusters=N_CLUSTERS, kmeans_path=None):
+    """Years and cluster labels of the compact event store, labelling it first if stale."""
+    store = event_store.EventStore()
+
+    def coords():
+        located = store.coords()
+        return located[~np.isnan(located).any(axis=1)]
+
+    centers = load_kmeans(coords, n_clusters, kmeans_path).cluster_centers_
+
+    labels = store.labels_for(centers)
+    if labels is None:
+        event_store.assign_clusters(centers)
+        store = event_store.EventStore()
+        labels = store.labels_for(centers)
+    # -1 marks events without coordinates
+    known = labels >= 0
+    instrumentation.rows("located", len(known), int(known.sum()))
+    return np.asarray(store["year"][known], dtype=np.int64), np.asarray(labels[known])
+
+
+def event_clusters(n_clusters=N_CLUSTERS, kmeans_path=None):
+    """Year and cluster label of every located event, from the compact store when it exists."""
+    if event_store.exists():
+        return store_clusters(n_clusters, kmeans_path)
+    with instrumentation.stage("train.load"):
+        df = load_training(columns=["latitude", "longitude", "date"])
+        rows_in = len(df)
+        df = df.dropna(subset=["latitude", "longitude", "date"])
+        instrumentation.rows("complete_rows", rows_in, len(df))
+    return df["date"].astype(int).to_numpy(), load_clusters(df, n_clusters, kmeans_path)
+
+
+def cluster_year_counts(years, labels, n_clusters=N_CLUSTERS):
+    """Years x clusters table of event counts, with missing years filled with zeros."""
+    counts = (pd.DataFrame({"date": years, "cluster": labels})
+              .groupby(["date", "cluster"]).size()
+              .unstack(fill_value=0)
+              .reindex(columns=range(n_clusters), fill_value=0))
+    counts = counts.reindex(range(counts.index.min(), counts.index.max() + 1), fill_value=0)
+    counts.columns = [f"cluster_{i}" for i in counts.columns]
+    return counts
+
+
+def build_features(counts):
+    """Lag features per year and the next year's total as the target.
+
+    Matches ClusterPredictionModel.build_features: lags of each cluster count,
+    last year's total and the 3-year rolling mean of the total.
+    """
+    total = counts.sum(axis=1)
+    lag1 = counts.shift(1).add_suffix("_lag1")
+    lag2 = counts.shift(2).add_suffix("_lag2")
+    features = pd.concat([counts, lag1, lag2], axis=1)
+    features["total_lag1"] = total.shift(1)
+    features["total_roll3"] = total.rolling(3).mean()
+
+    target = total.shift(-1).rename("next_total")
+    data = pd.concat([features, target], axis=1).dropna()
+    X = data[cluster_feature_names(counts.shape[1])]
+    return X, data["next_total"]
+
+
+@instrumentation.stage("train.evaluate")
+def evaluate(X, y, params=None, n_jobs=-1, n_splits=5):
+    """Hold-out metrics on the last 20% of years plus TimeSeriesSplit CV R²."""
+    params = {**RF_PARAMS, **(params or {})}
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, shuffle=False)
+
+    model = RandomForestRegressor(n_jobs=n_jobs, **params).fit(X_train, y_train)
+    pred = model.predict(X_test)
+    mse = mean_squared_error(y_test, pred)
+
+    cv = TimeSeriesSplit(n_splits=min(n_splits, len(X) - 1))
+    cv_scores = cross_val_score(RandomForestRegressor(**params), X, y, cv=cv, scoring="r2", n_jobs=n_jobs)
+    return {
+        "r2": r2_score(y_test, pred),
+        "mse": mse,
+        "rmse": float(np.sqrt(mse)),
+        "mae": mean_absolute_error(y_test, pred),
+        "cv_r2_mean": float(np.nanmean(cv_scores)),
+    }
+
+
+@instrumentation.stage("train.clusters")
+def main(n_clusters=N_CLUSTERS, params=None, n_jobs=-1,
+         model_path=None, info_path=None, kmeans_path=None):
+    """Rebuild earthquake_cluster_model_rf.pkl and model_info.json from the cleaned catalog."""
+    model_path = model_path or os.path.join(ROOT, "earthquake_cluster_model_rf.pkl")
+    info_path = info_path or os.path.join(ROOT, "model_info.json")
+
+    years, labels = event_clusters(n_clusters, kmeans_path)
+    print(f"✓ Loaded {len(years)} events")
+
+    with instrumentation.stage("train.features"):
+        counts = cluster_year_counts(years, labels, n_clusters)
+        X, y = build_features(counts)
+        instrumentation.rows("lagged_years", len(counts), len(X))
+    print(f"✓ Built {len(X)} yearly feature rows ({counts.index.min()}-{counts.index.max()})")
+
+    metrics = evaluate(X, y, params, n_jobs)
+    print(f"Hold-out R²: {metrics['r2']:.4f}  RMSE: {metrics['rmse']:.2f}  CV R²: {metrics['cv_r2_mean']:.4f}")
+
+    # the shipped model is refit on every year
+    with instrumentation.stage("train.fit", rows=len(X)):
+        model = RandomForestRegressor(n_jobs=n_jobs, **{**RF_PARAMS, **(params or {})}).fit(X, y)
+    model.set_params(n_jobs=None)
+    joblib.dump(model, model_path)
+    print(f"✓ Saved model to {model_path}")
+
+    model_info = {"n_clusters": n_clusters, "features": list(X.columns), **metrics,
+                  "artifact": model_artifacts.export(model, model_path)}
+    kmeans_artifact = model_artifacts.artifact_path(kmeans_path or get_absolute_path("kmeans_model.pkl"))
+    if os.path.exists(kmeans_artifact):
+        model_info["kmeans_artifact"] = model_artifacts.describe(kmeans_artifact)
+    with open(info_path, "w") as f:
+        json.dump(model_info, f, indent=2)
+    print(f"✓ Saved model info to {info_path}")
+    return model, model_info
+
+
+@instrumentation.stage("train.frequency")
+def train_frequency_model(model_path=None, info_path=None):
+    """Fit the yearly-count LinearRegression used by predict_earthquakes and export_to_js."""
+    model_path = model_path or os.path.join(ROOT, "earthquake_frequency_model.pkl")
+    info_path = info_path or os.path.join(ROOT, "frequency_model_info.json")
+
+    freq = load_frequency().sort_values("date")
+    X, y = freq[["date"]].astype(float), freq["count"]
+    # hold out the most recent years, as for the cluster model
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, shuffle=False)
+
+    model = LinearRegression().fit(X_train, y_train)
+    pred = model.predict(X_test)
+    mse = mean_squared_error(y_test, pred)
+    joblib.dump(model, model_path)
+    print(f"✓ Saved frequency model to {model_path}")
+
+    model_info = {
+        "model_type": "LinearRegression",
+        "training_date": date.today().isoformat(),
+        "features": ["date"],
+        "target": "earthquake_count",
+        "performance_metrics": {
+            "r2_score": r2_score(y_test, pred),
+            "mse": mse,
+            "rmse": float(np.sqrt(mse)),
+            "mae": mean_absolute_error(y_test, pred),
+        },
+        "model_coefficients": {
+            "intercept": float(model.intercept_),
+            "slope": float(model.coef_[0]),
+        },
+        "usage_instructions": "Use predict_earthquakes.py to make new predictions",
+        "artifact": model_artifacts.export(model, model_path),
+    }
+    with open(info_path, "w") as f:
+        json.dump(model_info, f, indent=2)
+    print(f"✓ Saved frequency model info to {info_path}")
+    return model, model_info
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-clusters", type=int, default=N_CLUSTERS)
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    args = parser.parse_args()
+
+    main(n_clusters=args.n_clusters, n_jobs=args.n_jobs)
@@ -0,0 +1,322 @@
+"""Make-style runner for the clean -> modify -> cluster -> train -> export pipeline.
+
+Every stage declares its input files, parameters and output files. Its
+fingerprint is a SHA-256 over the parameters and the contents of its inputs
+(outputs of earlier stages included), so a stage only reruns when something
+it reads actually changed. Outputs are kept under .pipeline_cache/<stage>/<fingerprint>/
+and restored from there when an earlier configuration comes back, e.g. when
+switching n_clusters back and forth. Stages whose inputs are ready run
+concurrently in a process pool (the KMeans fit and the yearly frequency count
+both only need the cleaned catalog).
+"""
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from file_hashes import file_hash
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+ROOT = os.path.abspath(get_absolute_path(os.path.join("..", "..")))
+CACHE_DIR = get_absolute_path(".pipeline_cache")
+STATE_FILE = os.path.join(CACHE_DIR, "state.json")
+
+
+# ---- stage bodies (module level so they can run in worker processes) ----
+
+def run_clean(min_magnitude, chunksize=None):
+    from cleanData import dataCleaner
+    dataCleaner(chunksize=chunksize, min_magnitude=min_magnitude)
+
+
+def run_frequency():
+    from cleanData import modify
+    modify()
+
+
+def run_kmeans(n_clusters, kmeans_path):
+    from verify_kmeans import load_coords, fit_full, save_model
+    save_model(fit_full(load_coords(), n_clusters), kmeans_path)
+
+
+def run_cube(kmeans_path):
+    from aggregate import build_cube
+    build_cube(kmeans_path=kmeans_path)
+
+
+def run_spatial_index():
+    from spatial_index import build_index
+    build_index()
+
+
+def run_train_clusters(n_clusters, rf_params, kmeans_path, model_path, info_path):
+    from model_training import main
+    main(n_clusters=n_clusters, params=rf_params, kmeans_path=kmeans_path,
+         model_path=model_path, info_path=info_path)
+
+
+def run_tiles():
+    from density_tiles import build_tiles
+    build_tiles(png=True)
+
+
+def run_train_frequency(model_path, info_path):
+    from model_training import train_frequency_model
+    train_frequency_model(model_path, info_path)
+
+
+def run_export(info_path, out_dir):
+    sys.path.insert(0, get_absolute_path(".."))
+    from export_to_js import export_model_to_javascript
+    export_model_to_javascript(info_path, out_dir)
+
+
+def run_export_compact(cluster_model_path, kmeans_path, frequency_info_path, cluster_info_path, out_dir):
+    sys.path.insert(0, get_absolute_path(".."))
+    from export_to_js import export_compact_models
+    export_compact_models(cluster_model_path, kmeans_path, frequency_info_path, cluster_info_path, out_dir)
+
+
+def run_backtest(n_clusters, rf_params, kmeans_path):
+    from backtest import backtest
+    backtest(params=rf_params, n_clusters=n_clusters, kmeans_path=kmeans_path)
+
+
+def stages(n_clusters=8, min_magnitude=3.5, rf_params=None, chunksize=None):
+    """Stage table: name -> (function, kwargs, fingerprinted params, inputs, outputs)."""
+    import catalog_store
+    import event_store
+    from model_artifacts import artifact_path
+    rf_params = rf_params or {}
+    kmeans_path = get_absolute_path("kmeans_model.pkl")
+    frequency_model = os.path.join(ROOT, "earthquake_frequency_model.pkl")
+    frequency_info = os.path.join(ROOT, "frequency_model_info.json")
+    cluster_model = os.path.join(ROOT, "earthquake_cluster_model_rf.pkl")
+    cluster_info = os.path.join(ROOT, "model_info.json")
+
+    return {
+        "clean": (run_clean, {"min_magnitude": min_magnitude, "chunksize": chunksize},
+                  {"min_magnitude": min_magnitude},
+                  [get_absolute_path("earthquakes.csv"), get_absolute_path("cleanData.py"),
+                   get_absolute_path("catalog_store.py"), get_absolute_path("event_store.py"),
+                   get_absolute_path("instrumentation.py")],
+                  [catalog_store.EVENTS_DIR, event_store.STORE_DIR]),
+        "frequency": (run_frequency, {}, {},
+                      [catalog_store.EVENTS_DIR, event_store.STORE_DIR],
+                      [catalog_store.FREQUENCY_FILE]),
+        "kmeans": (run_kmeans, {"n_clusters": n_clusters, "kmeans_path": kmeans_path},
+                   {"n_clusters": n_clusters},
+                   [catalog_store.EVENTS_DIR, event_store.STORE_DIR],
+                   [kmeans_path, artifact_path(kmeans_path), event_store.LABELS_DIR]),
+        "cube": (run_cube, {"kmeans_path": kmeans_path}, {},
+                 [catalog_store.EVENTS_DIR, kmeans_path, get_absolute_path("aggregate.py")],
+                 [os.path.join(catalog_store.STORE_DIR, "cube.parquet"),
+                  os.path.join(catalog_store.STORE_DIR, "cube.json")]),
+        "spatial_index": (run_spatial_index, {}, {},
+                          [catalog_store.EVENTS_DIR, get_absolute_path("spatial_index.py")],
+                          [os.path.join(catalog_store.STORE_DIR, "spatial_index")]),
+        "tiles": (run_tiles, {}, {},
+                  [catalog_store.EVENTS_DIR, event_store.STORE_DIR, get_absolute_path("density_tiles.py")],
+                  [os.path.join(catalog_store.STORE_DIR, "tiles")]),
+        "train_frequency": (run_train_frequency, {"model_path": frequency_model, "info_path": frequency_info}, {},
+                            [catalog_store.FREQUENCY_FILE],
+                            [frequency_model, frequency_info, artifact_path(frequency_model)]),
+        "train_clusters": (run_train_clusters,
+                           {"n_clusters": n_clusters, "rf_params": rf_params, "kmeans_path": kmeans_path,
+                            "model_path": cluster_model, "info_path": cluster_info},
+                           {"n_clusters": n_clusters, "rf_params": rf_params},
+                           [catalog_store.EVENTS_DIR, event_store.STORE_DIR, event_store.LABELS_DIR, kmeans_path,
+                            get_absolute_path("model_training.py")],
+                           [cluster_model, cluster_info, artifact_path(cluster_model)]),
+        "backtest": (run_backtest, {"n_clusters": n_clusters, "rf_params": rf_params, "kmeans_path": kmeans_path},
+                     {"n_clusters": n_clusters, "rf_params": rf_params},
+                     [catalog_store.EVENTS_DIR, catalog_store.FREQUENCY_FILE, event_store.STORE_DIR,
+                      event_store.LABELS_DIR, kmeans_path,
+                      get_absolute_path("model_training.py"), get_absolute_path("backtest.py")],
+                     [get_absolute_path("backtest_frequency.csv"), get_absolute_path("backtest_clusters.csv")]),
+        "export": (run_export, {"info_path": frequency_info, "out_dir": ROOT}, {},
+                   [frequency_info, get_absolute_path(os.path.join("..", "export_to_js.py"))],
+                   [os.path.join(ROOT, name) for name in
+                    ("earthquake_model.js", "earthquake_demo.html", "nodejs_example.js")]),
+        "export_compact": (run_export_compact,
+                           {"cluster_model_path": cluster_model, "kmeans_path": kmeans_path,
+                            "frequency_info_path": frequency_info, "cluster_info_path": cluster_info,
+                            "out_dir": ROOT}, {},
+                           [cluster_model, kmeans_path, frequency_info, cluster_info,
+                            get_absolute_path(os.path.join("..", "export_to_js.py")),
+                            get_absolute_path("forest_arrays.py")],
+                           [os.path.join(ROOT, name) for name in ("earthquake_models.bin", "earthquake_models.js")]),
+    }
+
+
+# ---- fingerprinting ----
+
+def _files(path):
+    if os.path.isdir(path):
+        for folder, _, names in sorted(os.walk(path)):
+            for name in sorted(names):
+                yield os.path.join(folder, name)
+    elif os.path.exists(path):
+        yield path
+
+
+def fingerprint(name, params, inputs, known):
+    digest = hashlib.sha256(json.dumps([name, params], sort_keys=True).encode())
+    for path in inputs:
+        files = list(_files(path))
+        if not files:
+            raise FileNotFoundError(f"stage '{name}' is missing input {path}")
+        for file in files:
+            digest.update(os.path.relpath(file, ROOT).encode())
+            digest.update(file_hash(file, known).encode())
+    return digest.hexdigest()
+
+
+# ---- output cache ----
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _copy(src, dst):
+    _remove(dst)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.copy2(src, dst)
+
+
+def _cache_slot(name, key):
+    return os.path.join(CACHE_DIR, name, key)
+
+
+def store_outputs(name, key, outputs):
+    slot = _cache_slot(name, key)
+    for i, path in enumerate(outputs):
+        _copy(path, os.path.join(slot, str(i)))
+
+
+def restore_outputs(name, key, outputs):
+    slot = _cache_slot(name, key)
+    if not all(os.path.exists(os.path.join(slot, str(i))) for i in range(len(outputs))):
+        return False
+    for i, path in enumerate(outputs):
+        _copy(os.path.join(slot, str(i)), path)
+    return True
+
+
+# ---- runner ----
+
+def load_state():
+    try:
+        with open(STATE_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"stages": {}, "hashes": {}}
+
+
+def save_state(state):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(STATE_FILE, "w") as f:
+        json.dump(state, f, indent=2)
+
+
+def run(targets=None, force=False, workers=None, **config):
+    table = stages(**config)
+    producers = {os.path.abspath(out): name for name, stage in table.items() for out in stage[4]}
+    deps = {name: {producers[os.path.abspath(p)] for p in stage[3] if os.path.abspath(p) in producers}
+            for name, stage in table.items()}
+
+    # only the requested stages and everything they depend on
+    wanted, todo = set(), list(targets or table)
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(deps[name])
+
+    state = load_state()
+    done, running = set(), {}
+    summary = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while len(done) < len(wanted):
+            # keep scheduling while skipped stages unlock their dependents
+            progress = True
+            while progress:
+                progress = False
+                for name in sorted(wanted - done - {job[0] for job in running.values()}):
+                    if not deps[name] <= done:
+                        continue
+                    fn, kwargs, params, inputs, outputs = table[name]
+                    key = fingerprint(name, params, inputs, state["hashes"])
+                    up_to_date = state["stages"].get(name) == key and all(os.path.exists(p) for p in outputs)
+
+                    if up_to_date and not force:
+                        summary[name] = "up to date"
+                        done.add(name)
+                        progress = True
+                    elif not force and restore_outputs(name, key, outputs):
+                        state["stages"][name] = key
+                        summary[name] = "restored from cache"
+                        done.add(name)
+                        progress = True
+                    else:
+                        print(f"▶ {name}")
+                        for path in outputs:
+                            _remove(path)
+                        running[pool.submit(fn, **kwargs)] = (name, key, time.perf_counter())
+
+            if len(done) == len(wanted):
+                break
+            if not running:
+                raise RuntimeError("pipeline stalled, check the stage dependencies")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, key, started = running.pop(future)
+                future.result()
+                store_outputs(name, key, table[name][4])
+                state["stages"][name] = key
+                summary[name] = f"ran in {time.perf_counter() - started:.1f}s"
+                done.add(name)
+                save_state(state)
+
+    save_state(state)
+    print("\nPipeline summary:")
+    for name in table:
+        if name in summary:
+            print(f"  {name:16s} {summary[name]}")
+    return summary
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("targets", nargs="*", help="stages to bring up to date (default: all)")
+    parser.add_argument("--n-clusters", type=int, default=8)
+    parser.add_argument("--min-magnitude", type=float, default=3.5)
+    parser.add_argument("--rf-params", default=None, help="JSON object of RandomForest parameters")
+    parser.add_argument("--chunksize", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="rerun even if up to date")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    run(args.targets or None, force=args.force, workers=args.workers,
+        n_clusters=args.n_clusters, min_magnitude=args.min_magnitude,
+        rf_params=json.loads(args.rf_params) if args.rf_params else None,
+        chunksize=args.chunksize)
+
+
+if __name__ == "__main__":
+    main()
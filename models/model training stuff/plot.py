@@ -1,16 +1,16 @@
-from imports import sbn, plt, pd
+from imports import sbn, plt
+import numpy as np
+from catalog_store import load_training, load_frequency
+import density_tiles
 import os
 
 def get_absolute_path(filename):
     return os.path.join(os.path.dirname(__file__), filename)
 
-#Date/Frequency and training dataset
-df = pd.read_csv(get_absolute_path("training.csv"))
-freq = pd.read_csv(get_absolute_path("Frequency.csv"))
-
 
 #Visuzlize using a scatter plot
 def scatter():
+    freq = load_frequency()
     plt.scatter(x=freq['date'], y=freq["count"])
     plt.xlabel('year')
     plt.ylabel("freq")
@@ -20,10 +20,22 @@ def scatter():
 
 #visualize using a heatmap
 def heat():
+    df = load_training(columns=["magnitudo", "longitude", "latitude", "date"])
+
+    sbn.heatmap(df.corr())
+    plt.show()
 
-    df_copy= df.drop(columns="data_type")
 
-    sbn.heatmap(df_copy.corr())
+#event density from the precomputed tiles, same cost for any number of events
+def density(zoom=3, layer="all"):
+    if not os.path.exists(os.path.join(density_tiles.TILES_DIR, "tiles.json")):
+        density_tiles.build_tiles()
+    world = density_tiles.DensityTiles().mosaic(zoom, layer)
+    plt.imshow(np.log1p(world), cmap="inferno")
+    plt.axis("off")
+    plt.title(f"earthquake density ({layer}, zoom {zoom})")
     plt.show()
 
-scatter()
+
+if __name__ == "__main__":
+    scatter()
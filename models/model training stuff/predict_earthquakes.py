@@ -1,55 +1,125 @@
 """
 Earthquake Frequency Prediction Script
 This script loads the trained model and makes predictions for new dates.
+
+Both model classes accept lazy=True: only model_info.json is read up front and
+pandas, joblib and sklearn are imported the first time they are actually needed.
+The linear model never needs its pickle when frequency_model_info.json carries
+its coefficients. When training wrote a matching .arrays artifact (see
+model_artifacts.py) the models are memory-mapped from it instead of unpickled.
 """
 
-import joblib
 import json
-import pandas as pd
+import os
+import time
+import warnings
 import numpy as np
+import forest_arrays
+import instrumentation
+import model_artifacts
+
+
+def _load_pickle(path):
+    """Unpickle a model, importing joblib (and sklearn) only now."""
+    with instrumentation.stage("predict.load_model", path=os.path.basename(path)):
+        import joblib
+        return joblib.load(path)
+
 
 class EarthquakePredictionModel:
-    def __init__(self, model_path="earthquake_frequency_model.pkl", info_path="model_info.json"):
+    def __init__(self, model_path="earthquake_frequency_model.pkl", info_path="frequency_model_info.json", lazy=False):
         """Load the trained model and its metadata."""
+        self.model_path = model_path
+        self._model = None
         try:
-            # Load the trained model
-            self.model = joblib.load(model_path)
-            print(f"✓ Model loaded successfully from {model_path}")
-            
             # Load model info
             with open(info_path, 'r') as f:
                 self.model_info = json.load(f)
             print(f"✓ Model info loaded from {info_path}")
+
+            # Load the trained model, mapped from its artifact when there is a current one
+            self.artifact = model_artifacts.load_for(model_path, "linear", self.model_info)
+            if self.artifact is not None:
+                print(f"✓ Model mapped from {model_artifacts.artifact_path(model_path)}")
+            elif not lazy:
+                self._model = _load_pickle(model_path)
+                print(f"✓ Model loaded successfully from {model_path}")
+            elif not os.path.exists(model_path):
+                raise FileNotFoundError(f"No such file: '{model_path}'")
+
+            # Linear model in closed form, used by the batch fast path
+            self.slope, self.intercept = self._coefficients()
             
             # Display model performance
-            metrics = self.model_info['performance_metrics']
-            print(f"\nModel Performance:")
-            print(f"R² Score: {metrics['r2_score']:.4f}")
-            print(f"RMSE: {metrics['rmse']:.2f}")
+            metrics = self.model_info.get('performance_metrics')
+            if metrics:
+                print(f"\nModel Performance:")
+                print(f"R² Score: {metrics['r2_score']:.4f}")
+                print(f"RMSE: {metrics['rmse']:.2f}")
             
         except FileNotFoundError as e:
             print(f"❌ Error: {e}")
             print("Make sure you've run model_training.py first to create the model files.")
             raise
+
+    @property
+    def model(self):
+        """The sklearn model, unpickled on first use in lazy mode."""
+        if self._model is None:
+            self._model = _load_pickle(self.model_path)
+        return self._model
     
+    def _coefficients(self):
+        """Slope and intercept from model_info.json, its artifact, or the fitted model."""
+        coeffs = self.model_info.get('model_coefficients')
+        if coeffs:
+            return float(coeffs['slope']), float(coeffs['intercept'])
+        if self.artifact is not None:
+            return float(self.artifact["coef"][0]), float(self.artifact["intercept"][0])
+        return float(self.model.coef_[0]), float(self.model.intercept_)
+
+    def predict_batch(self, years):
+        """Predict earthquake frequency for an array of years.
+
+        Evaluates slope * year + intercept directly with NumPy instead of
+        going through sklearn's predict, then rounds and clamps to
+        non-negative integers in one vectorized step.
+        """
+        start = time.perf_counter()
+        years = np.asarray(years, dtype=np.float64)
+        predictions = np.rint(self.slope * years + self.intercept)
+        predictions = np.maximum(predictions, 0).astype(np.int64)
+        instrumentation.observe("predict.frequency", start, predictions.size)
+        return predictions
+
+    def predict_ranges(self, start_years, end_years):
+        """Predict many inclusive year ranges with a single batch call.
+
+        Returns one array of predictions per (start, end) pair.
+        """
+        starts = np.atleast_1d(np.asarray(start_years, dtype=np.int64))
+        ends = np.atleast_1d(np.asarray(end_years, dtype=np.int64))
+        lengths = np.maximum(ends - starts + 1, 0)
+        bounds = np.cumsum(lengths)
+
+        # year at flat position p of range i is p + (start_i - offset_i)
+        years = np.arange(bounds[-1] if len(bounds) else 0) + np.repeat(starts - (bounds - lengths), lengths)
+        return np.split(self.predict_batch(years), bounds[:-1])
+
     def predict_single_year(self, year):
         """Predict earthquake frequency for a single year."""
-        # Convert year to the same format used in training
-        year_numeric = float(year)
-        prediction = self.model.predict([[year_numeric]])[0]
-        return max(0, int(round(prediction)))  # Ensure non-negative integer
+        return int(self.predict_batch([year])[0])  # Ensure non-negative integer
     
     def predict_multiple_years(self, years):
         """Predict earthquake frequency for multiple years."""
-        years_numeric = [[float(year)] for year in years]
-        predictions = self.model.predict(years_numeric)
-        return [max(0, int(round(pred))) for pred in predictions]
+        return self.predict_batch(years).tolist()
     
     def predict_future_trend(self, start_year, end_year):
         """Predict earthquake frequency trend for a range of years."""
         years = list(range(start_year, end_year + 1))
         predictions = self.predict_multiple_years(years)
-        
+
+        import pandas as pd
         results = pd.DataFrame({
             'Year': years,
             'Predicted_Earthquake_Count': predictions
@@ -62,25 +132,160 @@ class EarthquakePredictionModel:
         print("EARTHQUAKE PREDICTION MODEL INFO")
         print("="*50)
         
-        coeffs = self.model_info['model_coefficients']
-        print(f"Model Type: {self.model_info['model_type']}")
-        print(f"Training Date: {self.model_info['training_date']}")
-        print(f"Features: {', '.join(self.model_info['features'])}")
-        print(f"Target: {self.model_info['target']}")
+        print(f"Model Type: {self.model_info.get('model_type', 'LinearRegression')}")
+        print(f"Training Date: {self.model_info.get('training_date', 'unknown')}")
+        print(f"Features: {', '.join(self.model_info.get('features', ['date']))}")
+        print(f"Target: {self.model_info.get('target', 'earthquake_count')}")
         
         print(f"\nModel Equation:")
-        print(f"Earthquake Count = {coeffs['slope']:.2f} × Year + {coeffs['intercept']:.2f}")
+        print(f"Earthquake Count = {self.slope:.2f} × Year + {self.intercept:.2f}")
         
         print(f"\nInterpretation:")
-        print(f"• Earthquake frequency increases by ~{coeffs['slope']:.0f} events per year")
-        print(f"• Model explains {self.model_info['performance_metrics']['r2_score']*100:.1f}% of the variance")
+        print(f"• Earthquake frequency increases by ~{self.slope:.0f} events per year")
+        metrics = self.model_info.get('performance_metrics')
+        if metrics:
+            print(f"• Model explains {metrics['r2_score']*100:.1f}% of the variance")
+
+
+def cluster_feature_names(n_clusters):
+    """Feature order used by the cluster RandomForest."""
+    names = [f"cluster_{i}" for i in range(n_clusters)]
+    names += [f"cluster_{i}_lag1" for i in range(n_clusters)]
+    names += [f"cluster_{i}_lag2" for i in range(n_clusters)]
+    return names + ["total_lag1", "total_roll3"]
+
+
+def _shares(weights):
+    """Weights normalized over the last axis, equal shares where they are all zero."""
+    weights = np.asarray(weights, dtype=np.float64)
+    weight_sum = weights.sum(axis=-1, keepdims=True)
+    return np.where(weight_sum > 0, weights / np.where(weight_sum > 0, weight_sum, 1), 1 / weights.shape[-1])
+
+
+class ClusterPredictionModel:
+    """Predict next year's total earthquake count from per-cluster yearly counts."""
+
+    def __init__(self, model_path="earthquake_cluster_model_rf.pkl", info_path="model_info.json", lazy=False):
+        """Load the cluster RandomForest and its metadata."""
+        self.model_path = model_path
+        self._model = None
+        try:
+            with open(info_path, 'r') as f:
+                self.model_info = json.load(f)
+            print(f"✓ Model info loaded from {info_path}")
+
+            # the flattened trees, shared read-only with other processes
+            self.forest = model_artifacts.load_for(model_path, "random_forest", self.model_info)
+            if self.forest is not None:
+                print(f"✓ Cluster model mapped from {model_artifacts.artifact_path(model_path)}")
+            elif not lazy:
+                self._model = _load_pickle(model_path)
+                print(f"✓ Cluster model loaded successfully from {model_path}")
+            elif not os.path.exists(model_path):
+                raise FileNotFoundError(f"No such file: '{model_path}'")
+
+        except FileNotFoundError as e:
+            print(f"❌ Error: {e}")
+            print("Make sure you've run model_training.py first to create the model files.")
+            raise
+
+        self.n_clusters = int(self.model_info['n_clusters'])
+        self.features = self.model_info['features']
+        if self.features != cluster_feature_names(self.n_clusters):
+            raise ValueError(f"Unexpected feature layout in {info_path}")
+
+    @property
+    def model(self):
+        """The RandomForest, unpickled on first use in lazy mode."""
+        if self._model is None:
+            self._model = _load_pickle(self.model_path)
+        return self._model
+
+    def build_features(self, counts):
+        """Feature rows from three consecutive years of per-cluster counts.
+
+        counts has shape (..., 3, n_clusters), oldest year first; the row
+        describes the newest year.
+        """
+        counts = np.asarray(counts, dtype=np.float64)
+        totals = counts.sum(axis=-1)
+        return np.concatenate([counts[..., 2, :], counts[..., 1, :], counts[..., 0, :],
+                               totals[..., 1:2], totals.mean(axis=-1, keepdims=True)], axis=-1)
+
+    def predict(self, counts):
+        """Predict the following year's total for one or many count windows."""
+        start = time.perf_counter()
+        features = self.build_features(counts)
+        if self.forest is not None:
+            predictions = forest_arrays.predict(self.forest, features.reshape(-1, features.shape[-1]))
+        else:
+            with warnings.catch_warnings():
+                # the forest was fitted on a DataFrame, plain arrays are fine here
+                warnings.simplefilter("ignore", UserWarning)
+                predictions = self.model.predict(features.reshape(-1, features.shape[-1]))
+        instrumentation.observe("predict.clusters", start, len(predictions))
+        return predictions.reshape(features.shape[:-1])
+
+    def _flat_forest(self):
+        """The flattened trees: the mapped artifact, or flattened once from the pickle."""
+        if self.forest is None:
+            self.forest = forest_arrays.flatten_forest(self.model)
+        return self.forest
+
+    def predict_interval(self, counts, percentiles=(5, 50, 95)):
+        """Percentiles of the next year's total and of each cluster's share of it.
+
+        Every tree is evaluated for every window in one vectorized pass
+        (forest_arrays.tree_predictions), so the spread over the trees costs
+        about as much as the point prediction. The total is split over the
+        clusters by each window's share of its three years, as in forecast().
+        Returns a dict with "percentiles", "mean" (...,), "total"
+        (n_percentiles, ...) and "clusters" (n_percentiles, ..., n_clusters).
+        """
+        start = time.perf_counter()
+        windows = np.asarray(counts, dtype=np.float64)
+        features = self.build_features(windows)
+        trees = forest_arrays.tree_predictions(self._flat_forest(), features.reshape(-1, features.shape[-1]))
+        total = np.percentile(trees, percentiles, axis=0)
+        instrumentation.observe("predict.intervals", start, trees.shape[1])
+
+        shape = features.shape[:-1]
+        total = total.reshape((len(total),) + shape)
+        shares = _shares(windows.sum(axis=-2))
+        return {"percentiles": list(percentiles), "mean": trees.mean(axis=0).reshape(shape),
+                "total": total, "clusters": total[..., None] * shares}
+
+    def forecast(self, counts, horizon, shares=None):
+        """Recursive forecasts for the `horizon` years after each count window.
+
+        counts has shape (..., 3, n_clusters); every leading index is a
+        scenario. Each step predicts the next total of all scenarios in one
+        model call, splits it over the clusters (by `shares`, or by each
+        window's share of its three years) and shifts that year into the
+        window. Returns totals (..., horizon) and per-cluster counts
+        (..., horizon, n_clusters).
+        """
+        windows = np.array(counts, dtype=np.float64)
+        batch = windows.shape[:-2]
+        windows = windows.reshape(-1, 3, self.n_clusters)
+        if shares is not None:
+            shares = np.broadcast_to(np.asarray(shares, dtype=np.float64), batch + (self.n_clusters,))
+            shares = shares.reshape(-1, self.n_clusters)
+
+        totals = np.empty((len(windows), horizon))
+        clusters = np.empty((len(windows), horizon, self.n_clusters))
+        for step in range(horizon):
+            totals[:, step] = self.predict(windows)
+            clusters[:, step] = totals[:, step, None] * _shares(shares if shares is not None else windows.sum(axis=1))
+            windows = np.concatenate([windows[:, 1:], clusters[:, step, None]], axis=1)
+        return totals.reshape(batch + (horizon,)), clusters.reshape(batch + (horizon, self.n_clusters))
 
 
 def main():
     """Example usage of the prediction model."""
     try:
         # Initialize the model
-        predictor = EarthquakePredictionModel()
+        predictor = EarthquakePredictionModel(lazy=True)
         
         # Show model info
         predictor.get_model_info()
@@ -0,0 +1,327 @@
+"""Memoized predictions, keyed by model version and request.
+
+    model = CachedModel(lambda: EarthquakePredictionModel(pkl, info, lazy=True), [pkl, info])
+    model.predict_single_year(2030)     # computed
+    model.predict_single_year(2030)     # served from the cache
+
+The model version is the content hash of its artifacts (the .pkl and its
+info JSON), rechecked from their size/mtime at most once per check_interval.
+VersionedModel owns the reload: when training writes new artifacts the
+version changes, the model is reloaded and entries of the old version are
+dropped, so nothing stale is served after a retrain. While the artifacts are
+missing or half-written (the pipeline removes a stage's outputs before it
+reruns) the loaded version keeps being served. In an asyncio server,
+VersionedModel.current() loads the new version in a worker thread and keeps
+answering with the old one until it is ready.
+
+PredictionCache is an LRU with a per-entry TTL. With `path` set it is backed
+by a SQLite file as well, which worker processes on the same machine share:
+a miss in one process's memory is looked up on disk before the model runs.
+"""
+import asyncio
+import copy
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import instrumentation
+from file_hashes import file_hash
+
+
+class ArtifactVersion:
+    """Content hash of a model's artifact files; the last one seen while any of them is missing."""
+
+    def __init__(self, paths, check_interval=1.0):
+        self.paths = list(paths)
+        self.check_interval = check_interval
+        self.known = {}
+        self.signature = None
+        self.version = None
+        self.checked = 0.0
+
+    def _signature(self):
+        stats = [os.stat(path) for path in self.paths]
+        return tuple((stat.st_size, stat.st_mtime_ns) for stat in stats)
+
+    def __call__(self):
+        now = time.monotonic()
+        if self.version is None or now - self.checked >= self.check_interval:
+            self.checked = now
+            try:
+                signature = self._signature()
+                if signature != self.signature:
+                    digest = hashlib.sha256()
+                    for path in self.paths:
+                        digest.update(file_hash(path, self.known).encode())
+                    self.signature, self.version = signature, digest.hexdigest()[:16]
+            except FileNotFoundError:
+                # being rewritten by training; nothing to serve if it never existed
+                if self.version is None:
+                    raise
+        return self.version
+
+
+def _digest_value(digest, value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        array = np.asarray(value)
+        if array.dtype.kind in "iuf":
+            array = array.astype(np.float64)
+        digest.update(f"{array.dtype}{array.shape}".encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+    else:
+        digest.update(repr(value).encode())
+    digest.update(b"|")
+
+
+def request_key(*args, **kwargs):
+    """Stable digest of call arguments; lists and arrays with equal values give equal keys."""
+    digest = hashlib.blake2b(digest_size=16)
+    for value in args:
+        _digest_value(digest, value)
+    for name, value in sorted(kwargs.items()):
+        digest.update(name.encode())
+        _digest_value(digest, value)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    def __init__(self, max_entries=10_000, ttl=3600.0, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+        self.db = None
+        self.db_rows = 0
+        if path:
+            self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, model TEXT, "
+                            "version TEXT, value BLOB, expires REAL, used REAL)")
+            self.db.commit()
+            self.db_rows = self.db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def _count(self, name):
+        self.counters[name] += 1
+        instrumentation.count(f"cache.{name}")
+
+    def get(self, model, version, key):
+        """(True, value) on a hit, (False, None) on a miss."""
+        full_key = f"{model}:{version}:{key}"
+        now = time.time()
+        entry = self.entries.get(full_key)
+        if entry is not None:
+            if entry[1] > now:
+                self.entries.move_to_end(full_key)
+                self._count("hits")
+                return True, copy.deepcopy(entry[0])
+            del self.entries[full_key]
+            self._count("expired")
+
+        if self.db is not None:
+            row = self.db.execute("SELECT value, expires FROM predictions WHERE key = ?", (full_key,)).fetchone()
+            if row is not None and row[1] > now:
+                self.db.execute("UPDATE predictions SET used = ? WHERE key = ?", (now, full_key))
+                self.db.commit()
+                value = pickle.loads(row[0])
+                self._remember(full_key, value, row[1])
+                self._count("disk_hits")
+                return True, copy.deepcopy(value)
+
+        self._count("misses")
+        return False, None
+
+    def _remember(self, full_key, value, expires):
+        self.entries[full_key] = (value, expires)
+        self.entries.move_to_end(full_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self._count("evictions")
+
+    def put(self, model, version, key, value):
+        full_key = f"{model}:{version}:{key}"
+        value = copy.deepcopy(value)
+        expires = time.time() + self.ttl
+        self._remember(full_key, value, expires)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)",
+                            (full_key, model, version, pickle.dumps(value), expires, time.time()))
+            self.db_rows += 1
+            # keep the file bounded too, least recently used first; other processes
+            # insert as well, so db_rows is only an upper bound until the next prune
+            if self.db_rows > self.max_entries + max(self.max_entries // 10, 1):
+                self._prune()
+            self.db.commit()
+
+    def _prune(self):
+        self.db.execute("DELETE FROM predictions WHERE expires <= ?", (time.time(),))
+        self.db.execute("DELETE FROM predictions WHERE key IN (SELECT key FROM predictions "
+                        "ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        self.db_rows = self.db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def invalidate(self, model, keep_version=None):
+        """Drop every entry of `model` except those of keep_version."""
+        prefix = f"{model}:"
+        for full_key in [k for k in self.entries if k.startswith(prefix)]:
+            if not full_key.startswith(f"{prefix}{keep_version}:"):
+                del self.entries[full_key]
+        if self.db is not None:
+            self.db.execute("DELETE FROM predictions WHERE model = ? AND version IS NOT ?", (model, keep_version))
+            self.db.commit()
+            self.db_rows = self.db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+        self._count("invalidations")
+
+    def clear(self):
+        self.entries.clear()
+        if self.db is not None:
+            self.db.execute("DELETE FROM predictions")
+            self.db.commit()
+            self.db_rows = 0
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hit_rate = (self.counters["hits"] + self.counters["disk_hits"]) / lookups if lookups else 0.0
+        return {**self.counters, "size": len(self.entries), "hit_rate": hit_rate}
+
+
+class VersionedModel:
+    """A model that is reloaded whenever its artifacts change.
+
+    `factory` builds the model. On a reload the cache entries of the old
+    version are invalidated. A version whose factory fails (e.g. a pickle
+    that is still being written) is not retried until the artifacts change
+    again; the loaded model keeps being served meanwhile.
+    """
+
+    def __init__(self, factory, artifact_paths, cache=None, name=None, check_interval=1.0):
+        self.factory = factory
+        self.version = ArtifactVersion(artifact_paths, check_interval)
+        self.cache = cache or PredictionCache()
+        self.name = name or os.path.basename(artifact_paths[0])
+        self.model = None
+        self.loaded_version = None
+        self.failed_version = None
+        self.reloads = 0
+        self._loading = None
+
+    def _install(self, model, version):
+        if self.model is not None:
+            self.reloads += 1
+            self.cache.invalidate(self.name, keep_version=version)
+            print(f"✓ Reloaded {self.name} after retraining")
+        self.model, self.loaded_version = model, version
+
+    def _build(self, version):
+        """A new model for `version`, or None (and the loaded one kept) when that fails."""
+        try:
+            return self.factory()
+        except Exception as e:
+            if self.model is None:
+                raise
+            self.failed_version = version
+            print(f"⚠️  Could not reload {self.name} ({e}); still serving version {self.loaded_version}")
+            return None
+
+    def _pending(self):
+        version = self.version()
+        return version if version not in (self.loaded_version, self.failed_version) else None
+
+    def get(self):
+        """(model, version), reloading in this thread first if the artifacts changed."""
+        version = self._pending()
+        if version is not None:
+            model = self._build(version)
+            if model is not None:
+                self._install(model, version)
+        return self.model, self.loaded_version
+
+    async def current(self):
+        """(model, version) without blocking the event loop on a reload.
+
+        A new version is built in a worker thread while callers keep getting
+        the loaded one; only the very first load is waited for.
+        """
+        version = self._pending()
+        if version is not None and self._loading is None:
+            self._loading = asyncio.ensure_future(self._reload(version))
+        if self.model is None:
+            await self._loading
+        return self.model, self.loaded_version
+
+    async def _reload(self, version):
+        try:
+            model = await asyncio.to_thread(self._build, version)
+            # swapped in on the event loop, so the cache is never touched from the thread
+            if model is not None:
+                self._install(model, version)
+        finally:
+            self._loading = None
+
+
+# methods whose result only depends on the model and the arguments
+CACHED_METHODS = ("predict_single_year", "predict_multiple_years", "predict_batch", "predict_ranges",
+                  "predict_future_trend", "predict")
+
+
+class CachedModel:
+    """Wrap a prediction model so the methods in CACHED_METHODS are memoized.
+
+    `factory` builds the model; it is called again whenever the artifacts
+    change. Every other attribute is passed through to the current model.
+    """
+
+    def __init__(self, factory, artifact_paths, cache=None, name=None, check_interval=1.0):
+        self.versioned = VersionedModel(factory, artifact_paths, cache, name, check_interval)
+        self.cache = self.versioned.cache
+        self.name = self.versioned.name
+
+    @property
+    def model(self):
+        return self.versioned.get()[0]
+
+    @property
+    def loaded_version(self):
+        return self.versioned.loaded_version
+
+    @property
+    def reloads(self):
+        return self.versioned.reloads
+
+    def call(self, method, *args, **kwargs):
+        model, version = self.versioned.get()
+        key = f"{method}:{request_key(*args, **kwargs)}"
+        found, value = self.cache.get(self.name, version, key)
+        if not found:
+            value = getattr(model, method)(*args, **kwargs)
+            self.cache.put(self.name, version, key, value)
+        return value
+
+    def __getattr__(self, name):
+        if name in CACHED_METHODS:
+            return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+        return getattr(self.model, name)
+
+
+if __name__ == "__main__":
+    import argparse
+    from predict_earthquakes import EarthquakePredictionModel
+
+    root = os.path.join(os.path.dirname(__file__), "..", "..")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=os.path.join(root, "earthquake_frequency_model.pkl"))
+    parser.add_argument("--info", default=os.path.join(root, "frequency_model_info.json"))
+    parser.add_argument("--db", default=None, help="SQLite file to share the cache between processes")
+    args = parser.parse_args()
+
+    model = CachedModel(lambda: EarthquakePredictionModel(args.model, args.info, lazy=True),
+                        [args.model, args.info], PredictionCache(path=args.db))
+    for attempt in ("cold", "warm"):
+        start = time.perf_counter()
+        for year in range(1990, 2100):
+            model.predict_future_trend(year, year + 10)
+        print(f"{attempt}: {1000 * (time.perf_counter() - start):.2f} ms for 110 trend predictions")
+    print(model.cache.stats())
@@ -0,0 +1,443 @@
+"""Local HTTP prediction service.
+
+Keeps the frequency model, the KMeans model and the cluster RandomForest
+loaded once and serves them over a small asyncio HTTP/1.1 server:
+
+    GET  /predict/year?year=2030
+    GET  /predict/range?start=2025&end=2035
+    POST /predict/clusters   {"counts": [[...], [...], [...]]}  (3 years x n_clusters, or a list of those)
+                             add "percentiles": [5, 50, 95] for intervals over the trees
+    GET  /cluster?lat=31.2&lon=-97.1
+    POST /events             USGS GeoJSON FeatureCollection, assigned to clusters and counted
+    GET  /forecast/clusters[?year=2024][&horizon=10][&percentiles=5,50,95]
+                                          next year's (or years') total split over the clusters
+    GET  /events/bbox?min_lat=..&max_lat=..&min_lon=..&max_lon=..[&start=2020&end=2021-06]
+    GET  /events/nearby?lat=31.2&lon=-97.1&radius_km=100[&start=..&end=..]
+    GET  /health
+
+Concurrent requests for the same model are micro-batched: they are queued for
+a short window and answered from one vectorized model call. Answers are
+memoized in a prediction_cache.PredictionCache keyed by the model version;
+when training rewrites a model's artifacts the model is reloaded in a worker
+thread (prediction_cache.VersionedModel) and its old entries are dropped.
+"""
+import asyncio
+import json
+import os
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+import event_store
+import instrumentation
+import model_artifacts
+from cluster_forecast import ClusterForecaster
+from prediction_cache import PredictionCache, VersionedModel, request_key
+from predict_earthquakes import EarthquakePredictionModel, ClusterPredictionModel
+from spatial_index import SpatialIndex, INDEX_DIR, _date_key
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+# info_path is the cluster model's; the frequency model has its own info file
+FREQUENCY_INFO = os.path.abspath(get_absolute_path(os.path.join("..", "..", "frequency_model_info.json")))
+
+
+class MicroBatcher:
+    """Collect array inputs for `window` seconds and run `fn` once on all of them.
+
+    Every submitted item is an array whose first axis is its rows; `fn` gets the
+    rows of all queued items concatenated and must return one result per row.
+    `validate` is called on each item before it is queued, so a bad request
+    fails on its own; if a batch still raises, its items are retried one by one.
+    """
+
+    def __init__(self, fn, window=0.002, max_rows=4096, validate=None):
+        self.fn = fn
+        self.validate = validate
+        self.window = window
+        self.max_rows = max_rows
+        self.pending = []
+        self.rows = 0
+        self.flush_handle = None
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        if self.validate is not None:
+            self.validate(item)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        self.rows += len(item)
+        if self.rows >= self.max_rows:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        pending, self.pending, self.rows = self.pending, [], 0
+        if not pending:
+            return
+
+        self.batches += 1
+        self.items += len(pending)
+        try:
+            results = self.fn(np.concatenate([item for item, _ in pending]))
+        except Exception as e:
+            if len(pending) == 1:
+                if not pending[0][1].done():
+                    pending[0][1].set_exception(e)
+                return
+            # one bad item must not fail the requests batched with it
+            for item, future in pending:
+                if future.done():
+                    continue
+                try:
+                    future.set_result(self.fn(item))
+                except Exception as item_error:
+                    future.set_exception(item_error)
+            return
+
+        start = 0
+        for item, future in pending:
+            if not future.done():
+                future.set_result(results[start:start + len(item)])
+            start += len(item)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+# longest /predict/range, and largest request body (a month of USGS events is ~10 MB)
+MAX_RANGE_YEARS = 1000
+MAX_BODY_BYTES = 32 << 20
+
+
+class PredictionService:
+    def __init__(self, frequency_model_path, cluster_model_path, info_path,
+                 frequency_info_path=FREQUENCY_INFO, kmeans_path=None, index_dir=None, window=0.002, cache=None):
+        self.cache = cache or PredictionCache()
+        # reloaded by the cache layer when training replaces their artifacts
+        self.models = {
+            "frequency": VersionedModel(lambda: EarthquakePredictionModel(frequency_model_path, frequency_info_path),
+                                        [frequency_model_path, frequency_info_path], self.cache, "frequency"),
+            "cluster": VersionedModel(lambda: ClusterPredictionModel(cluster_model_path, info_path),
+                                      [cluster_model_path, info_path], self.cache, "cluster"),
+        }
+        self.frequency = self.models["frequency"].get()[0]
+        self.cluster = self.models["cluster"].get()[0]
+
+        # centroids are all that is needed to assign a point to its cluster
+        self.centers = None
+        self.forecaster = None
+        if kmeans_path and os.path.exists(kmeans_path):
+            self.centers = model_artifacts.load_centers(kmeans_path, self.cluster.model_info)
+            print(f"✓ KMeans model loaded from {kmeans_path}")
+            # per-cluster yearly counts, kept up to date by POST /events
+            self.forecaster = ClusterForecaster(self.centers, self.cluster)
+            if event_store.exists():
+                self.forecaster.seed_from_store()
+
+        # historical events for nearby queries, memory-mapped
+        self.events = None
+        if index_dir and os.path.exists(os.path.join(index_dir, "index.json")):
+            self.events = SpatialIndex(index_dir)
+            print(f"✓ Spatial index with {len(self.events)} events loaded from {index_dir}")
+
+        self.year_batcher = MicroBatcher(self.frequency.predict_batch, window, validate=_finite)
+        self.cluster_batcher = MicroBatcher(self.cluster.predict, window, validate=self._check_counts)
+        self.assign_batcher = MicroBatcher(self._assign, window, validate=_finite)
+
+    def _check_counts(self, counts):
+        _finite(counts)
+        if counts.ndim != 3 or counts.shape[1:] != (3, self.cluster.n_clusters):
+            raise HTTPError(400, f"counts must be 3 x {self.cluster.n_clusters} per window")
+
+    def _assign(self, points):
+        return event_store.nearest_center(points, self.centers)
+
+    async def _version(self, name):
+        """Version the answers of a model are cached under; a retrained model is used once loaded."""
+        model, version = await self.models[name].current()
+        if name == "frequency" and model is not self.frequency:
+            self.frequency = model
+            self.year_batcher.fn = model.predict_batch
+        elif name == "cluster" and model is not self.cluster:
+            self.cluster = model
+            self.cluster_batcher.fn = model.predict
+            if self.forecaster is not None:
+                self.forecaster.model = model
+        return version
+
+    async def _cached(self, name, key, compute):
+        version = await self._version(name)
+        found, value = self.cache.get(name, version, key)
+        if not found:
+            value = await compute()
+            self.cache.put(name, version, key, value)
+        return value
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/health":
+            return {"status": "ok",
+                    "batches": {name: {"batches": b.batches, "requests": b.items}
+                                for name, b in (("year", self.year_batcher),
+                                                ("cluster", self.cluster_batcher),
+                                                ("assign", self.assign_batcher))},
+                    "cache": self.cache.stats(),
+                    "models": {name: model.loaded_version for name, model in self.models.items()},
+                    "timers": instrumentation.snapshot()["timers"]}
+
+        if url.path == "/predict/year":
+            year = _int_param(query, "year")
+
+            async def compute():
+                prediction = await self.year_batcher.submit(np.array([year]))
+                return {"year": year, "prediction": int(prediction[0])}
+            return await self._cached("frequency", f"year:{year}", compute)
+
+        if url.path == "/predict/range":
+            start, end = _int_param(query, "start"), _int_param(query, "end")
+            if end < start:
+                raise HTTPError(400, "start must be less than or equal to end")
+            if end - start >= MAX_RANGE_YEARS:
+                raise HTTPError(400, f"a range spans at most {MAX_RANGE_YEARS} years")
+
+            async def compute():
+                years = np.arange(start, end + 1)
+                predictions = await self.year_batcher.submit(years)
+                return {"years": years.tolist(), "predictions": predictions.tolist()}
+            return await self._cached("frequency", f"range:{start}:{end}", compute)
+
+        if url.path == "/predict/clusters":
+            if method != "POST":
+                raise HTTPError(405, "use POST with a JSON body")
+            try:
+                request = json.loads(body)
+                counts = np.asarray(request["counts"], dtype=np.float64)
+                percentiles = [float(q) for q in request.get("percentiles") or []]
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise HTTPError(400, 'body must be {"counts": [[...], [...], [...]], "percentiles": [...]}')
+            if not all(0 <= q <= 100 for q in percentiles):
+                raise HTTPError(400, "percentiles must be between 0 and 100")
+            single = counts.ndim == 2
+            counts = counts[None] if single else counts
+            if counts.ndim != 3 or counts.shape[1:] != (3, self.cluster.n_clusters):
+                raise HTTPError(400, f"counts must be 3 x {self.cluster.n_clusters} per window")
+
+            if percentiles:
+                async def compute():
+                    interval = self.cluster.predict_interval(counts, percentiles)
+                    answers = [{"prediction": float(mean),
+                                "interval": {f"p{q:g}": float(v) for q, v in zip(percentiles, total)},
+                                "clusters": {f"p{q:g}": c.tolist() for q, c in zip(percentiles, clusters)}}
+                               for mean, total, clusters in
+                               zip(interval["mean"], interval["total"].T, interval["clusters"].transpose(1, 0, 2))]
+                    return answers[0] if single else {"predictions": answers}
+                return await self._cached("cluster", f"intervals:{request_key(counts, percentiles)}", compute)
+
+            async def compute():
+                predictions = (await self.cluster_batcher.submit(counts)).tolist()
+                return {"prediction": predictions[0]} if single else {"predictions": predictions}
+            return await self._cached("cluster", f"clusters:{request_key(counts)}", compute)
+
+        if url.path == "/cluster":
+            if self.centers is None:
+                raise HTTPError(503, "no KMeans model loaded")
+            point = np.array([[_float_param(query, "lat"), _float_param(query, "lon")]])
+            label = await self.assign_batcher.submit(point)
+            return {"cluster": int(label[0])}
+
+        if url.path in ("/events", "/forecast/clusters"):
+            if self.forecaster is None:
+                raise HTTPError(503, "no KMeans model loaded")
+            if url.path == "/events":
+                if method != "POST":
+                    raise HTTPError(405, "use POST with a GeoJSON FeatureCollection")
+                try:
+                    labels = self.forecaster.add_geojson(json.loads(body))
+                except (ValueError, AttributeError, TypeError):
+                    raise HTTPError(400, "body must be a GeoJSON FeatureCollection")
+                return {"added": int((labels >= 0).sum()), "clusters": labels.tolist(),
+                        "forecast": self.forecaster.forecast()[0]}
+            year = _int_param(query, "year") if "year" in query else None
+            if "horizon" in query:
+                horizon = _int_param(query, "horizon")
+                if not 1 <= horizon <= 100:
+                    raise HTTPError(400, "horizon must be between 1 and 100")
+                return self.forecaster.outlook(year, horizon)[0]
+            percentiles = None
+            if "percentiles" in query:
+                try:
+                    percentiles = [float(q) for q in query["percentiles"].split(",")]
+                except ValueError:
+                    raise HTTPError(400, "percentiles must be comma-separated numbers")
+                if not all(0 <= q <= 100 for q in percentiles):
+                    raise HTTPError(400, "percentiles must be between 0 and 100")
+            return self.forecaster.forecast(year, percentiles)[0]
+
+        if url.path in ("/events/bbox", "/events/nearby"):
+            if self.events is None:
+                raise HTTPError(503, "no spatial index loaded")
+            window = {"start": _date_param(query, "start"), "end": _date_param(query, "end")}
+            if url.path == "/events/bbox":
+                found = self.events.bbox(_float_param(query, "min_lat"), _float_param(query, "max_lat"),
+                                         _float_param(query, "min_lon"), _float_param(query, "max_lon"), **window)
+            else:
+                found = self.events.radius(_float_param(query, "lat"), _float_param(query, "lon"),
+                                           _float_param(query, "radius_km"), **window)
+            return {"count": len(found["date_key"]),
+                    "events": {name: _json_values(values) for name, values in found.items()}}
+
+        raise HTTPError(404, f"unknown path {url.path}")
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (version == "HTTP/1.1" and headers.get("connection", "").lower() != "close")
+
+                body = None
+                try:
+                    try:
+                        length = int(headers.get("content-length", 0) or 0)
+                    except ValueError:
+                        raise HTTPError(400, "invalid Content-Length")
+                    if length < 0:
+                        raise HTTPError(400, "invalid Content-Length")
+                    if length > MAX_BODY_BYTES:
+                        raise HTTPError(413, f"request body is limited to {MAX_BODY_BYTES} bytes")
+                    body = await reader.readexactly(length)
+                    status, payload = 200, await self.route(method, target, body)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": str(e)}
+                    # the unread body would be taken for the next request
+                    if body is None:
+                        keep_alive = False
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _json_values(values):
+    # float32 columns would otherwise print with float64 noise
+    if values.dtype.kind == "f":
+        return np.round(values.astype(np.float64), 5).tolist()
+    return values.tolist()
+
+
+def _finite(values):
+    """Reject an input before it is batched with other requests."""
+    if values.dtype.kind not in "iuf" or not np.isfinite(values).all():
+        raise HTTPError(400, "inputs must be finite numbers")
+
+
+def _int_param(query, name):
+    try:
+        return int(query[name])
+    except (KeyError, ValueError):
+        raise HTTPError(400, f"query parameter '{name}' must be an integer")
+
+
+def _float_param(query, name):
+    try:
+        return float(query[name])
+    except (KeyError, ValueError):
+        raise HTTPError(400, f"query parameter '{name}' must be a number")
+
+
+def _date_param(query, name):
+    """An optional yyyy / yyyy-mm / yyyy-mm-dd bound, checked before it reaches the index."""
+    value = query.get(name)
+    if value is not None:
+        try:
+            _date_key(value, low=True)
+        except ValueError:
+            raise HTTPError(400, f"query parameter '{name}' must be yyyy, yyyy-mm or yyyy-mm-dd")
+    return value
+
+
+async def serve(service, host="127.0.0.1", port=8765):
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"✓ Serving predictions on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    import argparse
+    root = get_absolute_path(os.path.join("..", ".."))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--frequency-model", default=os.path.join(root, "earthquake_frequency_model.pkl"))
+    parser.add_argument("--frequency-info", default=FREQUENCY_INFO,
+                        help="info file of the frequency model")
+    parser.add_argument("--cluster-model", default=os.path.join(root, "earthquake_cluster_model_rf.pkl"))
+    parser.add_argument("--info", default=os.path.join(root, "model_info.json"))
+    parser.add_argument("--kmeans", default=get_absolute_path("kmeans_model.pkl"))
+    parser.add_argument("--index", default=INDEX_DIR, help="spatial index built by spatial_index.py")
+    parser.add_argument("--window-ms", type=float, default=2.0,
+                        help="how long requests wait to be batched together")
+    parser.add_argument("--cache-size", type=int, default=10_000, help="cached answers kept in memory")
+    parser.add_argument("--cache-ttl", type=float, default=3600.0, help="seconds an answer stays cached")
+    parser.add_argument("--cache-db", default=None,
+                        help="SQLite file to share cached answers between service processes")
+    args = parser.parse_args()
+
+    service = PredictionService(args.frequency_model, args.cluster_model, args.info,
+                                frequency_info_path=args.frequency_info,
+                                kmeans_path=args.kmeans, index_dir=args.index,
+                                window=args.window_ms / 1000,
+                                cache=PredictionCache(args.cache_size, args.cache_ttl, args.cache_db))
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
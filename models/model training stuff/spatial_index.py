@@ -0,0 +1,164 @@
+"""Grid index over the cleaned catalog for bounding-box, radius and time queries.
+
+Events are sorted by lat/lon grid cell (row-major, see aggregate.grid_cell)
+and stored as flat .npy columns next to an offsets array, so the events of one
+cell are one contiguous slice and a run of cells along a grid row is one slice
+too. SpatialIndex memory-maps the columns read-only: loading is instant,
+several processes share the page cache, and a query only touches the cells
+its box overlaps before filtering exactly.
+"""
+import json
+import os
+import numpy as np
+import catalog_store
+from aggregate import grid_cell
+from geo_cluster import EARTH_RADIUS_KM
+
+
+def get_absolute_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+INDEX_DIR = os.path.join(catalog_store.STORE_DIR, "spatial_index")
+COLUMNS = {"latitude": np.float32, "longitude": np.float32, "magnitudo": np.float32, "date_key": np.uint32}
+
+
+def build_index(cell_degrees=1.0, out_dir=INDEX_DIR):
+    """Sort the catalog by grid cell and date and write the memory-mappable index."""
+    columns = ["latitude", "longitude", "magnitudo", "date"]
+    if catalog_store.store_exists():
+        columns += ["month", "day"]
+    df = catalog_store.load_training(columns=columns).dropna(subset=["latitude", "longitude"])
+
+    lat = df["latitude"].to_numpy(dtype=np.float64)
+    lon = df["longitude"].to_numpy(dtype=np.float64)
+    # yyyymmdd, with 00 for an unknown month/day
+    date_key = df["date"].to_numpy(dtype=np.int64) * 10000
+    if "month" in df:
+        date_key += df["month"].to_numpy(dtype=np.int64) * 100 + df["day"].to_numpy(dtype=np.int64)
+
+    cell = grid_cell(lat, lon, cell_degrees)
+    order = np.lexsort((date_key, cell))
+    n_cells = int(np.ceil(180 / cell_degrees)) * int(np.ceil(360 / cell_degrees))
+    offsets = np.zeros(n_cells + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cell, minlength=n_cells), out=offsets[1:])
+
+    os.makedirs(out_dir, exist_ok=True)
+    values = {"latitude": lat, "longitude": lon,
+              "magnitudo": df["magnitudo"].to_numpy(dtype=np.float64), "date_key": date_key}
+    for name, dtype in COLUMNS.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), values[name][order].astype(dtype))
+    np.save(os.path.join(out_dir, "offsets.npy"), offsets)
+    with open(os.path.join(out_dir, "index.json"), "w") as f:
+        json.dump({"cell_degrees": cell_degrees, "events": int(len(order))}, f, indent=2)
+    print(f"✓ Indexed {len(order)} events into {n_cells} cells of {cell_degrees}° in {out_dir}")
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class SpatialIndex:
+    def __init__(self, index_dir=INDEX_DIR):
+        with open(os.path.join(index_dir, "index.json"), "r") as f:
+            info = json.load(f)
+        self.cell_degrees = info["cell_degrees"]
+        self.n_rows = int(np.ceil(180 / self.cell_degrees))
+        self.n_cols = int(np.ceil(360 / self.cell_degrees))
+        self.offsets = np.load(os.path.join(index_dir, "offsets.npy"), mmap_mode="r")
+        self.columns = {name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+                        for name in COLUMNS}
+
+    def __len__(self):
+        return len(self.columns["date_key"])
+
+    def _candidates(self, min_lat, max_lat, lon_ranges):
+        """Positions of events in the cells overlapping the box, one slice per row and lon range."""
+        row0 = max(int((min_lat + 90) // self.cell_degrees), 0)
+        row1 = min(int((max_lat + 90) // self.cell_degrees), self.n_rows - 1)
+        slices = []
+        for lo, hi in lon_ranges:
+            col0 = max(int((lo + 180) // self.cell_degrees), 0)
+            col1 = min(int((hi + 180) // self.cell_degrees), self.n_cols - 1)
+            rows = np.arange(row0, row1 + 1) * self.n_cols
+            starts = self.offsets[rows + col0]
+            ends = self.offsets[rows + col1 + 1]
+            slices += [np.arange(s, e) for s, e in zip(starts, ends) if e > s]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def _select(self, positions, mask):
+        positions = positions[mask]
+        return {name: np.asarray(column[positions]) for name, column in self.columns.items()}
+
+    def _time_mask(self, positions, start, end):
+        mask = np.ones(len(positions), dtype=bool)
+        if start is None and end is None:
+            return mask
+        keys = self.columns["date_key"][positions]
+        if start is not None:
+            mask &= keys >= _date_key(start, low=True)
+        if end is not None:
+            mask &= keys <= _date_key(end, low=False)
+        return mask
+
+    def bbox(self, min_lat, max_lat, min_lon, max_lon, start=None, end=None):
+        """Events inside the box, optionally between two dates.
+
+        min_lon > max_lon means the box crosses the antimeridian. Dates are
+        years (2020), year-months ("2020-05") or full dates ("2020-05-17").
+        """
+        lon_ranges = [(min_lon, max_lon)] if min_lon <= max_lon else [(min_lon, 180), (-180, max_lon)]
+        positions = self._candidates(min_lat, max_lat, lon_ranges)
+
+        lat = self.columns["latitude"][positions]
+        lon = self.columns["longitude"][positions]
+        mask = (lat >= min_lat) & (lat <= max_lat)
+        if min_lon <= max_lon:
+            mask &= (lon >= min_lon) & (lon <= max_lon)
+        else:
+            mask &= (lon >= min_lon) | (lon <= max_lon)
+        return self._select(positions, mask & self._time_mask(positions, start, end))
+
+    def radius(self, lat, lon, radius_km, start=None, end=None):
+        """Events within radius_km (great-circle) of a point, optionally between two dates."""
+        dlat = np.degrees(radius_km / EARTH_RADIUS_KM)
+        min_lat, max_lat = lat - dlat, lat + dlat
+        if min_lat <= -90 or max_lat >= 90:
+            lon_ranges = [(-180, 180)]
+        else:
+            dlon = np.degrees(radius_km / (EARTH_RADIUS_KM * np.cos(np.radians(max(abs(min_lat), abs(max_lat))))))
+            lo, hi = lon - dlon, lon + dlon
+            if dlon >= 180:
+                lon_ranges = [(-180, 180)]
+            elif lo < -180:
+                lon_ranges = [(lo + 360, 180), (-180, hi)]
+            elif hi > 180:
+                lon_ranges = [(lo, 180), (-180, hi - 360)]
+            else:
+                lon_ranges = [(lo, hi)]
+
+        positions = self._candidates(max(min_lat, -90), min(max_lat, 90), lon_ranges)
+        distance = haversine_km(lat, lon, self.columns["latitude"][positions].astype(np.float64),
+                                self.columns["longitude"][positions].astype(np.float64))
+        return self._select(positions, (distance <= radius_km) & self._time_mask(positions, start, end))
+
+
+def _date_key(value, low):
+    """yyyymmdd bound for a year, "yyyy-mm" or "yyyy-mm-dd"; ValueError for anything else."""
+    parts = [int(p) for p in str(value).split("-")]
+    if len(parts) > 3 or not (len(parts) < 2 or 1 <= parts[1] <= 12) or not (len(parts) < 3 or 1 <= parts[2] <= 31):
+        raise ValueError(f"invalid date {value!r}, expected yyyy, yyyy-mm or yyyy-mm-dd")
+    year = parts[0]
+    month = parts[1] if len(parts) > 1 else (0 if low else 99)
+    day = parts[2] if len(parts) > 2 else (0 if low else 99)
+    return year * 10000 + month * 100 + day
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cell", type=float, default=1.0, help="grid cell size in degrees")
+    args = parser.parse_args()
+    build_index(args.cell)
@@ -0,0 +1,28 @@
+"""The benchmark children must report the real peak RSS of what they ran.
+
+Run with: python -m pytest "models/model training stuff"
+"""
+import os
+
+import pytest
+
+from benchmarks import get_absolute_path, run_stage
+
+ALLOCATE = """
+import numpy as np
+import instrumentation
+with instrumentation.stage("outer"):
+    with instrumentation.stage("allocate"):
+        data = np.ones(300 * (1 << 20) // 8)
+        del data
+    with instrumentation.stage("later"):
+        pass
+"""
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="needs Linux /proc")
+def test_known_allocation_shows_in_peak_rss():
+    scripts = get_absolute_path("")
+    idle = run_stage(scripts, "import numpy as np\nimport instrumentation")
+    loaded = run_stage(scripts, ALLOCATE)
+    assert loaded["peak_rss_mb"] >= idle["peak_rss_mb"] + 280
@@ -0,0 +1,164 @@
+"""feed_poller against the ReplayServer and the recorded feeds in recorded/.
+
+Run with: python -m pytest "models/model training stuff"
+"""
+import asyncio
+import hashlib
+import json
+import os
+
+import pytest
+
+import catalog_store
+import event_store
+import incremental
+from feed_poller import FEEDS, ConnectionPool, FeedPoller, ReplayServer, _rebase, iter_features
+
+RECORDED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recorded")
+
+
+def recorded(name):
+    with open(os.path.join(RECORDED, name), "rb") as f:
+        return f.read()
+
+
+def run_with_server(replay, session):
+    """Run `session(base_url)` against `replay` listening on an ephemeral port."""
+    async def main():
+        server = await asyncio.start_server(replay.handle, "127.0.0.1", 0)
+        base_url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        async with server:
+            return await session(base_url)
+    return asyncio.run(main())
+
+
+def make_poller(base_url, tmp_path, names=("usgs_day",), **kwargs):
+    feeds = _rebase({name: FEEDS[name] for name in names}, base_url)
+    kwargs = {"apply": len, "alerts_path": None, "state_path": str(tmp_path / "state.json"), **kwargs}
+    return FeedPoller(feeds, pool=ConnectionPool(timeout=5.0), **kwargs)
+
+
+async def byte_chunks(data, size=1):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def test_503_backs_off_with_retry_after(tmp_path):
+    replay = ReplayServer(RECORDED, fail=1)
+
+    async def session(base_url):
+        poller = make_poller(base_url, tmp_path, base_delay=0.01)
+        try:
+            failed = await poller.poll_safely("usgs_day")
+            failures = poller.state[poller.feeds["usgs_day"]["url"]]["failures"]
+            recovered = await poller.poll_safely("usgs_day")
+            return failed, failures, recovered, poller
+        finally:
+            poller.pool.close()
+
+    (result, delay), failures, recovered, poller = run_with_server(replay, session)
+    assert result is False and failures == 1
+    # the 10 ms exponential delay is raised to the server's Retry-After: 1
+    assert delay >= 1.0
+    assert recovered == (4, FEEDS["usgs_day"]["interval"])
+    assert poller.state[poller.feeds["usgs_day"]["url"]]["failures"] == 0
+    assert replay.stats["503"] == 1 and replay.stats["200"] == 1
+
+
+def test_repeat_poll_is_304_over_one_connection(tmp_path):
+    replay = ReplayServer(RECORDED, chunk_size=256)
+
+    async def session(base_url):
+        poller = make_poller(base_url, tmp_path)
+        try:
+            results = [await poller.poll("usgs_day") for _ in range(3)]
+        finally:
+            poller.pool.close()
+        # a fresh poller sends the saved validators back and gets a 304 straight away
+        restarted = make_poller(base_url, tmp_path)
+        try:
+            return results, poller.pool.stats, await restarted.poll("usgs_day")
+        finally:
+            restarted.pool.close()
+
+    results, stats, after_restart = run_with_server(replay, session)
+    # all_day.1, then all_day.2, then all_day.2 again with a matching ETag
+    assert results == [4, 5, None]
+    assert stats == {"connections": 1, "reused": 2}
+    assert after_restart is None
+    assert replay.stats["200"] == 2 and replay.stats["304"] == 2
+
+    with open(tmp_path / "state.json") as f:
+        state = json.load(f)
+    assert [entry["etag"] for entry in state.values()] == [f'"{hashlib.sha1(recorded("all_day.2.geojson")).hexdigest()}"']
+
+
+def test_dry_run_leaves_the_state_file_alone(tmp_path):
+    async def session(base_url):
+        poller = make_poller(base_url, tmp_path, save_state=False)
+        try:
+            return await poller.poll("usgs_day")
+        finally:
+            poller.pool.close()
+
+    assert run_with_server(ReplayServer(RECORDED), session) == 4
+    assert not os.path.exists(tmp_path / "state.json")
+
+
+def test_iter_features_one_byte_chunks():
+    body = recorded("all_day.2.geojson")
+
+    async def collect():
+        return [feature async for feature in iter_features(byte_chunks(body))]
+
+    # 1-byte chunks also split the multi-byte characters of the place names
+    assert asyncio.run(collect()) == json.loads(body)["features"]
+
+
+@pytest.mark.parametrize("keep", [0.0, 0.2, 0.5, 1.0])
+def test_iter_features_truncated_body(keep):
+    body = recorded("all_day.2.geojson")
+    # cut somewhere before the "]" closing the features array
+    end = body.rindex(b"]", 0, body.index(b'"bbox"'))
+    body = body[:int(end * keep)]
+
+    async def collect():
+        return [feature async for feature in iter_features(byte_chunks(body, 7))]
+
+    with pytest.raises(ValueError):
+        asyncio.run(collect())
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    """incremental.apply_features writing into tmp_path instead of the real catalog."""
+    monkeypatch.setattr(incremental, "WATERMARK_FILE", str(tmp_path / "training.watermark.json"))
+    monkeypatch.setattr(incremental, "get_absolute_path", lambda name: str(tmp_path / name))
+    monkeypatch.setattr(catalog_store, "get_absolute_path", lambda name: str(tmp_path / name))
+    monkeypatch.setattr(catalog_store, "STORE_DIR", str(tmp_path / "catalog"))
+    monkeypatch.setattr(catalog_store, "EVENTS_DIR", str(tmp_path / "catalog" / "events"))
+    monkeypatch.setattr(catalog_store, "FREQUENCY_FILE", str(tmp_path / "catalog" / "frequency.parquet"))
+    monkeypatch.setattr(event_store, "exists", lambda *args, **kwargs: False)
+    (tmp_path / "Frequency.csv").write_text("date,count\n2023,10\n")
+    return tmp_path
+
+
+def test_same_feed_applied_twice_is_deduped(catalog):
+    features = json.loads(recorded("all_day.1.geojson"))["features"]
+    # the 1.2 and the quarry blast are filtered out
+    assert incremental.apply_features(features) == 2
+    assert incremental.apply_features(features) == 0
+
+    async def session(base_url):
+        poller = make_poller(base_url, catalog, names=("usgs_day", "usgs_hour"), apply=None)
+        try:
+            # all_day.1 again, the hour feed's new event, then all_day.2 which holds nothing new
+            return [await poller.poll(name) for name in ("usgs_day", "usgs_hour", "usgs_day")]
+        finally:
+            poller.pool.close()
+
+    assert run_with_server(ReplayServer(RECORDED), session) == [0, 1, 0]
+    events = catalog_store.load_training(["magnitudo"])
+    assert sorted(events["magnitudo"].tolist()) == pytest.approx([4.0, 4.6, 5.1])
+    frequency = catalog_store.load_frequency().set_index("date")["count"]
+    assert frequency.to_dict() == {2024: 3, 2023: 10}
@@ -0,0 +1,119 @@
+"""forest_arrays and the compact JavaScript export must predict exactly what sklearn does.
+
+Run with: python -m pytest "models/model training stuff"
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.cluster import KMeans
+from sklearn.ensemble import RandomForestRegressor
+
+import forest_arrays
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from export_to_js import export_compact_models  # noqa: E402
+
+N_FEATURES = 26
+
+PARITY_JS = r"""
+const EarthquakeModels = require(process.argv[2]);
+const models = EarthquakeModels.loadFile(process.argv[3]);
+const input = JSON.parse(require('fs').readFileSync(process.argv[4], 'utf8'));
+const forest = input.features.map(row => models.predictFeatures(row));
+const clusters = input.points.map(([lat, lon]) => models.assignCluster(lat, lon));
+const years = input.years.map(year => models.predictYear(year));
+console.log(JSON.stringify({ forest, clusters, years }));
+"""
+
+
+@pytest.fixture(scope="module")
+def forest():
+    # yearly counts like the cluster features: integers, a few hundred to a few thousand
+    rng = np.random.default_rng(0)
+    X = rng.integers(0, 3000, (40, N_FEATURES)).astype(np.float64)
+    y = X[:, :8].sum(axis=1) + rng.normal(0, 50, len(X))
+    return RandomForestRegressor(n_estimators=25, random_state=42).fit(X, y)
+
+
+def threshold_inputs(model, n=2000, seed=0):
+    """Feature rows that land on both sides of many split thresholds."""
+    rng = np.random.default_rng(seed)
+    X = np.empty((n, model.n_features_in_))
+    for j in range(model.n_features_in_):
+        thresholds = np.concatenate([e.tree_.threshold[e.tree_.feature == j] for e in model.estimators_])
+        X[:, j] = rng.choice(thresholds, n) + rng.normal(0, 1, n) if len(thresholds) else rng.uniform(0, 1000, n)
+    return np.rint(np.maximum(X, 0))
+
+
+def test_predict_matches_sklearn(forest):
+    X = threshold_inputs(forest)
+    arrays = forest_arrays.flatten_forest(forest)
+    assert np.array_equal(forest_arrays.predict(arrays, X), forest.predict(X))
+
+
+def test_tree_predictions_match_estimators(forest):
+    X = threshold_inputs(forest, n=300)
+    trees = forest_arrays.tree_predictions(forest_arrays.flatten_forest(forest), X)
+    expected = np.stack([tree.predict(X.astype(np.float32)) for tree in forest.estimators_])
+    assert np.array_equal(trees, expected)
+
+
+def test_written_arrays_round_trip_and_detect_corruption(forest, tmp_path):
+    path = str(tmp_path / "forest.arrays")
+    arrays = forest_arrays.flatten_forest(forest)
+    forest_arrays.write_arrays(path, arrays, {"kind": "random_forest"})
+
+    header, loaded = forest_arrays.read_arrays(path, verify=True)
+    assert header["kind"] == "random_forest"
+    for name, array in arrays.items():
+        assert loaded[name].dtype == array.dtype
+        assert np.array_equal(loaded[name], array)
+    X = threshold_inputs(forest, n=200)
+    assert np.array_equal(forest_arrays.predict(loaded, X), forest.predict(X))
+    del loaded
+
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+    with pytest.raises(ValueError):
+        forest_arrays.read_arrays(path, verify=True)
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_javascript_evaluator_matches_sklearn(forest, tmp_path):
+    rng = np.random.default_rng(1)
+    kmeans = KMeans(n_clusters=8, random_state=42, n_init=1).fit(
+        np.column_stack([rng.uniform(-60, 60, 500), rng.uniform(-180, 180, 500)]))
+    joblib.dump(forest, tmp_path / "forest.pkl")
+    joblib.dump(kmeans, tmp_path / "kmeans.pkl")
+    slope, intercept = 23.5, -44_000.0
+    (tmp_path / "frequency.json").write_text(json.dumps(
+        {"model_coefficients": {"slope": slope, "intercept": intercept}}))
+    (tmp_path / "cluster.json").write_text(json.dumps(
+        {"n_clusters": 8, "features": [f"f{i}" for i in range(N_FEATURES)]}))
+    bin_path, js_path = export_compact_models(str(tmp_path / "forest.pkl"), str(tmp_path / "kmeans.pkl"),
+                                              str(tmp_path / "frequency.json"), str(tmp_path / "cluster.json"),
+                                              str(tmp_path))
+
+    X = threshold_inputs(forest)
+    points = np.column_stack([rng.uniform(-90, 90, 1000), rng.uniform(-180, 180, 1000)])
+    years = rng.integers(1900, 2100, 200)
+    (tmp_path / "input.json").write_text(json.dumps(
+        {"features": X.tolist(), "points": points.tolist(), "years": years.tolist()}))
+    (tmp_path / "parity.js").write_text(PARITY_JS)
+    out = subprocess.run(["node", str(tmp_path / "parity.js"), os.path.abspath(js_path),
+                          os.path.abspath(bin_path), str(tmp_path / "input.json")],
+                         capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout)
+
+    assert np.array_equal(result["forest"], forest.predict(X))
+    assert np.array_equal(result["clusters"], kmeans.predict(points))
+    assert np.array_equal(result["years"], np.maximum(np.rint(slope * years + intercept), 0))
@@ -0,0 +1,60 @@
+"""Stage peaks from instrumentation must not disturb the process high-water mark.
+
+Run with: python -m pytest "models/model training stuff"
+"""
+import os
+import resource
+import time
+
+import numpy as np
+import pytest
+
+import instrumentation
+
+pytestmark = pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="needs Linux /proc")
+
+MB = 1 << 20
+
+
+def allocate(mb):
+    # np.ones touches every page, so it all counts towards RSS
+    return np.ones(mb * MB // 8)
+
+
+def maxrss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def above_peak(mb):
+    """Size of an allocation that sets a new process peak `mb` above the old one."""
+    return int(instrumentation.peak_rss_mb() - instrumentation._rss_mb("VmRSS:")) + mb
+
+
+def test_stage_peak_reaches_outer_maxrss():
+    size = above_peak(300)
+    before = maxrss_mb()
+    with instrumentation.stage("outer") as outer:
+        with instrumentation.stage("inner") as inner:
+            data = allocate(size)
+            del data
+        # a later nested stage must not hide the peak from the outer reads
+        with instrumentation.stage("after"):
+            pass
+    after = maxrss_mb()
+
+    assert after >= before + 270
+    assert instrumentation.peak_rss_mb() >= after - 1
+    assert inner["peak_is_exact"] and outer["peak_is_exact"]
+    assert inner["peak_rss_mb"] >= after - 1 and outer["peak_rss_mb"] >= after - 1
+
+
+def test_stage_below_the_process_peak_is_sampled():
+    # raise the process peak first, so the next stage cannot move it
+    allocate(above_peak(200))
+    with instrumentation.stage("held") as record:
+        data = allocate(100)
+        time.sleep(10 * instrumentation.SAMPLE_INTERVAL)
+        del data
+    assert not record["peak_is_exact"]
+    assert record["peak_rss_mb"] >= record["rss_start_mb"] + 90
+    assert record["peak_rss_mb"] < instrumentation.peak_rss_mb()
@@ -0,0 +1,57 @@
+"""MicroBatcher must keep one bad request from failing the others in its batch.
+
+Run with: python -m pytest "models/model training stuff"
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from prediction_service import HTTPError, MicroBatcher, _finite
+
+
+def doubled(values):
+    if (values < 0).any():
+        raise ValueError("negative input")
+    return values * 2
+
+
+def gather(batcher, items):
+    async def main():
+        return await asyncio.gather(*(batcher.submit(np.array(item)) for item in items),
+                                    return_exceptions=True)
+    return asyncio.run(main())
+
+
+def test_failing_batch_is_retried_item_by_item():
+    batcher = MicroBatcher(doubled, window=0.01)
+    first, bad, last = gather(batcher, [[1, 2], [-1], [3]])
+    assert batcher.batches == 1 and batcher.items == 3
+    assert first.tolist() == [2, 4] and last.tolist() == [6]
+    assert isinstance(bad, ValueError)
+
+
+def test_invalid_item_is_rejected_before_it_joins_the_batch():
+    calls = []
+    batcher = MicroBatcher(lambda values: calls.append(len(values)) or values, window=0.01, validate=_finite)
+    good, infinite, text = gather(batcher, [[1.5], [np.inf], ["a"]])
+    assert good.tolist() == [1.5]
+    assert isinstance(infinite, HTTPError) and infinite.status == 400
+    assert isinstance(text, HTTPError) and text.status == 400
+    assert calls == [1] and batcher.items == 1
+
+
+def test_single_item_batch_raises_its_own_error():
+    calls = []
+
+    def counted(values):
+        calls.append(len(values))
+        return doubled(values)
+
+    async def main():
+        return await MicroBatcher(counted).submit(np.array([-1]))
+
+    with pytest.raises(ValueError):
+        asyncio.run(main())
+    # not run a second time on its own
+    assert calls == [1]
@@ -1,32 +1,227 @@
 """Verify KMeans clustering on training.csv
 Print cluster centers, cluster sizes, and save the fitted model.
+
+--mode minibatch fits a MiniBatchKMeans chunk by chunk instead of loading every
+point, and --warm-start continues from the saved kmeans_model.pkl (e.g. with
+--years limited to the newly added events). --compare reports inertia and
+centroid drift against a full-batch fit. --metric geodesic clusters on the
+sphere with geo_cluster.GeoClusterIndex instead of on raw degrees.
+
+Coordinates come from the memory-mapped event_store when it exists, and a
+saved model labels the stored events so training can reuse the assignment.
 """
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from scipy.optimize import linear_sum_assignment
+import numpy as np
 import pandas as pd
 import joblib
 import os
+from catalog_store import load_training, store_exists, EVENTS_DIR
+from geo_cluster import GeoClusterIndex
+import event_store
+import instrumentation
+import model_artifacts
+
+N_CLUSTERS = 8
 
 def get_absolute_path(filename):
     return os.path.join(os.path.dirname(__file__), filename)
 
 
-def main():
-    path = get_absolute_path('training.csv')
-    df = pd.read_csv(path)
+def iter_coord_chunks(chunksize=100_000, years=None):
+    """Yield (n, 2) float arrays of latitude/longitude without loading the whole catalog."""
+    if event_store.exists():
+        yield from event_store.EventStore().iter_coords(chunksize, years)
+        return
+
+    if store_exists():
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(EVENTS_DIR, format="parquet", partitioning="hive")
+        condition = ds.field("date").isin([int(y) for y in years]) if years is not None else None
+        for batch in dataset.to_batches(columns=["latitude", "longitude"], filter=condition,
+                                        batch_size=chunksize):
+            coords = np.column_stack([batch.column(0).to_numpy(zero_copy_only=False),
+                                      batch.column(1).to_numpy(zero_copy_only=False)]).astype(np.float64)
+            coords = coords[~np.isnan(coords).any(axis=1)]
+            if len(coords):
+                yield coords
+        return
+
+    reader = pd.read_csv(get_absolute_path('training.csv'), usecols=['latitude', 'longitude', 'date'],
+                         chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            if years is not None:
+                chunk = chunk[chunk['date'].isin(list(years))]
+            coords = chunk[['latitude', 'longitude']].apply(pd.to_numeric, errors='coerce').dropna()
+            if len(coords):
+                yield coords.to_numpy()
+
+
+@instrumentation.stage("kmeans.fit_minibatch")
+def fit_minibatch(n_clusters=N_CLUSTERS, chunksize=100_000, years=None, init=None, counts=None):
+    """Fit MiniBatchKMeans with partial_fit over the catalog chunks.
+
+    With init and counts (the number of points each initial centre already
+    stands for) the fit continues from them: new points pull a centre in
+    proportion to how many it has seen, as if the history had been fed again.
+    """
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42,
+                             init=init if init is not None else 'k-means++',
+                             n_init=1 if init is not None else 3,
+                             # small clusters of a warm start keep their centre instead of being reseeded
+                             reassignment_ratio=0.0 if counts is not None else 0.01)
+    if init is not None and counts is not None and np.sum(counts) > 0:
+        # the history, summarized as each centre weighted by its size: every centre
+        # stays where it is and starts with its count
+        kmeans.partial_fit(np.asarray(init, dtype=np.float64), sample_weight=np.asarray(counts, dtype=np.float64))
+    # partial_fit needs at least n_clusters points per call, so small chunks are carried over
+    carry = None
+    for coords in iter_coord_chunks(chunksize, years):
+        coords = coords if carry is None else np.vstack([carry, coords])
+        if len(coords) < n_clusters:
+            carry = coords
+            continue
+        kmeans.partial_fit(coords)
+        carry = None
+    if carry is not None and hasattr(kmeans, 'cluster_centers_'):
+        kmeans.partial_fit(carry)
+    if not hasattr(kmeans, 'cluster_centers_'):
+        raise RuntimeError('not enough points to fit the clusters')
+    return kmeans
+
+
+@instrumentation.stage("kmeans.inertia")
+def chunked_inertia_and_sizes(centers, chunksize=100_000, years=None):
+    """Inertia and cluster sizes of `centers` over the catalog (or `years`), one chunk at a time."""
+    inertia = 0.0
+    sizes = np.zeros(len(centers), dtype=np.int64)
+    for coords in iter_coord_chunks(chunksize, years):
+        distances = ((coords[:, None, :] - centers[None, :, :]) ** 2).sum(axis=-1)
+        labels = distances.argmin(axis=1)
+        inertia += distances[np.arange(len(coords)), labels].sum()
+        sizes += np.bincount(labels, minlength=len(centers))
+    return inertia, sizes
+
+
+def centroid_drift(centers, reference):
+    """Distance of each centroid to its matched reference centroid (degrees)."""
+    cost = np.linalg.norm(centers[:, None, :] - reference[None, :, :], axis=-1)
+    rows, cols = linear_sum_assignment(cost)
+    return cost[rows, cols]
+
+
+def run_minibatch(n_clusters=N_CLUSTERS, chunksize=100_000, years=None, warm_start=False, compare=False):
+    out = get_absolute_path('kmeans_model.pkl')
+    init = counts = None
+    if warm_start:
+        previous = joblib.load(out)
+        init = np.asarray(previous.cluster_centers_, dtype=np.float64)
+        # the previous centres stand for every point outside the years being fed
+        previous_inertia, counts = chunked_inertia_and_sizes(init, chunksize)
+        if years is not None:
+            counts = counts - chunked_inertia_and_sizes(init, chunksize, years)[1]
+        else:
+            counts = np.zeros_like(counts)
+        print(f'Warm-starting from {out} ({int(counts.sum())} points already fitted)')
+
+    kmeans = fit_minibatch(n_clusters, chunksize, years, init, counts)
+    centers = np.asarray(kmeans.cluster_centers_, dtype=np.float64)
+    inertia, sizes = chunked_inertia_and_sizes(centers, chunksize)
+
+    print('Cluster sizes:')
+    for i, c in enumerate(sizes):
+        print(f'  Cluster {i}: {c} points')
+    print('\nCluster centers (latitude, longitude):')
+    for i, cen in enumerate(centers):
+        print(f'  Cluster {i}: {cen[0]:.6f}, {cen[1]:.6f}')
+    print(f'\nMini-batch inertia: {inertia:.1f}')
+
+    if warm_start:
+        drift = centroid_drift(centers, init)
+        print(f'Previous model inertia: {previous_inertia:.1f} '
+              f'(warm start is {100 * (inertia / previous_inertia - 1):+.2f}%)')
+        print(f'Centroid drift vs previous model: mean {drift.mean():.4f}°, max {drift.max():.4f}°')
+
+    if compare:
+        full = fit_full(load_coords(), n_clusters)
+        full_inertia, _ = chunked_inertia_and_sizes(full.cluster_centers_, chunksize)
+        drift = centroid_drift(centers, full.cluster_centers_)
+        print(f'Full-batch inertia: {full_inertia:.1f} '
+              f'(mini-batch is {100 * (inertia / full_inertia - 1):+.2f}%)')
+        print(f'Centroid drift vs full batch: mean {drift.mean():.4f}°, max {drift.max():.4f}°')
+
+    save_model(kmeans, out)
+    print(f"\nSaved MiniBatchKMeans model to: {out}")
+    return kmeans
+
+
+@instrumentation.stage("kmeans.save")
+def save_model(kmeans, out):
+    """Save a fitted model and its centroid artifact, and label the compact event store's events."""
+    joblib.dump(kmeans, out)
+    model_artifacts.export(kmeans, out)
+    if event_store.exists():
+        event_store.assign_clusters(kmeans.cluster_centers_)
+
+
+@instrumentation.stage("kmeans.load")
+def load_coords():
+    if event_store.exists():
+        store = event_store.EventStore()
+        df = pd.DataFrame({'latitude': store['latitude'], 'longitude': store['longitude'],
+                           'date': store['year']})
+    else:
+        df = load_training(columns=['latitude', 'longitude', 'date'])
 
     # Ensure columns
     if not {'latitude', 'longitude'}.issubset(df.columns):
-        raise RuntimeError('training.csv missing latitude/longitude columns')
+        raise RuntimeError('cleaned catalog missing latitude/longitude columns')
 
-    # Clean coords
-    df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
-    df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
+    # Clean coords (float64 even from the float32 store, so the saved model predicts on either)
+    df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce').astype('float64')
+    df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce').astype('float64')
+    rows_in = len(df)
     df = df.dropna(subset=['latitude','longitude'])
+    instrumentation.rows('coordinates', rows_in, len(df))
+    return df
+
 
-    n_clusters = 8
+@instrumentation.stage("kmeans.fit_full")
+def fit_full(df, n_clusters=N_CLUSTERS):
     kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    coords = df[['latitude','longitude']]
-    labels = kmeans.fit_predict(coords)
+    kmeans.fit(df[['latitude','longitude']].to_numpy())
+    return kmeans
+
+
+def run_geodesic(n_clusters=N_CLUSTERS):
+    df = load_coords()
+    with instrumentation.stage('kmeans.fit_geodesic', rows=len(df)):
+        index = GeoClusterIndex(n_clusters=n_clusters).fit(df['latitude'], df['longitude'])
+        labels, distance_km = index.assign(df['latitude'], df['longitude'])
+
+    print('Cluster sizes:')
+    for i, c in enumerate(np.bincount(labels, minlength=n_clusters)):
+        print(f'  Cluster {i}: {c} points')
+    print('\nCluster centers (latitude, longitude):')
+    for i, (lat, lon) in enumerate(index.cluster_centers_):
+        print(f'  Cluster {i}: {lat:.6f}, {lon:.6f}')
+    print(f'\nMean great-circle distance to centroid: {distance_km.mean():.1f} km')
+
+    out = get_absolute_path('geo_kmeans_model.pkl')
+    index.save(out)
+    print(f"\nSaved geodesic cluster index to: {out}")
+    return index
+
+
+def main():
+    df = load_coords()
+
+    n_clusters = N_CLUSTERS
+    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+    coords = df[['latitude','longitude']].to_numpy()
+    with instrumentation.stage('kmeans.fit_full', rows=len(coords)):
+        labels = kmeans.fit_predict(coords)
 
     df['cluster'] = labels
 
@@ -55,8 +250,26 @@ def main():
 
     # Save kmeans
     out = get_absolute_path('kmeans_model.pkl')
-    joblib.dump(kmeans, out)
+    save_model(kmeans, out)
     print(f"\nSaved KMeans model to: {out}")
 
 if __name__ == '__main__':
-    main()
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['full', 'minibatch'], default='full')
+    parser.add_argument('--metric', choices=['euclidean', 'geodesic'], default='euclidean')
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    parser.add_argument('--years', type=int, nargs='+', default=None,
+                        help='only feed these years to the mini-batch fit')
+    parser.add_argument('--warm-start', action='store_true',
+                        help='start from the centroids in kmeans_model.pkl')
+    parser.add_argument('--compare', action='store_true',
+                        help='report inertia and centroid drift against a full-batch fit')
+    args = parser.parse_args()
+
+    if args.metric == 'geodesic':
+        run_geodesic(N_CLUSTERS)
+    elif args.mode == 'minibatch':
+        run_minibatch(N_CLUSTERS, args.chunksize, args.years, args.warm_start, args.compare)
+    else:
+        main()